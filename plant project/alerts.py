@@ -0,0 +1,233 @@
+"""
+=============================================================================
+PLANT HEALTH TREND ALERTS
+=============================================================================
+Features:
+- Consumes the stream of analyze() results per plant
+- O(1) updates per result: EWMA mean/variance, rolling mean/variance over a
+  fixed ring buffer, one-sided CUSUM and a consecutive-worsening counter
+- Alerts on statistically significant deterioration of yellow / brown
+  ratios, green ratio, spot severity and score
+- Fixed-size state per plant (slotted objects + float32 ring buffers) and an
+  optional LRU cap on the number of tracked plants
+=============================================================================
+
+    engine = AlertEngine()
+    for plant_id, timestamp, result in stream:
+        for alert in engine.update(plant_id, result, timestamp):
+            print(alert.message)
+"""
+
+import math
+from array import array
+from collections import OrderedDict
+
+
+# metric -> (direction of deterioration, noise floor for the standard deviation)
+METRICS = {
+    'yellow': (+1, 0.5),
+    'brown': (+1, 0.5),
+    'green': (-1, 1.0),
+    'severity': (+1, 2.0),
+    'score': (-1, 1.0)
+}
+
+DEFAULT_WINDOW = 7          # rolling window (results)
+DEFAULT_ALPHA = 0.3         # EWMA weight of the newest result
+DEFAULT_Z = 3.0             # z-score of a single result against the rolling window
+DEFAULT_CUSUM_K = 0.5       # CUSUM slack (standard deviations)
+DEFAULT_CUSUM_H = 4.0       # CUSUM decision threshold (standard deviations)
+DEFAULT_TREND_RUN = 5       # consecutive worsening results
+MIN_SAMPLES = 3             # results before any statistical alert
+
+
+def result_metrics(result):
+    """Tracked metric values of an analyze() result dict or a results.AnalysisRecord"""
+    if isinstance(result, dict):
+        ratios, spots, health = result['ratios'], result['spots'], result['health']
+        return {
+            'yellow': ratios['yellow'], 'brown': ratios['brown'], 'green': ratios['green'],
+            'severity': spots['severity'], 'score': health['score']
+        }
+    return {
+        'yellow': result.ratios.yellow, 'brown': result.ratios.brown, 'green': result.ratios.green,
+        'severity': result.spots.severity, 'score': result.health.score
+    }
+
+
+class Alert:
+    """One deterioration alert"""
+
+    __slots__ = ("plant_id", "metric", "kind", "value", "baseline", "timestamp", "message")
+
+    def __init__(self, plant_id, metric, kind, value, baseline, timestamp, message):
+        self.plant_id = plant_id
+        self.metric = metric
+        self.kind = kind
+        self.value = value
+        self.baseline = baseline
+        self.timestamp = timestamp
+        self.message = message
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f"Alert({self.plant_id!r}, {self.message!r})"
+
+
+# =============================================================================
+# PER-METRIC ROLLING STATE
+# =============================================================================
+
+class MetricState:
+    """Rolling statistics of one metric for one plant, all updated in O(1)"""
+
+    __slots__ = ("buffer", "pos", "count", "total", "total_sq",
+                 "ewma", "ewvar", "cusum", "run", "last")
+
+    def __init__(self, window):
+        self.buffer = array('f', bytes(4 * window))
+        self.pos = 0
+        self.count = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.ewma = None
+        self.ewvar = 0.0
+        self.cusum = 0.0
+        self.run = 0
+        self.last = None
+
+    @property
+    def n(self):
+        return min(self.count, len(self.buffer))
+
+    def rolling_mean(self):
+        return self.total / self.n if self.n else 0.0
+
+    def rolling_var(self):
+        n = self.n
+        if n < 2:
+            return 0.0
+        return max(0.0, (self.total_sq - self.total * self.total / n) / (n - 1))
+
+    def push(self, x, alpha):
+        # Ring buffer: subtract the value falling out of the window
+        if self.count >= len(self.buffer):
+            old = self.buffer[self.pos]
+            self.total -= old
+            self.total_sq -= old * old
+        self.buffer[self.pos] = x
+        stored = self.buffer[self.pos]    # float32-rounded, so the later subtraction cancels exactly
+        self.total += stored
+        self.total_sq += stored * stored
+        self.pos = (self.pos + 1) % len(self.buffer)
+        self.count += 1
+
+        # Exponentially weighted mean and variance (West's incremental form)
+        if self.ewma is None:
+            self.ewma = x
+        else:
+            diff = x - self.ewma
+            incr = alpha * diff
+            self.ewma += incr
+            self.ewvar = (1 - alpha) * (self.ewvar + diff * incr)
+        self.last = x
+
+
+# =============================================================================
+# ENGINE
+# =============================================================================
+
+class AlertEngine:
+    """
+    Incremental alerting over per-plant result streams.
+
+    Three detectors run on every metric, each in the metric's worsening
+    direction:
+    - spike: the new value is `z` rolling standard deviations past the
+      rolling mean of the previous `window` results
+    - cusum: the one-sided CUSUM of deviations from the EWMA baseline
+      exceeds `cusum_h` standard deviations (slow, sustained drift)
+    - trend: the metric worsened `trend_run` times in a row
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW, alpha=DEFAULT_ALPHA, z=DEFAULT_Z, cusum_k=DEFAULT_CUSUM_K,
+                 cusum_h=DEFAULT_CUSUM_H, trend_run=DEFAULT_TREND_RUN, min_samples=MIN_SAMPLES,
+                 metrics=METRICS, max_plants=None):
+        self.window = window
+        self.alpha = alpha
+        self.z = z
+        self.cusum_k = cusum_k
+        self.cusum_h = cusum_h
+        self.trend_run = trend_run
+        self.min_samples = min_samples
+        self.metrics = metrics
+        self.max_plants = max_plants
+        self.plants = OrderedDict()
+
+    def _state(self, plant_id):
+        states = self.plants.get(plant_id)
+        if states is None:
+            states = {m: MetricState(self.window) for m in self.metrics}
+            self.plants[plant_id] = states
+            if self.max_plants is not None and len(self.plants) > self.max_plants:
+                self.plants.popitem(last=False)    # least recently updated plant
+        else:
+            self.plants.move_to_end(plant_id)
+        return states
+
+    def update(self, plant_id, result, timestamp=None):
+        """Feed one result; returns the alerts it triggers"""
+        states = self._state(plant_id)
+        alerts = []
+        for metric, value in result_metrics(result).items():
+            if metric in states:
+                alerts.extend(self._update_metric(plant_id, metric, states[metric], float(value), timestamp))
+        return alerts
+
+    def _update_metric(self, plant_id, metric, s, x, timestamp):
+        direction, floor = self.metrics[metric]
+        alerts = []
+
+        def alert(kind, baseline, text):
+            alerts.append(Alert(plant_id, metric, kind, x, baseline, timestamp, f"{plant_id}: {metric} {text}"))
+
+        if s.count >= self.min_samples:
+            # Spike against the previous window (before x is added)
+            mean, std = s.rolling_mean(), max(math.sqrt(s.rolling_var()), floor)
+            if direction * (x - mean) / std > self.z:
+                alert("spike", mean, f"jumped to {x:.2f} (window mean {mean:.2f}, {abs(x - mean) / std:.1f} sd)")
+
+            # CUSUM against the EWMA baseline
+            base, sd = s.ewma, max(math.sqrt(s.ewvar), floor)
+            s.cusum = max(0.0, s.cusum + direction * (x - base) / sd - self.cusum_k)
+            if s.cusum > self.cusum_h:
+                alert("cusum", base, f"drifting: {x:.2f} vs baseline {base:.2f} (CUSUM {s.cusum:.1f})")
+                s.cusum = 0.0
+
+        if s.last is not None:
+            s.run = s.run + 1 if direction * (x - s.last) > 0 else 0
+            if s.run >= self.trend_run:
+                alert("trend", s.last, f"worsened {s.run} results in a row (now {x:.2f})")
+                s.run = 0
+
+        s.push(x, self.alpha)
+        return alerts
+
+    def summary(self, plant_id):
+        """Current statistics of one plant: {metric: {...}}"""
+        return {
+            metric: {
+                'last': s.last, 'ewma': s.ewma, 'ewm_std': math.sqrt(s.ewvar),
+                'rolling_mean': s.rolling_mean(), 'rolling_std': math.sqrt(s.rolling_var()),
+                'cusum': s.cusum, 'run': s.run, 'samples': s.count
+            }
+            for metric, s in self.plants[plant_id].items()
+        }
+
+    def consume(self, stream):
+        """Generator over alerts from an iterable of (plant_id, timestamp, result)"""
+        for plant_id, timestamp, result in stream:
+            if result is not None:
+                yield from self.update(plant_id, result, timestamp)
@@ -0,0 +1,234 @@
+"""
+=============================================================================
+MEMORY-MAPPED ARTIFACT STORE
+=============================================================================
+Features:
+- Per-image masks (bit-packed), damage maps and LBP codes for batch runs
+- Preallocated memory-mapped files + fixed-size offset index
+- Zero-copy reads of any single image's artifacts
+=============================================================================
+
+Layout of a store directory:
+    masks.bin   - np.packbits of the g / y / b / fg masks, back to back
+    damage.bin  - uint8 damage map (H x W)
+    lbp.bin     - uint8 uniform-LBP codes (H x W, values 0-25)
+    index.bin   - one INDEX_DTYPE record per image
+    meta.json   - record count and bytes used per data file
+"""
+
+import json
+import os
+
+import numpy as np
+
+from pipeline import RESULT_ARTIFACTS
+
+
+MASK_KEYS = ("g", "y", "b", "fg")
+
+INDEX_DTYPE = np.dtype([
+    ("image_id", "S120"),
+    ("h", "<u2"),
+    ("w", "<u2"),
+    ("mask_off", "<u8"),
+    ("damage_off", "<u8"),
+    ("lbp_off", "<u8")
+])
+
+# analyze() resizes to at most 800 x 600
+DEFAULT_MAX_PIXELS = 800 * 600
+
+_DATA_FILES = ("masks", "damage", "lbp")
+
+# analyze() outputs add_result reads from processing_steps (damage map, LBP codes, foreground)
+STORE_OUTPUTS = tuple(dict.fromkeys(RESULT_ARTIFACTS + ("damage", "lbp_img", "fg_mask")))
+
+
+def _encode_id(image_id):
+    """UTF-8 image id cut to the index field on a character boundary"""
+    data = str(image_id).encode("utf-8")[:INDEX_DTYPE["image_id"].itemsize]
+    return data.decode("utf-8", errors="ignore").encode("utf-8")
+
+
+def _packed_size(h, w):
+    return (h * w + 7) // 8
+
+
+class _GrowableMap:
+    """Byte-addressed memmap that doubles its file size when full"""
+
+    def __init__(self, path, capacity):
+        self.path = path
+        with open(path, "wb") as f:
+            f.truncate(capacity)     # sparse on most filesystems
+        self.capacity = capacity
+        self.mm = np.memmap(path, dtype=np.uint8, mode="r+", shape=(capacity,))
+
+    def ensure(self, size):
+        if size <= self.capacity:
+            return
+        new_capacity = max(size, self.capacity * 2)
+        self.mm.flush()
+        del self.mm
+        with open(self.path, "r+b") as f:
+            f.truncate(new_capacity)
+        self.capacity = new_capacity
+        self.mm = np.memmap(self.path, dtype=np.uint8, mode="r+", shape=(self.capacity,))
+
+    def write(self, offset, data):
+        self.ensure(offset + data.nbytes)
+        self.mm[offset:offset + data.nbytes] = data.reshape(-1).view(np.uint8)
+
+    def flush(self):
+        self.mm.flush()
+
+
+# =============================================================================
+# WRITER
+# =============================================================================
+
+class ArtifactWriter:
+    """
+    Appends per-image artifacts to a store directory.
+
+    `capacity` is the expected number of images; files are preallocated for it
+    (sparsely) and grow by doubling if exceeded.
+    """
+
+    def __init__(self, directory, capacity=1000, max_pixels=DEFAULT_MAX_PIXELS):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        capacity = max(1, capacity)
+        per_image = {
+            "masks": len(MASK_KEYS) * _packed_size(max_pixels, 1),
+            "damage": max_pixels,
+            "lbp": max_pixels
+        }
+        self.files = {
+            name: _GrowableMap(os.path.join(directory, f"{name}.bin"), capacity * per_image[name])
+            for name in _DATA_FILES
+        }
+        self.index = _GrowableMap(os.path.join(directory, "index.bin"), capacity * INDEX_DTYPE.itemsize)
+        self.offsets = dict.fromkeys(_DATA_FILES, 0)
+        self.count = 0
+
+    def add(self, image_id, masks, damage, lbp):
+        """Store one image; `masks` maps MASK_KEYS to H x W arrays (nonzero = set)"""
+        h, w = damage.shape[:2]
+        record = np.zeros(1, INDEX_DTYPE)
+        record["image_id"] = _encode_id(image_id)
+        record["h"], record["w"] = h, w
+
+        packed = np.concatenate([np.packbits(masks[k].reshape(-1) > 0) for k in MASK_KEYS])
+        codes = np.clip(lbp, 0, 255).astype(np.uint8) if lbp.dtype != np.uint8 else lbp
+
+        for name, data in (("masks", packed), ("damage", damage), ("lbp", codes)):
+            off = self.offsets[name]
+            self.files[name].write(off, np.ascontiguousarray(data))
+            record[f"{'mask' if name == 'masks' else name}_off"] = off
+            self.offsets[name] = off + data.nbytes
+
+        self.index.write(self.count * INDEX_DTYPE.itemsize, record)
+        self.count += 1
+        return self.count - 1
+
+    def add_result(self, image_id, result, processing_steps):
+        """Store the artifacts of an analyze() call"""
+        masks = dict(result['masks'])
+        masks["fg"] = processing_steps['fg_mask']
+        return self.add(image_id, masks, processing_steps['damage'], processing_steps['lbp'])
+
+    def flush(self):
+        for mm in (*self.files.values(), self.index):
+            mm.flush()
+        meta = {"count": self.count, "offsets": self.offsets, "mask_keys": list(MASK_KEYS)}
+        with open(os.path.join(self.directory, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# =============================================================================
+# READER
+# =============================================================================
+
+class ImageArtifacts:
+    """Views into the store for one image; damage/lbp/packed masks are zero-copy"""
+
+    __slots__ = ("image_id", "shape", "damage", "lbp", "packed_masks")
+
+    def __init__(self, image_id, shape, damage, lbp, packed_masks):
+        self.image_id = image_id
+        self.shape = shape
+        self.damage = damage
+        self.lbp = lbp
+        self.packed_masks = packed_masks
+
+    def mask(self, key):
+        """Unpack one mask to uint8 0/255"""
+        n = _packed_size(*self.shape)
+        i = MASK_KEYS.index(key)
+        bits = np.unpackbits(self.packed_masks[i * n:(i + 1) * n], count=self.shape[0] * self.shape[1])
+        return (bits.reshape(self.shape) * 255).astype(np.uint8)
+
+
+class ArtifactReader:
+    """Read-only access to a store written by ArtifactWriter"""
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.count = self.meta["count"]
+        self.maps = {
+            name: np.memmap(os.path.join(directory, f"{name}.bin"), dtype=np.uint8, mode="r")
+            for name in _DATA_FILES
+        }
+        self.index = np.memmap(os.path.join(directory, "index.bin"), dtype=INDEX_DTYPE, mode="r")[:self.count]
+        self._ids = None
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if not -self.count <= i < self.count:
+            raise IndexError(i)
+        rec = self.index[i]
+        h, w = int(rec["h"]), int(rec["w"])
+        n = h * w
+        mo, do, lo = int(rec["mask_off"]), int(rec["damage_off"]), int(rec["lbp_off"])
+        return ImageArtifacts(
+            rec["image_id"].decode("utf-8", errors="ignore"),
+            (h, w),
+            self.maps["damage"][do:do + n].reshape(h, w),
+            self.maps["lbp"][lo:lo + n].reshape(h, w),
+            self.maps["masks"][mo:mo + len(MASK_KEYS) * _packed_size(h, w)]
+        )
+
+    def find(self, image_id):
+        """Artifacts by image id (index built on first call)"""
+        if self._ids is None:
+            self._ids = {rec.decode("utf-8", errors="ignore"): i for i, rec in enumerate(self.index["image_id"])}
+        return self[self._ids[_encode_id(image_id).decode("utf-8")]]
+
+
+def store_batch(directory, paths, analyzer, use_grabcut=False):
+    """Analyze images and stream their artifacts to disk; returns the analyze results without masks"""
+    from PIL import Image
+
+    results = []
+    with ArtifactWriter(directory, capacity=len(paths)) as writer:
+        for path in paths:
+            with Image.open(path) as img:
+                result = analyzer.analyze(img.convert('RGB'), use_grabcut, outputs=STORE_OUTPUTS)
+            if result is None:
+                continue
+            writer.add_result(path, result, analyzer.processing_steps)
+            results.append({k: v for k, v in result.items() if k != 'masks'})
+    return results
@@ -0,0 +1,337 @@
+"""
+=============================================================================
+CAMERA CALIBRATION PROFILES
+=============================================================================
+Features:
+- Per-camera profile computed once from a gray-card or ColorChecker frame
+- White-balance gains (1D table) plus an optional color-correction matrix
+  baked into a 3D lookup table
+- Per-frame correction is a single table lookup (no per-image Gray World)
+- Drift detection on neutral regions only: a gray card left in view is
+  re-measured each frame and the gains recalibrated from it; a configured
+  background region (wall, bench) that drifts only flags the profile.
+  The plants themselves are never used, so yellowing is not "drift"
+=============================================================================
+
+    profile = calibrate_gray_card(cv2.imread("card.jpg"), roi=(40, 40, 80, 80), camera_id="greenhouse-1",
+                                  neutral_roi=(700, 20, 80, 60))
+    profile.save("profiles/greenhouse-1.npz")
+    analyzer = UltimatePlantAnalyzer(calibration=CalibratedBalancer(profile))
+"""
+
+import json
+import os
+
+import cv2
+import numpy as np
+
+
+# 3D LUT resolution: 6 bits per channel -> 64^3 packed entries (1 MB)
+LUT_BITS = 6
+
+DRIFT_THRESHOLD = 0.02     # chromaticity shift (fraction of the channel sum)
+DRIFT_PATIENCE = 5         # consecutive drifting frames before acting
+DRIFT_ALPHA = 0.2          # EWMA weight of the newest frame
+MIN_CARD_LEVEL = 8.0       # darker card means (any channel) are occlusion / a bad ROI, not drift
+
+# X-Rite ColorChecker Classic, sRGB (R, G, B), row by row from "dark skin" to "black"
+COLORCHECKER_SRGB = [
+    (115, 82, 68), (194, 150, 130), (98, 122, 157), (87, 108, 67), (133, 128, 177), (103, 189, 170),
+    (214, 126, 44), (80, 91, 166), (193, 90, 99), (94, 60, 108), (157, 188, 64), (224, 163, 46),
+    (56, 61, 150), (70, 148, 73), (175, 54, 60), (231, 199, 31), (187, 86, 149), (8, 133, 161),
+    (243, 243, 242), (200, 200, 200), (160, 160, 160), (122, 122, 121), (85, 85, 85), (52, 52, 52)
+]
+COLORCHECKER_GRID = (6, 4)              # columns, rows
+COLORCHECKER_NEUTRALS = range(18, 24)   # bottom row
+
+
+def chromaticity(bgr_mean):
+    """(b, g, r) means -> fractions summing to 1"""
+    m = np.asarray(bgr_mean[:3], dtype=np.float64)
+    return m / max(m.sum(), 1e-6)
+
+
+def neutral_gains(bgr_mean):
+    """Per-channel gains that make a gray patch neutral (B, G, R order)"""
+    m = np.asarray(bgr_mean[:3], dtype=np.float64)
+    return m.mean() / np.maximum(m, 1e-6)
+
+
+def _roi_mean(img, roi):
+    x, y, w, h = roi
+    crop = img[y:y + h, x:x + w]
+    if crop.size == 0:
+        return None
+    return cv2.mean(crop)[:3]
+
+
+def card_fraction(roi, shape):
+    """Pixel ROI (x, y, w, h) of a frame with `shape` -> fractions of the frame size"""
+    x, y, w, h = roi
+    fh, fw = shape[:2]
+    return (x / fw, y / fh, w / fw, h / fh)
+
+
+def card_pixels(card_roi, shape):
+    """Fractional card ROI -> pixel ROI in a frame of `shape` (at least 1 x 1)"""
+    fx, fy, fw, fh = card_roi
+    h, w = shape[:2]
+    x, y = int(round(fx * w)), int(round(fy * h))
+    return x, y, max(1, int(round(fw * w))), max(1, int(round(fh * h)))
+
+
+def card_mean(img, card_roi):
+    """Mean BGR of the card in `img`, or None if the ROI is empty or (nearly) black"""
+    mean = _roi_mean(img, card_pixels(card_roi, img.shape))
+    if mean is None or min(mean) < MIN_CARD_LEVEL:
+        return None
+    return mean
+
+
+def _gain_table(gains):
+    """256-entry per-channel table for cv2.LUT"""
+    levels = np.arange(256, dtype=np.float64)
+    return np.clip(levels[:, None] * gains, 0, 255).astype(np.uint8).reshape(1, 256, 3)
+
+
+# =============================================================================
+# PROFILE
+# =============================================================================
+
+class CalibrationProfile:
+    """White-balance gains and optional color-correction matrix for one camera"""
+
+    def __init__(self, camera_id, gains, ccm=None, reference=None, card_roi=None, lut_bits=LUT_BITS,
+                 neutral_roi=None):
+        self.camera_id = camera_id
+        self.gains = np.asarray(gains, dtype=np.float64)
+        self.ccm = None if ccm is None else np.asarray(ccm, dtype=np.float64)
+        # Corrected chromaticity of the neutral region in the calibration frame
+        self.reference = None if reference is None else np.asarray(reference, dtype=np.float64)
+        # Fractions of the frame size: card and neutral region are measured on resized analysis frames
+        self.card_roi = None if card_roi is None else tuple(float(v) for v in card_roi)
+        self.neutral_roi = None if neutral_roi is None else tuple(float(v) for v in neutral_roi)
+        self.lut_bits = lut_bits
+        self._build_tables()
+
+    def _build_tables(self):
+        self.lut1d = _gain_table(self.gains)
+        self.lut3d = None
+        if self.ccm is not None:
+            # Cell centres of the quantized cube, gains then the 3x4 affine matrix (BGR in, BGR out)
+            n = 1 << self.lut_bits
+            step = 256 / n
+            centres = np.arange(n) * step + (step - 1) / 2
+            b, g, r = np.meshgrid(centres, centres, centres, indexing="ij")
+            bgr = np.stack([b, g, r], axis=-1).reshape(-1, 3) * self.gains
+            out = np.hstack([bgr, np.ones((len(bgr), 1))]) @ self.ccm.T
+            out = np.clip(np.round(out), 0, 255).astype(np.uint32)
+            # One packed 32-bit B | G << 8 | R << 16 word per cell: a single gather per pixel
+            self.lut3d = out[:, 0] | (out[:, 1] << 8) | (out[:, 2] << 16)
+
+    def with_gains(self, gains):
+        """Copy with new white-balance gains (recalibration keeps the color matrix)"""
+        return CalibrationProfile(self.camera_id, gains, self.ccm, self.reference, self.card_roi, self.lut_bits,
+                                  self.neutral_roi)
+
+    def correct(self, img):
+        """Apply the profile to a BGR uint8 frame with one table lookup"""
+        if self.lut3d is None:
+            return cv2.LUT(img, self.lut1d)
+        q = np.right_shift(img, 8 - self.lut_bits)
+        idx = q[..., 0].astype(np.uint32) << (2 * self.lut_bits)
+        idx |= q[..., 1].astype(np.uint32) << self.lut_bits
+        idx |= q[..., 2]
+        bgra = np.take(self.lut3d, idx).view(np.uint8).reshape(img.shape[0], img.shape[1], 4)
+        return cv2.cvtColor(bgra, cv2.COLOR_BGRA2BGR)
+
+    def save(self, path):
+        meta = {"camera_id": self.camera_id, "card_roi": self.card_roi, "lut_bits": self.lut_bits,
+                "neutral_roi": self.neutral_roi}
+        arrays = {"gains": self.gains, "meta": np.array(json.dumps(meta))}
+        if self.ccm is not None:
+            arrays["ccm"] = self.ccm
+        if self.reference is not None:
+            arrays["reference"] = self.reference
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        meta = json.loads(str(data["meta"]))
+        return cls(meta["camera_id"], data["gains"],
+                   data["ccm"] if "ccm" in data else None,
+                   data["reference"] if "reference" in data else None,
+                   meta["card_roi"], meta["lut_bits"], meta.get("neutral_roi"))
+
+
+def load_profiles(directory):
+    """{camera_id: CalibrationProfile} for every .npz profile in a directory"""
+    profiles = {}
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".npz"):
+            profile = CalibrationProfile.load(os.path.join(directory, name))
+            profiles[profile.camera_id] = profile
+    return profiles
+
+
+# =============================================================================
+# CALIBRATION FROM A REFERENCE FRAME
+# =============================================================================
+
+def neutral_reference(profile, img, neutral_roi):
+    """
+    Set `profile.neutral_roi` (x, y, w, h, pixels of `img`): a background region
+    without plants that stays in view, watched for drift when there is no card.
+    """
+    profile.neutral_roi = card_fraction(neutral_roi, img.shape)
+    mean = card_mean(profile.correct(img), profile.neutral_roi)
+    if mean is None:
+        raise ValueError(f"Neutral ROI {neutral_roi} is empty or too dark for a {img.shape[1]} x {img.shape[0]} frame")
+    profile.reference = chromaticity(mean)
+    return profile
+
+
+def calibrate_gray_card(img, roi, camera_id="default", keep_card=False, neutral_roi=None):
+    """
+    Profile from a frame with a gray card at `roi` (x, y, w, h, pixels of `img`).
+    `keep_card=True` if the card stays in view: it is then used for drift checks.
+    Otherwise `neutral_roi` can name a background region to watch instead.
+    """
+    card_roi = card_fraction(roi, img.shape)
+    mean = card_mean(img, card_roi)
+    if mean is None:
+        raise ValueError(f"Gray card ROI {roi} is empty or too dark for a {img.shape[1]} x {img.shape[0]} frame")
+    profile = CalibrationProfile(camera_id, neutral_gains(mean), card_roi=card_roi if keep_card else None)
+    return neutral_reference(profile, img, neutral_roi) if neutral_roi is not None else profile
+
+
+def checker_patch_means(img, rect, grid=COLORCHECKER_GRID):
+    """Mean BGR of each ColorChecker patch; `rect` (x, y, w, h) bounds the patch grid"""
+    x, y, w, h = rect
+    cols, rows = grid
+    cw, ch = w / cols, h / rows
+    means = []
+    for row in range(rows):
+        for col in range(cols):
+            # Centre half of the cell: avoids the black borders between patches
+            px, py = int(x + (col + 0.25) * cw), int(y + (row + 0.25) * ch)
+            means.append(_roi_mean(img, (px, py, max(1, int(cw / 2)), max(1, int(ch / 2)))))
+    return np.array(means)
+
+
+def calibrate_color_checker(img, rect, camera_id="default", reference_srgb=COLORCHECKER_SRGB, neutral_roi=None):
+    """Profile with gains from the neutral row and a least-squares 3x4 color matrix over all patches"""
+    measured = checker_patch_means(img, rect)
+    neutrals = measured[list(COLORCHECKER_NEUTRALS)]
+    gains = neutral_gains(neutrals.mean(axis=0))
+
+    target = np.asarray(reference_srgb, dtype=np.float64)[:, ::-1]    # RGB -> BGR
+    src = np.hstack([measured * gains, np.ones((len(measured), 1))])
+    ccm, *_ = np.linalg.lstsq(src, target, rcond=None)
+
+    profile = CalibrationProfile(camera_id, gains, ccm.T)
+    return neutral_reference(profile, img, neutral_roi) if neutral_roi is not None else profile
+
+
+# =============================================================================
+# PER-CAMERA RUNTIME WITH DRIFT DETECTION
+# =============================================================================
+
+class CalibratedBalancer:
+    """
+    Applies a profile frame by frame and watches for drift.
+
+    With a card ROI the card's chromaticity after correction should stay
+    neutral; after DRIFT_PATIENCE drifting frames the gains are re-measured
+    from the card (automatic recalibration). Without a card the EWMA of the
+    neutral region's chromaticity is compared with the calibration frame;
+    sustained drift sets `needs_recalibration`, which is reported but does
+    not change the correction until recalibrate() installs a new profile.
+    Without either, drift is not measured: whole-frame color follows the
+    plants, so yellowing or browning would look like a lighting change.
+    """
+
+    def __init__(self, profile, threshold=DRIFT_THRESHOLD, patience=DRIFT_PATIENCE, alpha=DRIFT_ALPHA):
+        self.profile = profile
+        self.threshold = threshold
+        self.patience = patience
+        self.alpha = alpha
+        self.ewma = None
+        self.drifting = 0
+        self.needs_recalibration = False
+        self.recalibrations = 0
+        self.frames = 0
+
+    @property
+    def camera_id(self):
+        return self.profile.camera_id
+
+    def drift(self, img):
+        """Current drift measure for an uncorrected frame of any size (max chromaticity deviation)"""
+        if self.profile.card_roi is not None:
+            mean = card_mean(img, self.profile.card_roi)
+            if mean is None:
+                return 0.0    # card hidden or unreadable: no evidence of drift
+            card = chromaticity(np.asarray(mean) * self.profile.gains)
+            return float(np.abs(card - 1 / 3).max())
+        if self.profile.neutral_roi is None or self.profile.reference is None:
+            return 0.0
+        # Only the region is corrected: the full frame is corrected once, in correct()
+        x, y, w, h = card_pixels(self.profile.neutral_roi, img.shape)
+        region = img[y:y + h, x:x + w]
+        mean = card_mean(self.profile.correct(region), (0, 0, 1, 1)) if region.size else None
+        if mean is None:
+            return 0.0 if self.ewma is None else float(np.abs(self.ewma - self.profile.reference).max())
+        region = chromaticity(mean)
+        self.ewma = region if self.ewma is None else self.alpha * region + (1 - self.alpha) * self.ewma
+        return float(np.abs(self.ewma - self.profile.reference).max())
+
+    def correct(self, img):
+        self.frames += 1
+        self.drifting = self.drifting + 1 if self.drift(img) > self.threshold else 0
+        if self.drifting >= self.patience:
+            self.drifting = 0
+            if self.profile.card_roi is not None:
+                mean = card_mean(img, self.profile.card_roi)
+                if mean is not None:
+                    self.profile = self.profile.with_gains(neutral_gains(mean))
+                    self.recalibrations += 1
+            else:
+                self.needs_recalibration = True
+        return self.profile.correct(img)
+
+    def recalibrate(self, profile):
+        """Install a fresh profile (e.g. from a new reference frame)"""
+        self.profile = profile
+        self.ewma = None
+        self.drifting = 0
+        self.needs_recalibration = False
+        self.recalibrations += 1
+
+
+if __name__ == "__main__":
+    import argparse
+
+    def box(text):
+        return tuple(int(v) for v in text.split(","))
+
+    parser = argparse.ArgumentParser(description="Create a camera calibration profile from a reference frame")
+    parser.add_argument("image")
+    parser.add_argument("-c", "--camera", required=True)
+    parser.add_argument("-o", "--output", required=True, help="profile .npz path")
+    ref = parser.add_mutually_exclusive_group(required=True)
+    ref.add_argument("--gray-card", type=box, metavar="X,Y,W,H")
+    ref.add_argument("--checker", type=box, metavar="X,Y,W,H", help="bounds of the 6 x 4 patch grid")
+    parser.add_argument("--keep-card", action="store_true", help="card stays in view: use it for drift checks")
+    parser.add_argument("--neutral", type=box, metavar="X,Y,W,H",
+                        help="plant-free background region to watch for drift (when the card is not kept)")
+    args = parser.parse_args()
+
+    frame = cv2.imread(args.image)
+    if args.checker:
+        prof = calibrate_color_checker(frame, args.checker, args.camera, neutral_roi=args.neutral)
+    else:
+        prof = calibrate_gray_card(frame, args.gray_card, args.camera, args.keep_card, args.neutral)
+    prof.save(args.output)
+    print(f"{args.camera}: gains (B, G, R) = {np.round(prof.gains, 3).tolist()} -> {args.output}")
@@ -0,0 +1,329 @@
+"""
+=============================================================================
+CHANGE DETECTION FOR FIXED CAMERAS
+=============================================================================
+Features:
+- Each new frame is registered to the camera's reference frame (ECC /
+  ORB, see lesions.py) and warped into reference coordinates, so cached
+  results stay aligned when the camera or plant shifts slightly
+- Per-pixel change mask over the HSV class labels (foreground / green /
+  yellow / brown), cleaned of single-pixel flicker and summed per tile
+- Only changed tiles are re-measured: class counts (ratios), damage map
+  and LBP histogram in those tiles and their neighbours, spots touching
+  them; every other tile reuses its cached result
+- Ratio deltas against the previous frame, per frame and per changed tile
+=============================================================================
+
+    detector = ChangeDetector()
+    for img in camera_frames:
+        result = detector.update(img)
+        print(result['change']['changed_tiles'], result['change']['ratio_delta'])
+"""
+
+import cv2
+import numpy as np
+
+try:
+    from skimage.feature import local_binary_pattern
+    HAS_SKIMAGE = True
+except ImportError:
+    HAS_SKIMAGE = False
+
+from lesions import REGISTRATION_METHODS, register_frames
+from pipeline import DEFAULT_PIPELINE, FULL_SIZE, analysis_scale
+
+
+TILE = 64                     # tile edge (analysis pixels)
+MIN_CHANGED_FRACTION = 0.01   # a tile is re-measured once this fraction of its pixels changed class
+ALIGN_TOLERANCE_PX = 0.5      # smaller estimated motion is treated as none (no resampling blur)
+DAMAGE_PAD = 7                # heatmap Gaussian (15 x 15) radius
+LBP_PAD = 4                   # LBP radius 3 plus bilinear interpolation
+LBP_BINS = 26
+MIN_SPOT_AREA = 20            # full-resolution pixels, as analyze_disease_spots
+
+# Bits of the class label map
+FG, GREEN, YELLOW, BROWN = 1, 2, 4, 8
+CLASS_BITS = (('green', GREEN), ('yellow', YELLOW), ('brown', BROWN))
+
+CHANGE_OUTPUTS = ("original", "gray", "fg_mask", "g_mask", "y_mask", "b_mask")
+
+
+def class_labels(fg_mask, g_mask, y_mask, b_mask):
+    """Bitwise class label map; the class masks may overlap, so each class has its own bit"""
+    labels = (fg_mask > 0).astype(np.uint8)
+    for mask, bit in ((g_mask, GREEN), (y_mask, YELLOW), (b_mask, BROWN)):
+        labels |= (mask > 0).astype(np.uint8) * bit
+    return labels
+
+
+def tile_sums(mask, tile):
+    """Number of non-zero pixels in each tile (rows x cols grid, edge tiles may be partial)"""
+    h, w = mask.shape
+    rows, cols = -(-h // tile), -(-w // tile)
+    padded = np.zeros((rows * tile, cols * tile), np.int32)
+    padded[:h, :w] = mask > 0
+    return padded.reshape(rows, tile, cols, tile).sum(axis=(1, 3))
+
+
+# =============================================================================
+# DETECTOR
+# =============================================================================
+
+class ChangeDetector:
+    """
+    Incremental analysis of one fixed camera. The detector keeps a
+    composite of the class labels and gray image in which a tile is only
+    replaced once enough of it changed; all results are those of the
+    composite, re-measured only where it was replaced. Edge density is
+    not computed. A frame that cannot be registered starts a new reference.
+    """
+
+    def __init__(self, analyzer=None, tile=TILE, min_changed=MIN_CHANGED_FRACTION, registration="ecc",
+                 use_grabcut=False, max_size=FULL_SIZE):
+        if registration not in REGISTRATION_METHODS:
+            raise ValueError(f"Unknown registration method '{registration}', expected one of {REGISTRATION_METHODS}")
+        if analyzer is None:
+            from plant_care_system import UltimatePlantAnalyzer
+            analyzer = UltimatePlantAnalyzer()
+        self.an = analyzer
+        self.tile = tile
+        self.min_changed = min_changed
+        self.registration = registration
+        self.options = {'use_grabcut': use_grabcut, 'max_size': max_size}
+        self.scale = analysis_scale(self.options)
+        self.frames = 0
+        self.reset()
+
+    def reset(self):
+        """Forget the reference: the next frame is measured in full"""
+        self.ref_gray = None
+        self.labels = None            # composite class labels
+        self.gray = None              # composite (segmented) gray image
+        self.counts = None            # (rows, cols, 4) fg / green / yellow / brown pixels per tile
+        self.lbp_counts = None        # (rows, cols, LBP_BINS) LBP code counts per tile
+        self.damage = None            # blurred, unnormalized damage map
+        self.spot_cache = {}          # component (x, y, w, h, area) -> (size, type) or None
+        self.prev_ratios = None
+
+    # -------------------------------------------------------------------------
+    # Alignment
+    # -------------------------------------------------------------------------
+
+    def _align(self, image):
+        """(RGB frame in reference coordinates, valid-pixel mask or None, warp, registered)"""
+        original = DEFAULT_PIPELINE.run(self.an, {'image': image}, outputs=("original",),
+                                        options=self.options)['original']
+        gray = cv2.cvtColor(original, cv2.COLOR_BGR2GRAY)
+        rgb = cv2.cvtColor(original, cv2.COLOR_BGR2RGB)
+        if self.ref_gray is None or self.ref_gray.shape != gray.shape:
+            self.reset()
+            self.ref_gray = gray
+            return rgb, None, np.eye(2, 3, dtype=np.float32), True
+
+        warp, registered = register_frames(self.ref_gray, gray, self.registration)
+        if not registered:
+            self.reset()
+            self.ref_gray = gray
+            return rgb, None, warp, False
+        motion = np.abs(warp[:, 2]).max() + np.abs(warp[:, :2] - np.eye(2)).max() * max(gray.shape)
+        if motion < ALIGN_TOLERANCE_PX:
+            return rgb, None, warp, True
+
+        # warp maps reference -> frame coordinates: sample the frame at warp(x)
+        h, w = gray.shape
+        flags = cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP
+        aligned = cv2.warpAffine(rgb, warp, (w, h), flags=flags, borderMode=cv2.BORDER_REPLICATE)
+        valid = cv2.warpAffine(np.full((h, w), 255, np.uint8), warp, (w, h), flags=cv2.INTER_NEAREST |
+                               cv2.WARP_INVERSE_MAP, borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+        return aligned, valid, warp, True
+
+    # -------------------------------------------------------------------------
+    # Update
+    # -------------------------------------------------------------------------
+
+    def update(self, image):
+        """
+        Analyze one frame (PIL image / RGB array). Returns an analyze()-style
+        dict (ratios, lbp_e, lbp_hist, spots, health, masks) plus 'damage',
+        'heatmap' and 'change' (mask, tile grid and deltas).
+        """
+        self.frames += 1
+        aligned, valid, warp, registered = self._align(image)
+        art = DEFAULT_PIPELINE.run(self.an, {'image': aligned}, outputs=CHANGE_OUTPUTS, options=self.options)
+        labels = class_labels(art['fg_mask'], art['g_mask'], art['y_mask'], art['b_mask'])
+        h, w = labels.shape
+        rows, cols = -(-h // self.tile), -(-w // self.tile)
+
+        if self.labels is None:
+            change_mask = np.full((h, w), 255, np.uint8)
+            tiles = np.ones((rows, cols), bool)
+            self.labels = labels.copy()
+            self.gray = art['gray'].copy()
+            self.counts = np.zeros((rows, cols, 4), np.int64)
+            self.lbp_counts = np.zeros((rows, cols, LBP_BINS), np.int64)
+            self.damage = np.zeros((h, w), np.uint8)
+        else:
+            change_mask = cv2.compare(labels, self.labels, cv2.CMP_NE)
+            # Isolated label flicker is sensor noise, not change
+            cv2.morphologyEx(change_mask, cv2.MORPH_OPEN, np.ones((3, 3), np.uint8), change_mask)
+            if valid is not None:
+                # Pixels shifted out of view keep their last observed state
+                change_mask[valid == 0] = 0
+            tiles = tile_sums(change_mask, self.tile) >= self.min_changed * self.tile ** 2
+
+        boxes = [self._box(r, c, h, w) for r, c in zip(*np.nonzero(tiles))]
+        for x0, y0, x1, y1 in boxes:
+            self.labels[y0:y1, x0:x1] = labels[y0:y1, x0:x1]
+            self.gray[y0:y1, x0:x1] = art['gray'][y0:y1, x0:x1]
+
+        # Blur and LBP reach DAMAGE_PAD / LBP_PAD pixels into the neighbouring tiles
+        halo = cv2.dilate(tiles.astype(np.uint8), np.ones((3, 3), np.uint8)).astype(bool)
+        tile_deltas = []
+        for r, c in zip(*np.nonzero(halo)):
+            box = self._box(r, c, h, w)
+            if tiles[r, c]:
+                before = self.counts[r, c].copy()
+                self.counts[r, c] = self._measure_counts(box)
+                tile_deltas.append(self._tile_delta(box, before, self.counts[r, c]))
+            self._measure_damage(box)
+            self.lbp_counts[r, c] = self._measure_lbp(box)
+
+        ratios = self._ratios()
+        spots = self._spots(tiles)
+        lbp_e, lbp_hist = self._lbp_entropy()
+        health = self.an.classify_health(ratios['green'], ratios['yellow'], ratios['brown'], spots, lbp_e)
+        delta = {k: round(v - self.prev_ratios[k], 2) for k, v in ratios.items()} if self.prev_ratios else None
+        self.prev_ratios = ratios
+
+        damage = self.damage
+        if damage.max() > 0:
+            damage = (damage / damage.max() * 255).astype(np.uint8)
+        original = cv2.cvtColor(np.asarray(aligned), cv2.COLOR_RGB2BGR)
+        heatmap = cv2.addWeighted(original, 0.6, cv2.applyColorMap(damage, cv2.COLORMAP_JET), 0.4, 0)
+
+        return {
+            'ratios': {k: round(v, 2) for k, v in ratios.items()},
+            'lbp_e': lbp_e,
+            'lbp_hist': lbp_hist,
+            'spots': spots,
+            'health': health,
+            'masks': {name: ((self.labels & bit) > 0).astype(np.uint8) * 255 for name, bit in
+                      (('g', GREEN), ('y', YELLOW), ('b', BROWN))},
+            'damage': damage,
+            'heatmap': heatmap,
+            'resolution': {'width': w, 'height': h},
+            'change': {
+                'mask': change_mask,
+                'tiles': tiles,
+                'changed_tiles': int(tiles.sum()),
+                'recomputed_tiles': int(halo.sum()),
+                'fraction': round(float(tiles.mean()), 4),
+                'ratio_delta': delta,
+                'tile_deltas': tile_deltas,
+                'registered': registered,
+                'warp': warp
+            }
+        }
+
+    def _box(self, r, c, h, w):
+        t = self.tile
+        return c * t, r * t, min((c + 1) * t, w), min((r + 1) * t, h)
+
+    # -------------------------------------------------------------------------
+    # Per-tile measurements (on the composite)
+    # -------------------------------------------------------------------------
+
+    def _measure_counts(self, box):
+        x0, y0, x1, y1 = box
+        lab = self.labels[y0:y1, x0:x1]
+        return [np.count_nonzero(lab & bit) for bit in (FG, GREEN, YELLOW, BROWN)]
+
+    def _tile_delta(self, box, before, after):
+        """Class change of one tile in percent of the tile area"""
+        x0, y0, x1, y1 = box
+        area = (x1 - x0) * (y1 - y0)
+        delta = {'box': (x0, y0, x1 - x0, y1 - y0)}
+        for i, (name, _) in enumerate(CLASS_BITS, start=1):
+            delta[name] = round((int(after[i]) - int(before[i])) / area * 100, 2)
+        return delta
+
+    def _padded(self, array, box, pad):
+        """Crop of `array` around `box` with up to `pad` pixels of context, and the inner slice"""
+        x0, y0, x1, y1 = box
+        h, w = array.shape[:2]
+        px0, py0, px1, py1 = max(0, x0 - pad), max(0, y0 - pad), min(w, x1 + pad), min(h, y1 + pad)
+        inner = (slice(y0 - py0, y1 - py0), slice(x0 - px0, x1 - px0))
+        return array[py0:py1, px0:px1], inner
+
+    def _measure_damage(self, box):
+        # Same weighting and blur as create_damage_heatmap, before normalization
+        x0, y0, x1, y1 = box
+        crop, inner = self._padded(self.labels, box, DAMAGE_PAD)
+        dmg = np.where((crop & BROWN) > 0, 255, np.where((crop & YELLOW) > 0, 127, 0)).astype(np.uint8)
+        self.damage[y0:y1, x0:x1] = cv2.GaussianBlur(dmg, (15, 15), 0)[inner]
+
+    def _measure_lbp(self, box):
+        if not HAS_SKIMAGE:
+            if self.an.strict:
+                raise ImportError("LBP texture analysis requires scikit-image")
+            return 0
+        gray, inner = self._padded(self.gray, box, LBP_PAD)
+        lbp = local_binary_pattern(gray, 24, 3, method='uniform')[inner]
+        x0, y0, x1, y1 = box
+        fg = (self.labels[y0:y1, x0:x1] & FG) > 0
+        return np.bincount(lbp[fg].astype(np.int64), minlength=LBP_BINS)[:LBP_BINS]
+
+    # -------------------------------------------------------------------------
+    # Aggregation
+    # -------------------------------------------------------------------------
+
+    def _ratios(self):
+        fg, g, y, b = self.counts.reshape(-1, 4).sum(axis=0)
+        total = fg or 1
+        return {'green': g / total * 100, 'yellow': y / total * 100, 'brown': b / total * 100}
+
+    def _lbp_entropy(self):
+        counts = self.lbp_counts.reshape(-1, LBP_BINS).sum(axis=0)
+        if counts.sum() == 0:
+            return 0.0, []
+        hist = counts / counts.sum()
+        entropy = -np.sum(hist[hist > 0] * np.log2(hist[hist > 0] + 1e-10))
+        return round(entropy, 3), hist.tolist()
+
+    def _spots(self, tiles):
+        """
+        Spot statistics of the composite brown mask. Spots that do not touch
+        a replaced tile are pixel-identical to the previous frame's and are
+        looked up by (bbox, area) instead of re-measured.
+        """
+        b_mask = ((self.labels & BROWN) > 0).astype(np.uint8)
+        n, cc, stats, _ = cv2.connectedComponentsWithStats(b_mask, connectivity=8)
+        t = self.tile
+        cache, spots = {}, {'total': 0, 'small': 0, 'medium': 0, 'large': 0, 'types': [], 'severity': 0}
+        for k in range(1, n):
+            x, y, w, h, area = (int(v) for v in stats[k])
+            key = (x, y, w, h, area)
+            touched = tiles[y // t:(y + h - 1) // t + 1, x // t:(x + w - 1) // t + 1].any()
+            if touched or key not in self.spot_cache:
+                cache[key] = self._measure_spot(cc[y:y + h, x:x + w] == k)
+            else:
+                cache[key] = self.spot_cache[key]
+            if cache[key] is None:
+                continue
+            size, spot_type = cache[key]
+            spots['total'] += 1
+            spots[size] += 1
+            if spot_type:
+                spots['types'].append(spot_type)
+        self.spot_cache = cache
+        spots['severity'] = self.an.spot_severity(spots)
+        return spots
+
+    def _measure_spot(self, component):
+        # External contour, as analyze_disease_spots (holes count towards the spot area)
+        contours, _ = cv2.findContours(component.astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        c = max(contours, key=cv2.contourArea)
+        area = cv2.contourArea(c) / self.scale ** 2
+        if area < MIN_SPOT_AREA:
+            return None
+        return self.an.classify_spot(area, cv2.arcLength(c, True) / self.scale)
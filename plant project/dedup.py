@@ -0,0 +1,204 @@
+"""
+=============================================================================
+NEAR-DUPLICATE FRAME DETECTION
+=============================================================================
+Features:
+- 64-bit perceptual hashes (aHash / dHash / pHash) on a tiny grayscale thumbnail
+- BK-tree for Hamming-radius search
+- Reuses the previous analysis for near-identical frames from fixed cameras
+=============================================================================
+"""
+
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+from PIL import Image
+
+
+# =============================================================================
+# PERCEPTUAL HASHES
+# =============================================================================
+
+def _bits_to_int(bits):
+    return int.from_bytes(np.packbits(bits.flatten()).tobytes(), 'big')
+
+
+def average_hash(gray):
+    """aHash: 8x8 thumbnail thresholded at its mean"""
+    small = cv2.resize(gray, (8, 8), interpolation=cv2.INTER_AREA)
+    return _bits_to_int(small > small.mean())
+
+
+def difference_hash(gray):
+    """dHash: sign of horizontal gradients on a 9x8 thumbnail"""
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    return _bits_to_int(small[:, 1:] > small[:, :-1])
+
+
+def perceptual_hash(gray):
+    """pHash: low-frequency 8x8 DCT block thresholded at its median"""
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    return _bits_to_int(low > np.median(low[1:]))
+
+
+HASH_METHODS = {
+    "ahash": average_hash,
+    "dhash": difference_hash,
+    "phash": perceptual_hash
+}
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def image_hash(pil_image, method="dhash"):
+    """Hash of a fully decoded PIL image (the one decode path, so file and in-memory frames agree)"""
+    gray = np.asarray(pil_image.convert('L'))
+    gray = cv2.resize(gray, (64, 64), interpolation=cv2.INTER_AREA)
+    return HASH_METHODS[method](gray)
+
+
+def file_hash(path, method="dhash"):
+    """Hash an image file"""
+    with Image.open(path) as img:
+        return image_hash(img, method)
+
+
+# =============================================================================
+# BK-TREE
+# =============================================================================
+
+class BKTree:
+    """Metric tree over 64-bit hashes under Hamming distance"""
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, h, value):
+        node = [h, value, {}]
+        self.size += 1
+        if self.root is None:
+            self.root = node
+            return
+        cur = self.root
+        while True:
+            d = hamming(h, cur[0])
+            if d in cur[2]:
+                cur = cur[2][d]
+            else:
+                cur[2][d] = node
+                return
+
+    def search(self, h, radius):
+        """[(distance, hash, value)] within `radius`, nearest first"""
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            d = hamming(h, node[0])
+            if d <= radius:
+                found.append((d, node[0], node[1]))
+            # Triangle inequality: only children with |k - d| <= radius can match
+            for k, child in node[2].items():
+                if d - radius <= k <= d + radius:
+                    stack.append(child)
+        found.sort(key=lambda x: x[0])
+        return found
+
+
+# =============================================================================
+# DEDUPLICATING ANALYZER FRONT-END
+# =============================================================================
+
+class FrameDeduplicator:
+    """
+    Skips `analyze` for frames within `threshold` bits of an analyzed frame.
+
+    Frames are grouped by `key` (e.g. camera id). Only analyzed frames become
+    references, so gradual change eventually exceeds the threshold and
+    triggers a fresh analysis; `max_age` (seconds) forces one regardless.
+
+    Fresh and reused results have the same keys. Full-frame masks would
+    dominate the cache's memory, so 'masks' is left out of both unless
+    `keep_masks` is set.
+    """
+
+    def __init__(self, analyzer, threshold=4, method="dhash", max_entries=5000, max_age=None, keep_masks=False):
+        self.analyzer = analyzer
+        self.keep_masks = keep_masks
+        self.threshold = threshold
+        self.method = method
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.groups = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _group(self, key):
+        if key not in self.groups:
+            self.groups[key] = (BKTree(), OrderedDict())
+        return self.groups[key]
+
+    def lookup(self, h, key=None):
+        tree, entries = self._group(key)
+        now = time.monotonic()
+        for d, ref, _ in tree.search(h, self.threshold):
+            entry = entries.get(ref)
+            if entry is not None and (self.max_age is None or now - entry[0] <= self.max_age):
+                return d, entry[1]
+        return None, None
+
+    def store(self, h, result, key=None):
+        tree, entries = self._group(key)
+        if h not in entries:
+            tree.add(h, None)
+        entries[h] = (time.monotonic(), result)
+        if len(entries) > self.max_entries:
+            # BK-trees do not support deletion; rebuild from the newest half
+            while len(entries) > self.max_entries // 2:
+                entries.popitem(last=False)
+            tree = BKTree()
+            for ref in entries:
+                tree.add(ref, None)
+            self.groups[key] = (tree, entries)
+
+    def analyze(self, pil_image, use_grabcut=False, key=None):
+        """Analysis result, reused from a near-duplicate frame when possible"""
+        h = image_hash(pil_image, self.method)
+        return self._reuse(h, key) or self._analyze_miss(pil_image, h, use_grabcut, key)
+
+    def analyze_file(self, path, use_grabcut=False, key=None):
+        """Like analyze(), for an image file (decoded once for both hashing and analysis)"""
+        with Image.open(path) as img:
+            return self.analyze(img.convert('RGB'), use_grabcut, key)
+
+    def _reuse(self, h, key):
+        d, cached = self.lookup(h, key)
+        if cached is None:
+            return None
+        self.hits += 1
+        result = dict(cached)
+        result['dedup'] = {'reused': True, 'distance': d, 'hash': f"{h:016x}"}
+        return result
+
+    def _analyze_miss(self, pil_image, h, use_grabcut, key):
+        self.misses += 1
+        result = self.analyzer.analyze(pil_image, use_grabcut)
+        if result is None:
+            return None
+        if not self.keep_masks:
+            result = {k: v for k, v in result.items() if k != 'masks'}
+        self.store(h, result, key)
+        result = dict(result)
+        result['dedup'] = {'reused': False, 'distance': 0, 'hash': f"{h:016x}"}
+        return result
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
@@ -0,0 +1,423 @@
+"""
+=============================================================================
+GROUND-TRUTH EVALUATION HARNESS
+=============================================================================
+Features:
+- Labeled dataset loader (per-image health labels, optional pixel masks)
+- Several pipeline configurations evaluated side by side, in parallel
+- Confusion matrices, per-mask IoU and per-image latency
+- Per-stage feature cache: a stage is only recomputed when its own
+  parameters or an upstream stage changed (e.g. new HSV bounds reuse the
+  cached resize / white balance / CLAHE / denoise / segmentation outputs)
+=============================================================================
+
+Dataset layout:
+    dataset/
+        labels.json      {"leaf1.jpg": {"label": "diseased", "masks": {"b": "masks/leaf1_b.png"}}, ...}
+        leaf1.jpg
+        masks/leaf1_b.png
+
+Labels are HEALTH_STATUSES keys (healthy / diseased / stress / moderate) or,
+with label_field="grade", grades (A+ ... F). Mask keys are those of
+result['masks'] ("g", "y", "b"); nonzero pixels are positive.
+
+    python evaluation.py dataset/ --workers 4 --cache .eval_cache
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from grading import HEALTH_GRADES, HEALTH_STATUSES
+from pipeline import DEFAULT_PIPELINE, RESULT_ARTIFACTS, SOURCE_ARTIFACTS, build_result
+from plant_care_system import UltimatePlantAnalyzer
+from stage_scheduler import get_pool
+
+
+# Config fields each stage depends on (besides its inputs); unknown stages depend on all of them
+STAGE_PARAMS = {
+    "resize": ("max_size",),
+    "white_balance": (),
+    "clahe": (),
+    "denoise": (),
+    "segmentation": ("use_grabcut",),
+    "roi": ("crop_to_fg",),
+    "hsv_classification": ("max_size", "hsv"),
+    "ratios": (),
+    "gray": (),
+    "edges": ("crop_to_fg",),
+    "lbp": (),
+    "spots": ("max_size",),
+    "heatmap": (),
+    "scoring": ()
+}
+
+_STATUS_KEYS = {text: key for key, text in HEALTH_STATUSES.items()}
+LABEL_CLASSES = {
+    "status": list(HEALTH_STATUSES),
+    "grade": [grade for _, grade, _, _ in HEALTH_GRADES]
+}
+
+
+# =============================================================================
+# DATASET
+# =============================================================================
+
+class Sample:
+    """One labeled image"""
+
+    __slots__ = ("image_id", "path", "label", "masks")
+
+    def __init__(self, image_id, path, label, masks=None):
+        self.image_id = image_id
+        self.path = path
+        self.label = label
+        self.masks = masks or {}
+
+    def load_mask(self, key, shape):
+        """Ground-truth mask resized (nearest) to the analysis resolution, as bool"""
+        gt = cv2.imread(self.masks[key], cv2.IMREAD_GRAYSCALE)
+        if gt is None:
+            raise FileNotFoundError(self.masks[key])
+        return cv2.resize(gt, (shape[1], shape[0]), interpolation=cv2.INTER_NEAREST) > 0
+
+
+def load_dataset(root, labels_file="labels.json"):
+    """Samples listed in <root>/labels.json"""
+    with open(os.path.join(root, labels_file), encoding="utf-8") as f:
+        labels = json.load(f)
+    samples = []
+    for image_id, entry in sorted(labels.items()):
+        if isinstance(entry, str):
+            entry = {"label": entry}
+        masks = {k: os.path.join(root, p) for k, p in entry.get("masks", {}).items()}
+        samples.append(Sample(image_id, os.path.join(root, image_id), entry.get("label"), masks))
+    return samples
+
+
+# =============================================================================
+# CONFIGURATIONS
+# =============================================================================
+
+class EvalConfig:
+    """A pipeline variant: pipeline, GrabCut, foreground cropping, analysis size and HSV bound overrides"""
+
+    def __init__(self, name, pipeline=None, use_grabcut=False, max_size=(800, 600), hsv=None, crop_to_fg=False):
+        self.name = name
+        self.pipeline = pipeline or DEFAULT_PIPELINE
+        self.use_grabcut = use_grabcut
+        self.max_size = tuple(max_size)
+        self.hsv = dict(hsv or {})
+        self.crop_to_fg = crop_to_fg
+
+    def params(self):
+        return {
+            "use_grabcut": self.use_grabcut,
+            "crop_to_fg": self.crop_to_fg,
+            "max_size": list(self.max_size),
+            "hsv": {k: list(map(int, v)) for k, v in sorted(self.hsv.items())}
+        }
+
+    def make_analyzer(self):
+        analyzer = UltimatePlantAnalyzer()
+        for key, value in self.hsv.items():
+            setattr(analyzer, key, np.array(value))
+        return analyzer
+
+    @classmethod
+    def from_spec(cls, spec):
+        """From a dict such as {"name": "fast", "max_size": [400, 300], "hsv": {"brown_upper": [22, 255, 200]}}"""
+        from pipeline import PIPELINES, Pipeline
+        pipeline = spec.get("pipeline")
+        if isinstance(pipeline, dict):
+            pipeline = Pipeline.from_spec(pipeline)
+        elif isinstance(pipeline, str):
+            pipeline = PIPELINES[pipeline]
+        return cls(spec["name"], pipeline, spec.get("use_grabcut", False),
+                   spec.get("max_size", (800, 600)), spec.get("hsv"), spec.get("crop_to_fg", False))
+
+
+DEFAULT_CONFIGS = [
+    EvalConfig("full"),
+    EvalConfig("grabcut", use_grabcut=True),
+    EvalConfig("grabcut-crop", use_grabcut=True, crop_to_fg=True),
+    EvalConfig("half-size", max_size=(400, 300))
+]
+
+
+# =============================================================================
+# PER-STAGE FEATURE CACHE
+# =============================================================================
+
+class FeatureCache:
+    """
+    Stage outputs keyed by (image digest, stage, stage params, upstream keys).
+    Kept in an in-memory LRU and, with `directory`, as pickles on disk so a
+    later evaluation run reuses them. Concurrent requests for the same key
+    compute it once.
+    """
+
+    def __init__(self, directory=None, max_entries=128):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.memory = OrderedDict()
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".pkl")
+
+    def get_or_compute(self, key, compute):
+        while True:
+            with self.lock:
+                if key in self.memory:
+                    self.memory.move_to_end(key)
+                    self.hits += 1
+                    return self.memory[key]
+                waiting = self.pending.get(key)
+                if waiting is None:
+                    self.pending[key] = threading.Event()
+                    break
+            waiting.wait()
+
+        try:
+            entry = self._load(key)
+            with self.lock:
+                if entry is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+            if entry is None:
+                entry = compute()
+                self._store(key, entry)
+            self._remember(key, entry)
+            return entry
+        finally:
+            with self.lock:
+                self.pending.pop(key).set()
+
+    def _load(self, key):
+        if not self.directory or not os.path.exists(self._path(key)):
+            return None
+        with open(self._path(key), "rb") as f:
+            return pickle.load(f)
+
+    def _store(self, key, entry):
+        if not self.directory:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    def _remember(self, key, entry):
+        with self.lock:
+            self.memory[key] = entry
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_entries:
+                self.memory.popitem(last=False)
+
+
+def file_digest(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def run_cached(config, sample, cache, digest=None):
+    """
+    Run the config's pipeline on one sample through the cache.
+    Returns (result, latency_ms); latency is the sum of the stages'
+    measured compute times, so cached stages still count at their cost.
+    """
+    pipeline = config.pipeline
+    stages = pipeline.required_stages(RESULT_ARTIFACTS)
+    params = config.params()
+    options = {"use_grabcut": config.use_grabcut, "max_size": config.max_size, "crop_to_fg": config.crop_to_fg}
+    digest = digest or file_digest(sample.path)
+
+    analyzer = None
+    artifacts, keys, latency = {}, {}, 0.0
+    for stage in stages:
+        upstream = sorted({keys[pipeline.producers[i].name] for i in stage.inputs if i not in SOURCE_ARTIFACTS})
+        own = {p: params[p] for p in STAGE_PARAMS.get(stage.name, tuple(params))}
+        key = hashlib.sha1(json.dumps([digest, stage.name, own, upstream]).encode()).hexdigest()
+        keys[stage.name] = key
+
+        def compute(stage=stage):
+            nonlocal analyzer
+            if analyzer is None:
+                analyzer = config.make_analyzer()
+            if "image" not in artifacts:
+                with Image.open(sample.path) as img:
+                    artifacts["image"] = img.convert("RGB")
+            start = time.perf_counter()
+            produced = stage.fn(analyzer, options, **{k: artifacts[k] for k in stage.inputs})
+            return {o: produced[o] for o in stage.outputs}, (time.perf_counter() - start) * 1000
+
+        outputs, ms = compute() if cache is None else cache.get_or_compute(key, compute)
+        artifacts.update(outputs)
+        latency += ms
+    return build_result(artifacts), latency
+
+
+# =============================================================================
+# METRICS
+# =============================================================================
+
+def predicted_label(result, label_field="status"):
+    health = result['health']
+    return _STATUS_KEYS.get(health['status']) if label_field == "status" else health['grade']
+
+
+def mask_iou(pred, gt):
+    union = np.count_nonzero(pred | gt)
+    return 1.0 if union == 0 else np.count_nonzero(pred & gt) / union
+
+
+def confusion_matrix(truth, predicted, classes):
+    index = {c: i for i, c in enumerate(classes)}
+    matrix = np.zeros((len(classes), len(classes)), dtype=np.int64)
+    for t, p in zip(truth, predicted):
+        if t in index and p in index:
+            matrix[index[t], index[p]] += 1
+    return matrix
+
+
+def summarize(config_name, rows, label_field, classes):
+    """rows: per-sample dicts from evaluate(); returns one report dict"""
+    labeled = [r for r in rows if r['label'] is not None and r['predicted'] is not None]
+    matrix = confusion_matrix([r['label'] for r in labeled], [r['predicted'] for r in labeled], classes)
+    correct = np.trace(matrix)
+    per_class = {}
+    for i, c in enumerate(classes):
+        tp, col, row = matrix[i, i], matrix[:, i].sum(), matrix[i].sum()
+        per_class[c] = {'precision': tp / col if col else None, 'recall': tp / row if row else None, 'support': int(row)}
+
+    ious = {}
+    for r in rows:
+        for k, v in r['iou'].items():
+            ious.setdefault(k, []).append(v)
+    latencies = np.array([r['latency_ms'] for r in rows]) if rows else np.zeros(1)
+
+    return {
+        'config': config_name,
+        'n': len(rows),
+        'accuracy': correct / matrix.sum() if matrix.sum() else None,
+        'classes': classes,
+        'confusion': matrix.tolist(),
+        'per_class': per_class,
+        'iou': {k: float(np.mean(v)) for k, v in sorted(ious.items())},
+        'latency_ms': {
+            'mean': float(latencies.mean()),
+            'p50': float(np.percentile(latencies, 50)),
+            'p95': float(np.percentile(latencies, 95))
+        },
+        'failed': sum(1 for r in rows if r['predicted'] is None)
+    }
+
+
+# =============================================================================
+# EVALUATION
+# =============================================================================
+
+def _evaluate_one(config, sample, cache, digest, label_field):
+    row = {'image_id': sample.image_id, 'label': sample.label, 'predicted': None, 'iou': {}, 'latency_ms': 0.0}
+    try:
+        result, latency = run_cached(config, sample, cache, digest)
+    except Exception as e:
+        row['error'] = str(e)
+        return row
+    row['predicted'] = predicted_label(result, label_field)
+    row['latency_ms'] = latency
+    for key in sample.masks:
+        if key in result.get('masks', {}):
+            pred = result['masks'][key] > 0
+            row['iou'][key] = mask_iou(pred, sample.load_mask(key, pred.shape))
+    return row
+
+
+def evaluate(samples, configs=DEFAULT_CONFIGS, cache=None, max_workers=4, label_field="status"):
+    """
+    Evaluate every config on every sample, (config, sample) pairs in parallel
+    on the shared stage pool. Returns ({config: report}, {config: rows}).
+    Latencies are measured under that parallel load; max_workers=1 gives
+    single-image numbers.
+    """
+    classes = LABEL_CLASSES[label_field]
+    digests = {s.image_id: file_digest(s.path) for s in samples}
+    tasks = [(c, s) for c in configs for s in samples]
+    if max_workers > 1:
+        pool = get_pool(max_workers)
+        futures = [pool.submit(_evaluate_one, c, s, cache, digests[s.image_id], label_field) for c, s in tasks]
+        results = [f.result() for f in futures]
+    else:
+        results = [_evaluate_one(c, s, cache, digests[s.image_id], label_field) for c, s in tasks]
+
+    rows = {c.name: [] for c in configs}
+    for (c, _), row in zip(tasks, results):
+        rows[c.name].append(row)
+    reports = {name: summarize(name, r, label_field, classes) for name, r in rows.items()}
+    return reports, rows
+
+
+def format_reports(reports):
+    """Side-by-side text table plus one confusion matrix per config"""
+    mask_keys = sorted({k for r in reports.values() for k in r['iou']})
+    header = f"{'config':<14}{'n':>5}{'accuracy':>10}" + "".join(f"{'IoU ' + k:>9}" for k in mask_keys) + \
+             f"{'mean ms':>10}{'p95 ms':>10}"
+    lines = [header, "-" * len(header)]
+    for r in reports.values():
+        acc = f"{r['accuracy']:.3f}" if r['accuracy'] is not None else "-"
+        ious = "".join(f"{r['iou'][k]:>9.3f}" if k in r['iou'] else f"{'-':>9}" for k in mask_keys)
+        lines.append(f"{r['config']:<14}{r['n']:>5}{acc:>10}{ious}"
+                     f"{r['latency_ms']['mean']:>10.1f}{r['latency_ms']['p95']:>10.1f}")
+    for r in reports.values():
+        lines.append("")
+        lines.append(f"Confusion matrix - {r['config']} (rows = truth, columns = predicted)")
+        width = max(len(c) for c in r['classes']) + 2
+        lines.append(" " * width + "".join(f"{c:>{width}}" for c in r['classes']))
+        for c, counts in zip(r['classes'], r['confusion']):
+            lines.append(f"{c:<{width}}" + "".join(f"{v:>{width}}" for v in counts))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Evaluate pipeline configurations against a labeled dataset")
+    parser.add_argument("dataset")
+    parser.add_argument("--configs", help="JSON file with a list of config specs (default: full / grabcut / half-size)")
+    parser.add_argument("--label-field", choices=list(LABEL_CLASSES), default="status")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--cache", help="directory for the per-stage feature cache")
+    parser.add_argument("--json", help="also write the reports to this file")
+    args = parser.parse_args()
+
+    configs = DEFAULT_CONFIGS
+    if args.configs:
+        with open(args.configs, encoding="utf-8") as f:
+            configs = [EvalConfig.from_spec(spec) for spec in json.load(f)]
+    feature_cache = FeatureCache(args.cache)
+    all_reports, _ = evaluate(load_dataset(args.dataset), configs, feature_cache, args.workers, args.label_field)
+    print(format_reports(all_reports))
+    print(f"\nFeature cache: {feature_cache.hits} hits, {feature_cache.misses} misses")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(all_reports, f, indent=2, default=float)
@@ -0,0 +1,189 @@
+"""
+=============================================================================
+COLUMNAR RESULTS EXPORT (Arrow / Parquet)
+=============================================================================
+Features:
+- Flattens nested `analyze` results into a typed columnar schema
+- Spot lists and LBP histograms become list columns
+- Row-group batching: rows are buffered column-wise and flushed per group
+- Parquet or Arrow IPC files (chosen by extension: .parquet / .arrow)
+=============================================================================
+"""
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+
+DEFAULT_ROW_GROUP_SIZE = 65536
+
+# (column, arrow type factory) - factories so the module imports without pyarrow
+_COLUMNS = [
+    ("image_id", lambda: pa.string()),
+    ("plant", lambda: pa.string()),
+    ("timestamp", lambda: pa.timestamp("ms")),
+    ("green", lambda: pa.float32()),
+    ("yellow", lambda: pa.float32()),
+    ("brown", lambda: pa.float32()),
+    ("edge_d", lambda: pa.float32()),
+    ("lbp_e", lambda: pa.float32()),
+    ("lbp_hist", lambda: pa.list_(pa.float32())),
+    ("spots_total", lambda: pa.int32()),
+    ("spots_small", lambda: pa.int32()),
+    ("spots_medium", lambda: pa.int32()),
+    ("spots_large", lambda: pa.int32()),
+    ("spots_severity", lambda: pa.int16()),
+    ("spot_type", lambda: pa.list_(pa.string())),
+    ("spot_circ", lambda: pa.list_(pa.float32())),
+    ("spot_sev", lambda: pa.list_(pa.int8())),
+    ("score", lambda: pa.float32()),
+    ("grade", lambda: pa.string()),
+    ("status", lambda: pa.string()),
+    ("problems", lambda: pa.list_(pa.string())),
+    ("width", lambda: pa.int16()),
+    ("height", lambda: pa.int16()),
+    ("resolution_mode", lambda: pa.string()),
+    ("species", lambda: pa.string())
+]
+
+COLUMN_NAMES = [name for name, _ in _COLUMNS]
+
+# Low-cardinality text columns stored dictionary-encoded
+_DICTIONARY_COLUMNS = ["plant", "grade", "status", "resolution_mode", "species"]
+
+
+def _format_for(path, fmt):
+    if fmt is None:
+        fmt = "arrow" if str(path).endswith((".arrow", ".feather", ".ipc")) else "parquet"
+    if fmt not in ("parquet", "arrow"):
+        raise ValueError(f"Unknown export format '{fmt}', expected 'parquet' or 'arrow'")
+    return fmt
+
+
+def _require_pyarrow():
+    if not HAS_PYARROW:
+        raise ImportError("Results export requires pyarrow (pip install pyarrow)")
+
+
+def result_schema():
+    """Arrow schema of the exported table"""
+    _require_pyarrow()
+    return pa.schema([pa.field(name, factory()) for name, factory in _COLUMNS])
+
+
+def flatten_result(result, image_id=None, plant=None, timestamp=None):
+    """One analyze() result -> flat row dict keyed by COLUMN_NAMES (masks are dropped)"""
+    ratios = result.get('ratios', {})
+    spots = result.get('spots', {})
+    types = spots.get('types', [])
+    health = result.get('health', {})
+    resolution = result.get('resolution', {})
+    species = result.get('species', {})
+    return {
+        "image_id": None if image_id is None else str(image_id),
+        "plant": plant,
+        "timestamp": timestamp,
+        "green": ratios.get('green'),
+        "yellow": ratios.get('yellow'),
+        "brown": ratios.get('brown'),
+        "edge_d": result.get('edge_d'),
+        "lbp_e": result.get('lbp_e'),
+        "lbp_hist": result.get('lbp_hist'),
+        "spots_total": spots.get('total'),
+        "spots_small": spots.get('small'),
+        "spots_medium": spots.get('medium'),
+        "spots_large": spots.get('large'),
+        "spots_severity": spots.get('severity'),
+        "spot_type": [s['type'] for s in types],
+        "spot_circ": [s['circ'] for s in types],
+        "spot_sev": [s['sev'] for s in types],
+        "score": health.get('score'),
+        "grade": health.get('grade'),
+        "status": health.get('status'),
+        "problems": health.get('problems'),
+        "width": resolution.get('width'),
+        "height": resolution.get('height'),
+        "resolution_mode": resolution.get('mode'),
+        "species": species.get('name')
+    }
+
+
+class ResultExporter:
+    """
+    Streams flattened results into a Parquet (or Arrow IPC) file.
+
+        with ResultExporter("results.parquet") as out:
+            for path in paths:
+                out.add(analyzer.analyze(img), image_id=path, plant=plant)
+
+    Rows are buffered per column and written as one row group every
+    `row_group_size` rows, so memory is bounded by a single group.
+    """
+
+    def __init__(self, path, row_group_size=DEFAULT_ROW_GROUP_SIZE, fmt=None, compression="zstd"):
+        _require_pyarrow()
+        fmt = _format_for(path, fmt)
+        self.schema = result_schema()
+        self.row_group_size = row_group_size
+        self.columns = {name: [] for name in COLUMN_NAMES}
+        self.rows = 0
+        if fmt == "parquet":
+            self._writer = pq.ParquetWriter(path, self.schema, compression=compression,
+                                            use_dictionary=_DICTIONARY_COLUMNS)
+        else:
+            self._writer = pa.ipc.new_file(path, self.schema)
+
+    def add(self, result, image_id=None, plant=None, timestamp=None):
+        self.add_row(flatten_result(result, image_id, plant, timestamp))
+
+    def add_row(self, row):
+        for name in COLUMN_NAMES:
+            self.columns[name].append(row.get(name))
+        self.rows += 1
+        if len(self.columns["image_id"]) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if not self.columns["image_id"]:
+            return
+        batch = pa.RecordBatch.from_arrays(
+            [pa.array(self.columns[f.name], type=f.type) for f in self.schema],
+            schema=self.schema
+        )
+        self._writer.write_batch(batch)
+        for values in self.columns.values():
+            values.clear()
+
+    def close(self):
+        if self._writer is not None:
+            self.flush()
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def export_results(path, results, row_group_size=DEFAULT_ROW_GROUP_SIZE, fmt=None):
+    """Write an iterable of (image_id, plant, result) tuples; returns the row count"""
+    with ResultExporter(path, row_group_size, fmt) as out:
+        for image_id, plant, result in results:
+            if result is not None:
+                out.add(result, image_id, plant)
+        return out.rows
+
+
+def read_results(path, columns=None, fmt=None):
+    """Load an exported file as an Arrow table (optionally only some columns)"""
+    _require_pyarrow()
+    if _format_for(path, fmt) == "parquet":
+        return pq.read_table(path, columns=columns)
+    # Zero-copy: the table's buffers keep the memory map alive
+    table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    return table.select(columns) if columns else table
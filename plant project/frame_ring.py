@@ -0,0 +1,310 @@
+"""
+=============================================================================
+SHARED-MEMORY FRAME RING
+=============================================================================
+Features:
+- Ring of preallocated frame slots in one multiprocessing.shared_memory
+  block, shared by the ingest process and the analysis workers
+- Producers decode straight into a free slot (cv2.imread with a
+  destination buffer); only a small (frame id, slot, shape) descriptor
+  goes through the job queue
+- Workers analyze the slot in place (the resize stage accepts RGB arrays)
+  and send back the packed AnalysisRecord (about 300 bytes) instead of
+  masks and processing steps
+- Slots are recycled through a free-slot queue, which also bounds the
+  number of frames in flight
+- Dead workers (OOM kill, crash in native code) are detected while
+  waiting: their in-flight frame is reported as failed, its slot freed
+  and the worker replaced
+=============================================================================
+
+    with RingAnalysisPool(workers=4) as pool:
+        for frame_id, record in pool.map(paths):
+            print(frame_id, record.health.grade_code)
+"""
+
+import multiprocessing as mp
+import queue
+import time
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from pipeline import RESULT_ARTIFACTS
+from results import AnalysisRecord
+from stage_scheduler import configure_threads
+
+
+DEFAULT_MAX_SHAPE = (3024, 4032, 3)     # 12 MP RGB
+DEFAULT_SLOTS_PER_WORKER = 2            # one frame being analyzed, one decoded and waiting
+DEFAULT_POLL = 1.0                      # seconds between worker liveness checks while waiting
+
+# RGB decode straight from the codec where OpenCV supports it (4.10+), BGR + in-place swap otherwise
+_IMREAD_FLAGS = getattr(cv2, "IMREAD_COLOR_RGB", cv2.IMREAD_COLOR) | cv2.IMREAD_IGNORE_ORIENTATION
+_DECODES_RGB = hasattr(cv2, "IMREAD_COLOR_RGB")
+
+
+# =============================================================================
+# RING
+# =============================================================================
+
+class FrameRing:
+    """
+    `slots` frame buffers of up to `max_shape` (h, w, 3) uint8 each.
+    Frames smaller than the maximum use a contiguous prefix of their slot.
+    The creating process owns the block (unlink()); pickling a ring (e.g. as
+    a Process argument) attaches the receiving process to the same memory.
+    """
+
+    def __init__(self, slots, max_shape=DEFAULT_MAX_SHAPE, ctx=None):
+        self.slots = slots
+        self.max_shape = tuple(max_shape)
+        self.slot_bytes = int(np.prod(self.max_shape))
+        self.shm = shared_memory.SharedMemory(create=True, size=slots * self.slot_bytes)
+        self.owner = True
+        self.free = (ctx or mp).Queue()
+        for slot in range(slots):
+            self.free.put(slot)
+
+    def __getstate__(self):
+        return {'name': self.shm.name, 'slots': self.slots, 'max_shape': self.max_shape, 'free': self.free}
+
+    def __setstate__(self, state):
+        self.slots = state['slots']
+        self.max_shape = state['max_shape']
+        self.slot_bytes = int(np.prod(self.max_shape))
+        self.shm = shared_memory.SharedMemory(name=state['name'])
+        self.owner = False
+        self.free = state['free']
+
+    def fits(self, shape):
+        return len(shape) == 3 and shape[2] == 3 and shape[0] * shape[1] * 3 <= self.slot_bytes
+
+    def view(self, slot, shape):
+        """uint8 array of `shape` backed by the slot (no copy)"""
+        return np.ndarray(shape, dtype=np.uint8, buffer=self.shm.buf, offset=slot * self.slot_bytes)
+
+    def acquire(self, timeout=None):
+        """Index of a free slot; blocks while all slots are in flight"""
+        return self.free.get(timeout=timeout)
+
+    def release(self, slot):
+        self.free.put(slot)
+
+    def write(self, slot, frame):
+        """Copy an RGB array into a slot; returns its shape"""
+        np.copyto(self.view(slot, frame.shape), frame)
+        return frame.shape
+
+    def decode_into(self, slot, path):
+        """Decode an image file directly into a slot as RGB; returns its shape"""
+        with Image.open(path) as img:      # header only: size without decoding
+            w, h = img.size
+        shape = (h, w, 3)
+        if not self.fits(shape):
+            raise ValueError(f"{path}: {w}x{h} does not fit a {self.max_shape[1]}x{self.max_shape[0]} slot")
+        dst = self.view(slot, shape)
+        out = cv2.imread(path, dst, _IMREAD_FLAGS)
+        if out is None:
+            raise ValueError(f"{path}: cannot decode")
+        if not np.shares_memory(out, dst):
+            np.copyto(dst, out)             # codec allocated its own buffer (e.g. palette / 16-bit input)
+        if not _DECODES_RGB:
+            cv2.cvtColor(dst, cv2.COLOR_BGR2RGB, dst)
+        return shape
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+# =============================================================================
+# WORKERS
+# =============================================================================
+
+def _analysis_worker(index, ring, jobs, results, current, holding, options, threads, strict):
+    from plant_care_system import UltimatePlantAnalyzer
+
+    cv2.setNumThreads(threads)
+    analyzer = UltimatePlantAnalyzer(strict=strict)
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        seq, slot, shape = job
+        # Published for the pool: which frame (and slot) this worker holds if it dies
+        current[index] = seq
+        holding[index] = 1
+        data = error = None
+        try:
+            result = analyzer.analyze(ring.view(slot, shape), **options)
+            if result is None:
+                error = "analysis failed"
+            else:
+                data = AnalysisRecord.from_dict(result).to_bytes()
+        except Exception as e:
+            error = repr(e)
+        finally:
+            # The resize stage made its own analysis-size copy: the slot can be reused.
+            # Cleared first: dying in between leaks the slot instead of freeing it twice.
+            holding[index] = 0
+            ring.release(slot)
+        results.put((seq, data, error))
+    ring.shm.close()
+
+
+class RingAnalysisPool:
+    """
+    Analysis worker processes fed through a FrameRing. Results arrive as
+    (frame_id, AnalysisRecord or None) in completion order; for None,
+    `errors[frame_id]` says why (the worker's exception, or its exit code
+    if it died). Waits poll the workers every `poll` seconds.
+    """
+
+    def __init__(self, workers=2, slots=None, max_shape=DEFAULT_MAX_SHAPE, use_grabcut=False,
+                 outputs=RESULT_ARTIFACTS, max_size=(800, 600), start_method=None, strict=False,
+                 poll=DEFAULT_POLL):
+        self.ctx = mp.get_context(start_method)
+        self.ring = FrameRing(slots or DEFAULT_SLOTS_PER_WORKER * workers, max_shape, self.ctx)
+        self.jobs = self.ctx.Queue()
+        self.results = self.ctx.Queue()
+        self.poll = poll
+        self.inflight = {}           # seq -> (frame_id, slot)
+        self.errors = {}
+        self._lost = []              # frame ids of dead workers, not yet handed out
+        self._seq = 0
+        self.current = self.ctx.Array('q', [-1] * workers, lock=False)
+        self.holding = self.ctx.Array('b', workers, lock=False)
+        options = {'use_grabcut': use_grabcut, 'outputs': outputs, 'max_size': max_size}
+        threads = configure_threads(1, batch_workers=workers)
+        self._worker_args = (self.ring, self.jobs, self.results, self.current, self.holding, options, threads,
+                             strict)
+        self.processes = [self._spawn(i) for i in range(workers)]
+        self.replaced = 0
+
+    def _spawn(self, index):
+        p = self.ctx.Process(target=_analysis_worker, args=(index,) + self._worker_args, daemon=True)
+        p.start()
+        return p
+
+    @property
+    def pending(self):
+        """Submitted frames whose result has not been handed out yet"""
+        return len(self.inflight) + len(self._lost)
+
+    def check_workers(self):
+        """Replace dead workers; their in-flight frames become failed results"""
+        for i, p in enumerate(self.processes):
+            if p.is_alive():
+                continue
+            entry = self.inflight.pop(self.current[i], None)
+            if entry is not None:
+                frame_id, slot = entry
+                if self.holding[i]:
+                    self.ring.release(slot)
+                self.errors[frame_id] = f"worker died (exit code {p.exitcode})"
+                self._lost.append(frame_id)
+            self.current[i] = -1
+            self.holding[i] = 0
+            self.processes[i] = self._spawn(i)
+            self.replaced += 1
+
+    def _submit(self, frame_id, fill):
+        # A dead worker may hold the last free slot: check on them while waiting
+        while True:
+            try:
+                slot = self.ring.acquire(timeout=self.poll)
+                break
+            except queue.Empty:
+                self.check_workers()
+        try:
+            shape = fill(slot)
+        except Exception:
+            self.ring.release(slot)
+            raise
+        seq = self._seq
+        self._seq += 1
+        self.inflight[seq] = (frame_id, slot)
+        self.jobs.put((seq, slot, shape))
+
+    def submit_path(self, frame_id, path):
+        """Decode a file into the next free slot and queue it (blocks while the ring is full)"""
+        self._submit(frame_id, lambda slot: self.ring.decode_into(slot, path))
+
+    def submit_array(self, frame_id, frame):
+        """Queue an RGB uint8 array (one copy into the ring)"""
+        if not self.ring.fits(frame.shape):
+            raise ValueError(f"frame {frame.shape} does not fit slot {self.ring.max_shape}")
+        self._submit(frame_id, lambda slot: self.ring.write(slot, frame))
+
+    def get(self, timeout=None):
+        """Next finished (frame_id, AnalysisRecord or None); queue.Empty after `timeout` seconds"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if self._lost:
+                return self._lost.pop(0), None
+            wait = self.poll if deadline is None else min(self.poll, max(0.0, deadline - time.monotonic()))
+            try:
+                seq, data, error = self.results.get(timeout=wait)
+            except queue.Empty:
+                self.check_workers()
+                if not self._lost and deadline is not None and time.monotonic() >= deadline:
+                    raise
+                continue
+            entry = self.inflight.pop(seq, None)
+            if entry is None:
+                continue                # already reported as lost with its dead worker
+            if error is not None:
+                self.errors[entry[0]] = error
+            return entry[0], AnalysisRecord.from_bytes(data) if data is not None else None
+
+    def map(self, paths):
+        """Analyze files (frame id = path), yielding results as they complete"""
+        for path in paths:
+            # Hand back whatever is already finished while the ring keeps the workers busy
+            while self.pending:
+                try:
+                    yield self.get(timeout=0)
+                except queue.Empty:
+                    break
+            try:
+                self.submit_path(path, path)
+            except (OSError, ValueError) as e:
+                self.errors[path] = repr(e)
+                yield path, None
+        while self.pending:
+            yield self.get()
+
+    def close(self):
+        for _ in self.processes:
+            self.jobs.put(None)
+        for p in self.processes:
+            p.join()
+        self.ring.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Analyze images through the shared-memory frame ring")
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("-w", "--workers", type=int, default=2)
+    parser.add_argument("--grabcut", action="store_true")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    with RingAnalysisPool(args.workers, use_grabcut=args.grabcut) as pool:
+        for name, record in pool.map(args.images):
+            print(f"{name}: " + (f"failed: {pool.errors[name]}" if record is None else
+                                 f"{record.to_dict()['health']['grade']} ({record.health.score})"))
+    elapsed = time.perf_counter() - start
+    print(f"{len(args.images)} images in {elapsed:.2f} s ({len(args.images) / elapsed:.1f} images/s)")
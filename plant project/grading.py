@@ -0,0 +1,92 @@
+"""
+=============================================================================
+HEALTH GRADES, STATUSES & SCORING RULES
+=============================================================================
+Features:
+- Score -> grade table and the health status texts of classify_health
+- Ratio cut-offs behind the status text
+- The pure scoring rules: spot size / shape class, spot severity and the
+  health score, grade and status
+- No UI or analyzer imports, so result containers, workers and the
+  synthetic generator can use them without loading the Streamlit app
+=============================================================================
+"""
+
+import math
+
+
+# (minimum score, grade, text, color), best first
+HEALTH_GRADES = [
+    (90, "A+", "Excellent", "#00ff88"),
+    (80, "A", "Very Good", "#66ff00"),
+    (70, "B", "Good", "#ccff00"),
+    (60, "C", "Fair", "#ffaa00"),
+    (50, "D", "Poor", "#ff6600"),
+    (0, "F", "Critical", "#ff4444")
+]
+
+HEALTH_STATUSES = {
+    'healthy': "Healthy (صحي)",
+    'diseased': "Diseased/Necrotic (مريض/نخر)",
+    'stress': "Water/Nutrient Stress (إجهاد)",
+    'moderate': "Moderate Issues (مشاكل متوسطة)"
+}
+
+# Ratio cut-offs used by classify_health for the status text
+STATUS_THRESHOLDS = {'green': (85,), 'yellow': (5, 15), 'brown': (2, 15)}
+
+
+# =============================================================================
+# SCORING RULES
+# =============================================================================
+
+def classify_spot(area, perim):
+    """Size class and shape type of one spot (area / perimeter in full-resolution pixels)"""
+    if area < 100:
+        size, sev = 'small', 1
+    elif area < 500:
+        size, sev = 'medium', 2
+    else:
+        size, sev = 'large', 3
+
+    if perim <= 0:
+        return size, None
+    circ = 4 * math.pi * area / (perim ** 2)
+    dtype = "Fungal" if circ > 0.75 else "Bacterial" if circ > 0.5 else "Physical"
+    return size, {'type': dtype, 'circ': round(circ, 2), 'sev': sev}
+
+
+def spot_severity(spots):
+    return min(100, spots['small']*5 + spots['medium']*15 + spots['large']*30)
+
+
+def classify_health(green, yellow, brown, spots, lbp, thresholds=STATUS_THRESHOLDS):
+    """Health classification with scoring"""
+    score = 100
+    score += green * 0.5 - yellow * 1.2 - brown * 2.5 - lbp * 2 - spots['severity'] * 0.3
+    score = max(0, min(100, round(score, 1)))
+
+    grade, text, color = next((g, t, c) for floor, g, t, c in HEALTH_GRADES if score >= floor)
+
+    t = thresholds
+    if green > t['green'][0] and yellow < t['yellow'][0] and brown < t['brown'][0]:
+        status = HEALTH_STATUSES['healthy']
+        problems = ["No significant issues detected"]
+    elif brown > t['brown'][1]:
+        status = HEALTH_STATUSES['diseased']
+        problems = [f"High necrosis ({brown}%)", "Possible fungal infection"]
+    elif yellow > t['yellow'][1]:
+        status = HEALTH_STATUSES['stress']
+        problems = [f"Chlorosis detected ({yellow}%)", "Check watering/nutrients"]
+    else:
+        status = HEALTH_STATUSES['moderate']
+        problems = ["Early stress signs", "Monitor closely"]
+
+    return {
+        'status': status,
+        'score': score,
+        'grade': grade,
+        'text': text,
+        'color': color,
+        'problems': problems
+    }
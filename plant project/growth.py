@@ -0,0 +1,314 @@
+"""
+=============================================================================
+LEAF AREA AND GROWTH MEASUREMENT
+=============================================================================
+Features:
+- "leaf_area" pipeline stage: canopy area, convex hull area, perimeter,
+  compactness and solidity of the vegetation mask from one contour pass,
+  plus green / yellow / brown tissue areas
+- Pixel -> cm² conversion from an AreaScale: a fixed camera calibration
+  (focal length and working distance, or a measured cm / pixel) or an
+  ArUco reference marker of known size detected in each frame. The scale
+  is read-only during analysis, so one analyzer can serve many cameras
+- Compact per-plant growth history (float arrays of time and area) with
+  growth rate, relative growth rate and doubling time updated in O(1)
+  per frame from running least-squares sums; frames where a plant's
+  marker is hidden reuse that plant's last marker scale
+=============================================================================
+
+    analyzer = UltimatePlantAnalyzer(area_scale=AreaScale(marker_cm=4.0))
+    growth = GrowthTracker()
+    for plant_id, timestamp, img in frames:
+        result = analyzer.analyze(img, pipeline=AREA_PIPELINE, outputs=AREA_OUTPUTS)
+        print(growth.update(plant_id, result, timestamp))
+"""
+
+import json
+import math
+import time
+from array import array
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+HAS_ARUCO = hasattr(cv2, "aruco") and hasattr(cv2.aruco, "ArucoDetector")
+
+import leaves  # noqa: F401  (registers the "vegetation" stage)
+from pipeline import DEFAULT_PIPELINE, PIPELINES, RESULT_ARTIFACTS, Pipeline, register_stage
+
+
+DEFAULT_MARKER_DICT = "DICT_4X4_50"
+GROWTH_ALPHA = 0.3            # EWMA weight of the newest frame-to-frame relative growth rate
+SECONDS_PER_DAY = 86400.0
+
+
+# =============================================================================
+# SCALE CALIBRATION
+# =============================================================================
+
+def marker_side_px(img, marker_dict=DEFAULT_MARKER_DICT):
+    """Mean side length (pixels) of the largest ArUco marker in a BGR / gray frame, or None"""
+    if not HAS_ARUCO:
+        return None
+    dictionary = cv2.aruco.getPredefinedDictionary(getattr(cv2.aruco, marker_dict))
+    corners, ids, _ = cv2.aruco.ArucoDetector(dictionary).detectMarkers(img)
+    if ids is None or not len(corners):
+        return None
+    sides = [np.linalg.norm(np.roll(c[0], -1, axis=0) - c[0], axis=1).mean() for c in corners]
+    return float(max(sides))
+
+
+class AreaScale:
+    """
+    Physical scale of one camera. `cm_per_px` is given at the camera's
+    native resolution; with `marker_cm` an ArUco marker of that side length
+    is looked for in every frame and, when found, overrides it. Nothing is
+    stored per frame: the last marker scale of a plant whose marker is
+    hidden is kept by GrowthTracker.
+    """
+
+    def __init__(self, cm_per_px=None, marker_cm=None, marker_dict=DEFAULT_MARKER_DICT):
+        if cm_per_px is None and marker_cm is None:
+            raise ValueError("AreaScale needs cm_per_px or marker_cm")
+        if marker_cm is not None and not HAS_ARUCO:
+            raise ImportError("Marker detection requires OpenCV with the aruco module")
+        self.cm_per_px = cm_per_px
+        self.marker_cm = marker_cm
+        self.marker_dict = marker_dict
+
+    @classmethod
+    def from_camera(cls, focal_px, distance_cm):
+        """Pinhole camera looking straight at the canopy plane from `distance_cm`"""
+        return cls(cm_per_px=distance_cm / focal_px)
+
+    @classmethod
+    def from_marker_image(cls, img, marker_cm, marker_dict=DEFAULT_MARKER_DICT):
+        """Fixed scale measured once from a frame showing the marker (native resolution)"""
+        side = marker_side_px(img, marker_dict)
+        if side is None:
+            raise ValueError("No ArUco marker found in the calibration image")
+        return cls(cm_per_px=marker_cm / side)
+
+    def measure(self, original, native_width):
+        """
+        (cm per pixel of the analysis-resolution frame `original`, source):
+        source is "marker" or "camera"; (None, None) without marker or calibration.
+        """
+        if self.marker_cm is not None:
+            side = marker_side_px(original, self.marker_dict)
+            if side is not None:
+                return self.marker_cm / side, "marker"
+        if self.cm_per_px is None:
+            return None, None
+        return self.cm_per_px * native_width / original.shape[1], "camera"
+
+    def to_dict(self):
+        return {'cm_per_px': self.cm_per_px, 'marker_cm': self.marker_cm, 'marker_dict': self.marker_dict}
+
+
+# =============================================================================
+# MEASUREMENT
+# =============================================================================
+
+def shape_measurements(mask):
+    """
+    Area, convex hull area, perimeter, compactness (4πA / P²) and solidity
+    (A / hull area) in pixels, from one external-contour pass over `mask`.
+    The hull spans all regions (canopy outline); holes count as area.
+    """
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return {'area': 0.0, 'hull_area': 0.0, 'perimeter': 0.0, 'compactness': 0.0, 'solidity': 0.0}
+    area = sum(cv2.contourArea(c) for c in contours)
+    perimeter = sum(cv2.arcLength(c, True) for c in contours)
+    hull_area = cv2.contourArea(cv2.convexHull(np.concatenate(contours)))
+    return {
+        'area': area,
+        'hull_area': hull_area,
+        'perimeter': perimeter,
+        'compactness': 4 * np.pi * area / perimeter ** 2 if perimeter > 0 else 0.0,
+        'solidity': area / hull_area if hull_area > 0 else 0.0
+    }
+
+
+def _native_width(image):
+    # PIL images have .size (w, h); arrays are (h, w[, c])
+    return image.size[0] if hasattr(image, 'size') and isinstance(image.size, tuple) else np.asarray(image).shape[1]
+
+
+@register_stage("leaf_area", inputs=["image", "original", "veg_mask", "g_mask", "y_mask", "b_mask"],
+                outputs=["area"])
+def stage_leaf_area(an, options, image, original, veg_mask, g_mask, y_mask, b_mask):
+    an.step_explanations.append(("leaf_area", "Measured"))
+    shape = shape_measurements(veg_mask)
+    tissue = {name: cv2.countNonZero(cv2.bitwise_and(m, veg_mask))
+              for name, m in (('green', g_mask), ('yellow', y_mask), ('brown', b_mask))}
+    scale = getattr(an, 'area_scale', None)
+    cm_per_px, source = scale.measure(original, _native_width(image)) if scale is not None else (None, None)
+
+    area = {
+        'px': round(shape['area'], 1),
+        'hull_px': round(shape['hull_area'], 1),
+        'perimeter_px': round(shape['perimeter'], 1),
+        'compactness': round(shape['compactness'], 4),
+        'solidity': round(shape['solidity'], 4),
+        'cm_per_px': cm_per_px,
+        'scale_source': source,
+        'width_px': original.shape[1]
+    }
+    if cm_per_px is not None:
+        cm2 = cm_per_px ** 2
+        area.update({
+            'cm2': round(shape['area'] * cm2, 2),
+            'hull_cm2': round(shape['hull_area'] * cm2, 2),
+            'perimeter_cm': round(shape['perimeter'] * cm_per_px, 2)
+        })
+        area.update({f'{name}_cm2': round(px * cm2, 2) for name, px in tissue.items()})
+    else:
+        area.update({f'{name}_px': px for name, px in tissue.items()})
+    return {'area': area}
+
+
+AREA_PIPELINE = Pipeline("area", [s.name for s in DEFAULT_PIPELINE.stages] + ["vegetation", "leaf_area"])
+PIPELINES["area"] = AREA_PIPELINE
+
+# analyze(..., pipeline=AREA_PIPELINE, outputs=AREA_OUTPUTS)
+AREA_OUTPUTS = RESULT_ARTIFACTS + ("area",)
+
+
+# =============================================================================
+# GROWTH HISTORY
+# =============================================================================
+
+class GrowthState:
+    """
+    History and running statistics of one plant. Times are days since the
+    first observation; the least-squares sums make each update O(1).
+    """
+
+    __slots__ = ("unit", "t0", "times", "areas", "n", "st", "stt", "sa", "sta", "sl", "stl", "ewma_rgr")
+
+    def __init__(self, unit, t0):
+        self.unit = unit
+        self.t0 = t0
+        self.times = array('d')
+        self.areas = array('f')
+        self.n = 0
+        self.st = self.stt = self.sa = self.sta = self.sl = self.stl = 0.0
+        self.ewma_rgr = None
+
+    def push(self, timestamp, area, alpha=GROWTH_ALPHA):
+        t = (timestamp - self.t0) / SECONDS_PER_DAY
+        log_area = math.log(max(area, 1e-6))
+        if self.n and t > self.times[-1] and self.areas[-1] > 0 and area > 0:
+            step = (log_area - math.log(self.areas[-1])) / (t - self.times[-1])
+            self.ewma_rgr = step if self.ewma_rgr is None else self.ewma_rgr + alpha * (step - self.ewma_rgr)
+        self.times.append(t)
+        self.areas.append(area)
+        self.n += 1
+        self.st += t
+        self.stt += t * t
+        self.sa += area
+        self.sta += t * area
+        self.sl += log_area
+        self.stl += t * log_area
+
+    def _slope(self, sy, sty):
+        denom = self.n * self.stt - self.st * self.st
+        if self.n < 2 or denom <= 1e-12:
+            return None
+        return (self.n * sty - self.st * sy) / denom
+
+    def summary(self):
+        rate = self._slope(self.sa, self.sta)
+        rgr = self._slope(self.sl, self.stl)
+        first, last = self.areas[0], self.areas[-1]
+        return {
+            'unit': self.unit,
+            'area': round(last, 2),
+            'observations': self.n,
+            'days': round(self.times[-1], 3),
+            'rate_per_day': None if rate is None else round(rate, 3),
+            'rgr_per_day': None if rgr is None else round(rgr, 4),
+            'recent_rgr_per_day': None if self.ewma_rgr is None else round(self.ewma_rgr, 4),
+            'doubling_days': round(math.log(2) / rgr, 1) if rgr and rgr > 0 else None,
+            'change_pct': round((last - first) / first * 100, 2) if first > 0 else None
+        }
+
+
+class GrowthTracker:
+    """
+    Incremental growth statistics per plant from analyze() results with an
+    'area' entry (AREA_PIPELINE). Areas are tracked in cm² when the result
+    has them, otherwise in pixels; one plant must stay in one unit. The
+    scale of a plant's last marker frame (as cm per frame width) converts
+    its frames where the marker is hidden.
+    """
+
+    def __init__(self, alpha=GROWTH_ALPHA, max_plants=None):
+        self.alpha = alpha
+        self.max_plants = max_plants
+        self.plants = OrderedDict()
+        self.marker_scales = {}
+
+    def update(self, plant_id, result, timestamp=None):
+        """Add one result; returns the plant's growth summary"""
+        area = result['area']
+        if area.get('scale_source') == "marker":
+            self.marker_scales[plant_id] = area['cm_per_px'] * area['width_px']
+        if 'cm2' in area:
+            unit, value = 'cm2', area['cm2']
+        elif plant_id in self.marker_scales:
+            unit, value = 'cm2', area['px'] * (self.marker_scales[plant_id] / area['width_px']) ** 2
+        else:
+            unit, value = 'px', area['px']
+        return self.add(plant_id, value, unit, timestamp)
+
+    def add(self, plant_id, value, unit="cm2", timestamp=None):
+        """Add one area measurement (timestamp: datetime or epoch seconds, default now)"""
+        if timestamp is None:
+            timestamp = time.time()
+        elif hasattr(timestamp, 'timestamp'):
+            timestamp = timestamp.timestamp()
+        state = self.plants.get(plant_id)
+        if state is None:
+            state = GrowthState(unit, timestamp)
+            self.plants[plant_id] = state
+            if self.max_plants is not None and len(self.plants) > self.max_plants:
+                evicted, _ = self.plants.popitem(last=False)    # least recently updated plant
+                self.marker_scales.pop(evicted, None)
+        else:
+            self.plants.move_to_end(plant_id)
+            if state.unit != unit:
+                raise ValueError(f"{plant_id}: area history is in {state.unit}, got {unit}")
+        state.push(timestamp, float(value), self.alpha)
+        return state.summary()
+
+    def summary(self, plant_id):
+        return self.plants[plant_id].summary()
+
+    def history(self, plant_id):
+        """(days since first observation, areas) as arrays"""
+        state = self.plants[plant_id]
+        return np.frombuffer(state.times, dtype=np.float64), np.frombuffer(state.areas, dtype=np.float32)
+
+    def save(self, path):
+        meta = {pid: {'unit': s.unit, 't0': s.t0, 'marker_scale': self.marker_scales.get(pid)}
+                for pid, s in self.plants.items()}
+        arrays = {"meta": np.array(json.dumps(meta))}
+        for i, (pid, s) in enumerate(self.plants.items()):
+            arrays[f"t{i}"], arrays[f"a{i}"] = self.history(pid)
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path, alpha=GROWTH_ALPHA, max_plants=None):
+        """Rebuild the running statistics by replaying the stored histories"""
+        data = np.load(path)
+        tracker = cls(alpha, max_plants)
+        for i, (pid, meta) in enumerate(json.loads(str(data["meta"])).items()):
+            for t, a in zip(data[f"t{i}"], data[f"a{i}"]):
+                tracker.add(pid, float(a), meta['unit'], meta['t0'] + float(t) * SECONDS_PER_DAY)
+            if meta.get('marker_scale') is not None:
+                tracker.marker_scales[pid] = meta['marker_scale']
+        return tracker
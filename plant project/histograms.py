@@ -0,0 +1,206 @@
+"""
+=============================================================================
+HSV HISTOGRAM SIDECAR & FAST RE-THRESHOLDING
+=============================================================================
+Features:
+- Sparse quantized 3D HSV histogram per image (foreground only), emitted by
+  the "hsv_histogram" pipeline stage (36 x 16 x 16 bins)
+- Sharded, compressed archive of histograms next to the image archive
+- Re-thresholding engine: per shard a 3D summed-area table is built once;
+  every threshold set then costs a fixed number of table lookups per color
+  per image, so new HSV bounds can be previewed over millions of images
+  without decoding them
+=============================================================================
+
+Previewed ratios are approximate: bounds that fall inside a bin (H in steps
+of 5, S / V in steps of 16) are interpolated linearly within it, and the
+morphological opening / closing of analyze() is not applied.
+
+    with HistogramWriter("archive_hist") as out:
+        for path in paths:
+            out.add(path, analyzer.analyze(img, outputs=RESULT_ARTIFACTS + ("hsv_hist",))['hsv_hist'])
+
+    engine = RethresholdEngine("archive_hist")
+    ids, ratios = engine.ratios({'brown': ([10, 40, 20], [22, 255, 200])})
+"""
+
+import json
+import os
+
+import numpy as np
+
+from pipeline import HSV_HIST_BINS, HSV_HIST_RANGES, RESULT_ARTIFACTS
+
+
+DEFAULT_SHARD_SIZE = 2048
+DEFAULT_CACHED_SHARDS = 4      # summed-area tables kept in memory (~80 MB per full shard)
+
+COLORS = ("green", "yellow", "brown")
+
+
+def analyzer_bounds(analyzer):
+    """{color: (lower, upper)} of an analyzer's current HSV bounds"""
+    return {c: (getattr(analyzer, f"{c}_lower"), getattr(analyzer, f"{c}_upper")) for c in COLORS}
+
+
+# =============================================================================
+# ARCHIVE
+# =============================================================================
+
+class HistogramWriter:
+    """Appends sparse histograms to numbered compressed shards in `directory`"""
+
+    def __init__(self, directory, shard_size=DEFAULT_SHARD_SIZE):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.shard_size = shard_size
+        self.shard = len([n for n in os.listdir(directory) if n.startswith("shard_")])
+        self._reset()
+        self.count = 0
+
+    def _reset(self):
+        self.ids, self.bins, self.counts = [], [], []
+
+    def add(self, image_id, hsv_hist):
+        bins, counts = hsv_hist
+        self.ids.append(str(image_id))
+        self.bins.append(np.asarray(bins, dtype=np.uint16))
+        self.counts.append(np.asarray(counts, dtype=np.uint32))
+        self.count += 1
+        if len(self.ids) >= self.shard_size:
+            self.flush()
+
+    def flush(self):
+        if not self.ids:
+            return
+        offsets = np.zeros(len(self.bins) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in self.bins], out=offsets[1:])
+        np.savez_compressed(
+            os.path.join(self.directory, f"shard_{self.shard:06d}.npz"),
+            ids=np.array(self.ids), offsets=offsets,
+            bins=np.concatenate(self.bins), counts=np.concatenate(self.counts)
+        )
+        with open(os.path.join(self.directory, "meta.json"), "w") as f:
+            json.dump({"bins": HSV_HIST_BINS, "ranges": HSV_HIST_RANGES}, f)
+        self.shard += 1
+        self._reset()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def histogram_batch(directory, paths, analyzer, use_grabcut=False):
+    """Analyze images and write their histograms; returns the number written"""
+    from PIL import Image
+
+    with HistogramWriter(directory) as out:
+        for path in paths:
+            with Image.open(path) as img:
+                result = analyzer.analyze(img.convert('RGB'), use_grabcut, outputs=RESULT_ARTIFACTS + ("hsv_hist",))
+            if result is not None:
+                out.add(path, result['hsv_hist'])
+        return out.count
+
+
+# =============================================================================
+# RE-THRESHOLDING
+# =============================================================================
+
+class _Shard:
+    """Image ids, foreground totals and the summed-area table of one shard"""
+
+    def __init__(self, path, bins_shape):
+        data = np.load(path)
+        self.ids = data["ids"]
+        n = len(self.ids)
+        offsets, bins, counts = data["offsets"], data["bins"].astype(np.int64), data["counts"]
+        image = np.repeat(np.arange(n), np.diff(offsets))
+
+        size = int(np.prod(bins_shape))
+        dense = np.zeros(n * size, dtype=np.uint32)
+        dense[image * size + bins] = counts
+        dense = dense.reshape((n,) + tuple(bins_shape))
+        self.totals = dense.reshape(n, -1).sum(axis=1, dtype=np.int64)
+
+        # sat[i, h, s, v] = pixels of image i in bins [0, h) x [0, s) x [0, v)
+        sat = np.zeros((n,) + tuple(b + 1 for b in bins_shape), dtype=np.uint32)
+        for axis in (1, 2, 3):
+            np.cumsum(dense, axis=axis, dtype=np.uint32, out=dense)
+        sat[:, 1:, 1:, 1:] = dense
+        self.sat = sat
+
+    def cumulative(self, h, s, v):
+        """Pixels below fractional bin coordinates (h, s, v): trilinear interpolation of the table"""
+        corners = []
+        for x, n in zip((h, s, v), self.sat.shape[1:]):
+            i = min(int(x), n - 2)
+            corners.append(((i, 1 - (x - i)), (i + 1, x - i)))
+        total = 0.0
+        for hi, hw in corners[0]:
+            for si, sw in corners[1]:
+                for vi, vw in corners[2]:
+                    w = hw * sw * vw
+                    if w:
+                        total = total + w * self.sat[:, hi, si, vi]
+        return total
+
+    def box_counts(self, box):
+        """Pixels per image inside a box of fractional bin coordinates ((h0, h1), (s0, s1), (v0, v1))"""
+        (h0, h1), (s0, s1), (v0, v1) = box
+        f = self.cumulative
+        return (f(h1, s1, v1) - f(h0, s1, v1) - f(h1, s0, v1) - f(h1, s1, v0)
+                + f(h0, s0, v1) + f(h0, s1, v0) + f(h1, s0, v0) - f(h0, s0, v0))
+
+
+class RethresholdEngine:
+    """
+    Preview ratios for new HSV bounds from a histogram archive.
+
+    Summed-area tables are built per shard on first use and kept in an LRU
+    of `max_cached_shards` shards (about 40 KB per image); evicted shards are
+    rebuilt when needed again. None keeps every shard.
+    """
+
+    def __init__(self, directory, max_cached_shards=DEFAULT_CACHED_SHARDS):
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        self.bins = tuple(meta["bins"])
+        self.ranges = tuple(meta["ranges"])
+        self.paths = sorted(os.path.join(directory, n) for n in os.listdir(directory) if n.startswith("shard_"))
+        self.max_cached_shards = max_cached_shards
+        self._shards = {}
+
+    def _shard(self, path):
+        shard = self._shards.pop(path, None) or _Shard(path, self.bins)
+        self._shards[path] = shard
+        if self.max_cached_shards is not None and len(self._shards) > self.max_cached_shards:
+            del self._shards[next(iter(self._shards))]
+        return shard
+
+    def to_box(self, lower, upper):
+        """Inclusive HSV bounds -> fractional bin coordinates [lower, upper + 1)"""
+        return [(float(np.clip(lo / (r / n), 0, n)), float(np.clip((hi + 1) / (r / n), 0, n)))
+                for lo, hi, n, r in zip(lower, upper, self.bins, self.ranges)]
+
+    def ratios(self, bounds):
+        """
+        `bounds` = {color: (lower, upper)}; returns (image ids, {color: percent array})
+        over every archived image, as analyze() would report before morphology.
+        """
+        boxes = {c: self.to_box(lo, hi) for c, (lo, hi) in bounds.items()}
+        ids, out = [], {c: [] for c in boxes}
+        for path in self.paths:
+            shard = self._shard(path)
+            total = np.maximum(shard.totals, 1)
+            ids.append(shard.ids)
+            for c, box in boxes.items():
+                out[c].append(shard.box_counts(box) / total * 100)
+        if not ids:
+            return np.array([]), {c: np.array([]) for c in boxes}
+        return np.concatenate(ids), {c: np.concatenate(v) for c, v in out.items()}
@@ -0,0 +1,549 @@
+"""
+=============================================================================
+DISTRIBUTED ANALYSIS JOB QUEUE
+=============================================================================
+Features:
+- Producer API: submit image references (paths on shared storage) with
+  analysis options; job ids derive from path + options, so resubmitting
+  the same image is a no-op
+- Pluggable brokers: SQLite (single host / shared volume, no server) and
+  Redis (optional, any Redis-compatible server) behind one interface
+- Leases + acknowledgement: a job whose worker dies is handed out again
+  when its lease expires; failures are retried with exponential backoff
+  and parked as "dead" after max_attempts. Only the current lease holder
+  (worker + attempt number) can ack or nack; late calls are no-ops
+- Idempotent result writes: the first result for a job id wins, duplicate
+  deliveries cannot overwrite or double count it
+- Workers are plain processes on any node; per-node throughput is
+  recorded with every acknowledgement
+=============================================================================
+
+    queue = JobQueue(open_broker("sqlite:///jobs.db"))
+    queue.submit_many(paths, use_grabcut=True)
+    run_workers("sqlite:///jobs.db", workers=4)          # on each node
+    for job_id, path, record in queue.results():
+        ...
+"""
+
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+try:
+    import redis
+    HAS_REDIS = True
+except ImportError:
+    HAS_REDIS = False
+
+from results import AnalysisRecord
+
+
+DEFAULT_LEASE = 300.0          # seconds a reserved job belongs to its worker
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_BACKOFF = 5.0          # seconds before the first retry, doubled per attempt
+DEFAULT_POLL = 0.5             # idle worker poll interval
+
+JOB_STATES = ("queued", "running", "done", "dead")
+
+# analyze() keyword options a job may carry
+JOB_OPTIONS = ("use_grabcut", "max_size", "crop_to_fg", "pipeline")
+
+
+def job_id_for(path, options):
+    """Deterministic id: the same image reference with the same options is the same job"""
+    return hashlib.sha1(json.dumps([os.path.abspath(path), options], sort_keys=True).encode()).hexdigest()[:20]
+
+
+def node_name():
+    return socket.gethostname()
+
+
+class Job:
+    __slots__ = ("id", "path", "options", "attempts")
+
+    def __init__(self, job_id, path, options, attempts):
+        self.id = job_id
+        self.path = path
+        self.options = options
+        self.attempts = attempts
+
+
+# =============================================================================
+# SQLITE BROKER
+# =============================================================================
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY, path TEXT NOT NULL, options TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'queued', attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL, available_at REAL NOT NULL, lease_until REAL,
+    worker TEXT, error TEXT, created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (state, available_at);
+CREATE TABLE IF NOT EXISTS results (
+    job_id TEXT PRIMARY KEY, worker TEXT, data BLOB, finished REAL
+);
+CREATE TABLE IF NOT EXISTS nodes (
+    node TEXT PRIMARY KEY, jobs INTEGER NOT NULL DEFAULT 0, failures INTEGER NOT NULL DEFAULT 0,
+    busy REAL NOT NULL DEFAULT 0, first_seen REAL, last_seen REAL
+);
+"""
+
+
+class SQLiteBroker:
+    """
+    Broker in one SQLite file (WAL mode). Good for a single host or a few
+    nodes on a shared volume with working file locks; reservation is one
+    short write transaction.
+    """
+
+    def __init__(self, path, lease=DEFAULT_LEASE, backoff=DEFAULT_BACKOFF):
+        self.path = path
+        self.lease = lease
+        self.backoff = backoff
+        self._local = threading.local()
+        self._conn().executescript(_SCHEMA)
+
+    def __getstate__(self):
+        return {'path': self.path, 'lease': self.lease, 'backoff': self.backoff}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _conn(self):
+        # One connection per thread (and per process after a fork: the state is rebuilt on unpickling)
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, job_id, path, options, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        """Returns True if the job is new"""
+        now = time.time()
+        cur = self._conn().execute(
+            "INSERT OR IGNORE INTO jobs (id, path, options, max_attempts, available_at, created) "
+            "VALUES (?, ?, ?, ?, ?, ?)", (job_id, path, json.dumps(options), max_attempts, now, now))
+        return cur.rowcount == 1
+
+    def reserve(self, worker):
+        """Next runnable job (queued, or running with an expired lease), or None"""
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Expired leases that already used every attempt are parked instead of re-run
+            conn.execute("UPDATE jobs SET state = 'dead', error = 'lease expired' "
+                         "WHERE state = 'running' AND lease_until < ? AND attempts >= max_attempts", (now,))
+            row = conn.execute(
+                "SELECT id, path, options, attempts FROM jobs "
+                "WHERE (state = 'queued' AND available_at <= ?) OR (state = 'running' AND lease_until < ?) "
+                "ORDER BY available_at LIMIT 1", (now, now)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE jobs SET state = 'running', attempts = attempts + 1, lease_until = ?, "
+                             "worker = ? WHERE id = ?", (now + self.lease, worker, row[0]))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        return Job(row[0], row[1], json.loads(row[2]), row[3] + 1)
+
+    def ack(self, job, worker, data, seconds):
+        """
+        Store the result (first write wins) and mark the job done. Returns
+        False, changing nothing, if `worker` no longer holds this attempt's lease.
+        """
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cur = conn.execute("UPDATE jobs SET state = 'done', lease_until = NULL, error = NULL "
+                               "WHERE id = ? AND state = 'running' AND worker = ? AND attempts = ?",
+                               (job.id, worker, job.attempts))
+            if cur.rowcount:
+                conn.execute("INSERT OR IGNORE INTO results (job_id, worker, data, finished) VALUES (?, ?, ?, ?)",
+                             (job.id, worker, data, now))
+                self._record_node(conn, worker, now, seconds, failed=False)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return cur.rowcount == 1
+
+    def nack(self, job, worker, error, seconds):
+        """
+        Failed attempt: retry after a backoff, or park the job once attempts
+        run out. Like ack(), a no-op returning False for a lost lease.
+        """
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cur = conn.execute(
+                "UPDATE jobs SET state = CASE WHEN attempts >= max_attempts THEN 'dead' ELSE 'queued' END, "
+                "available_at = ?, lease_until = NULL, error = ? "
+                "WHERE id = ? AND state = 'running' AND worker = ? AND attempts = ?",
+                (now + self.backoff * 2 ** (job.attempts - 1), str(error)[:500], job.id, worker, job.attempts))
+            if cur.rowcount:
+                self._record_node(conn, worker, now, seconds, failed=True)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return cur.rowcount == 1
+
+    def _record_node(self, conn, worker, now, seconds, failed):
+        node = worker.rsplit(":", 1)[0]
+        conn.execute(
+            "INSERT INTO nodes (node, jobs, failures, busy, first_seen, last_seen) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (node) DO UPDATE SET jobs = jobs + excluded.jobs, failures = failures + excluded.failures, "
+            "busy = busy + excluded.busy, last_seen = excluded.last_seen",
+            (node, 0 if failed else 1, 1 if failed else 0, seconds, now - seconds, now))
+
+    def result(self, job_id):
+        row = self._conn().execute("SELECT data FROM results WHERE job_id = ?", (job_id,)).fetchone()
+        return None if row is None else row[0]
+
+    def results(self):
+        """(job_id, path, result bytes) of every finished job"""
+        yield from self._conn().execute(
+            "SELECT r.job_id, j.path, r.data FROM results r JOIN jobs j ON j.id = r.job_id ORDER BY r.finished")
+
+    def counts(self):
+        counts = dict.fromkeys(JOB_STATES, 0)
+        counts.update(self._conn().execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+        return counts
+
+    def failures(self):
+        """(job_id, path, attempts, error) of dead jobs"""
+        return self._conn().execute("SELECT id, path, attempts, error FROM jobs WHERE state = 'dead'").fetchall()
+
+    def node_stats(self):
+        """{node: {'jobs', 'failures', 'busy', 'first_seen', 'last_seen'}}"""
+        rows = self._conn().execute("SELECT node, jobs, failures, busy, first_seen, last_seen FROM nodes")
+        return {r[0]: dict(zip(('jobs', 'failures', 'busy', 'first_seen', 'last_seen'), r[1:])) for r in rows}
+
+
+# =============================================================================
+# REDIS BROKER (OPTIONAL)
+# =============================================================================
+
+# Move the oldest runnable id from the ready set to the lease set and take
+# the lease (attempt number + worker) atomically
+_RESERVE_SCRIPT = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, 1)
+if #ids == 0 then return false end
+local key = ARGV[4] .. ids[1]
+redis.call('ZREM', KEYS[1], ids[1])
+redis.call('ZADD', KEYS[2], ARGV[2], ids[1])
+local attempts = redis.call('HINCRBY', key, 'attempts', 1)
+redis.call('HSET', key, 'state', 'running', 'worker', ARGV[3])
+return {ids[1], attempts}
+"""
+
+# Give up a lease if (and only if) ARGV[2] still holds it for attempt ARGV[3]
+_RELEASE_SCRIPT = """
+local lease = redis.call('HMGET', KEYS[1], 'state', 'worker', 'attempts')
+if lease[1] ~= 'running' or lease[2] ~= ARGV[2] or lease[3] ~= ARGV[3] then return 0 end
+return redis.call('ZREM', KEYS[2], ARGV[1])
+"""
+
+
+class RedisBroker:
+    """
+    Broker on a Redis-compatible server: a "ready" sorted set scored by
+    the time a job becomes runnable, a "leases" sorted set scored by lease
+    expiry, one hash per job and a results hash written with HSETNX.
+    """
+
+    def __init__(self, url, lease=DEFAULT_LEASE, backoff=DEFAULT_BACKOFF, prefix="plantq"):
+        if not HAS_REDIS:
+            raise ImportError("The Redis broker requires redis-py (pip install redis)")
+        self.url = url
+        self.lease = lease
+        self.backoff = backoff
+        self.prefix = prefix
+        self.r = redis.Redis.from_url(url)
+        self._reserve = self.r.register_script(_RESERVE_SCRIPT)
+        self._release = self.r.register_script(_RELEASE_SCRIPT)
+
+    def __getstate__(self):
+        return {'url': self.url, 'lease': self.lease, 'backoff': self.backoff, 'prefix': self.prefix}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _key(self, *parts):
+        return ":".join((self.prefix,) + parts)
+
+    def enqueue(self, job_id, path, options, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        key = self._key("job", job_id)
+        if not self.r.hsetnx(key, "path", path):
+            return False
+        now = time.time()
+        self.r.hset(key, mapping={"options": json.dumps(options), "state": "queued", "attempts": 0,
+                                  "max_attempts": max_attempts, "created": now})
+        self.r.zadd(self._key("ready"), {job_id: now})
+        return True
+
+    def reserve(self, worker):
+        now = time.time()
+        # Requeue jobs whose lease expired (whoever removes the id from the lease set owns the requeue)
+        for raw in self.r.zrangebyscore(self._key("leases"), "-inf", now):
+            if self.r.zrem(self._key("leases"), raw):
+                self.r.zadd(self._key("ready"), {raw: now})
+        while True:
+            reserved = self._reserve(keys=[self._key("ready"), self._key("leases")],
+                                     args=[now, now + self.lease, worker, self._key("job", "")])
+            if not reserved:
+                return None
+            job_id, attempts = reserved[0].decode(), int(reserved[1])
+            key = self._key("job", job_id)
+            fields = self.r.hmget(key, "path", "options", "max_attempts")
+            if attempts > int(fields[2]):
+                self.r.zrem(self._key("leases"), job_id)
+                self.r.hset(key, mapping={"state": "dead", "error": "lease expired"})
+                continue
+            return Job(job_id, fields[0].decode(), json.loads(fields[1]), attempts)
+
+    def _release_lease(self, job, worker):
+        # A lease that expired (requeued or taken over by another worker) is no longer ours
+        return bool(self._release(keys=[self._key("job", job.id), self._key("leases")],
+                                  args=[job.id, worker, job.attempts]))
+
+    def ack(self, job, worker, data, seconds):
+        if not self._release_lease(job, worker):
+            return False
+        self.r.hsetnx(self._key("results"), job.id, data)
+        self.r.hset(self._key("job", job.id), mapping={"state": "done", "finished": time.time()})
+        self._record_node(worker, seconds, failed=False)
+        return True
+
+    def nack(self, job, worker, error, seconds):
+        if not self._release_lease(job, worker):
+            return False
+        key = self._key("job", job.id)
+        if job.attempts >= int(self.r.hget(key, "max_attempts")):
+            self.r.hset(key, mapping={"state": "dead", "error": str(error)[:500]})
+        else:
+            self.r.hset(key, mapping={"state": "queued", "error": str(error)[:500]})
+            self.r.zadd(self._key("ready"), {job.id: time.time() + self.backoff * 2 ** (job.attempts - 1)})
+        self._record_node(worker, seconds, failed=True)
+        return True
+
+    def _record_node(self, worker, seconds, failed):
+        node = worker.rsplit(":", 1)[0]
+        key = self._key("node", node)
+        now = time.time()
+        pipe = self.r.pipeline()
+        pipe.hincrby(key, "failures" if failed else "jobs", 1)
+        pipe.hincrbyfloat(key, "busy", seconds)
+        pipe.hsetnx(key, "first_seen", now - seconds)
+        pipe.hset(key, "last_seen", now)
+        pipe.sadd(self._key("nodes"), node)
+        pipe.execute()
+
+    def result(self, job_id):
+        return self.r.hget(self._key("results"), job_id)
+
+    def results(self):
+        for job_id, data in self.r.hscan_iter(self._key("results")):
+            job_id = job_id.decode()
+            yield job_id, self.r.hget(self._key("job", job_id), "path").decode(), data
+
+    def counts(self):
+        counts = dict.fromkeys(JOB_STATES, 0)
+        for key in self.r.scan_iter(self._key("job", "*")):
+            counts[self.r.hget(key, "state").decode()] += 1
+        return counts
+
+    def failures(self):
+        out = []
+        for key in self.r.scan_iter(self._key("job", "*")):
+            path, state, attempts, error = self.r.hmget(key, "path", "state", "attempts", "error")
+            if state == b"dead":
+                out.append((key.decode().rsplit(":", 1)[1], path.decode(), int(attempts),
+                            error.decode() if error else None))
+        return out
+
+    def node_stats(self):
+        stats = {}
+        for node in self.r.smembers(self._key("nodes")):
+            h = self.r.hgetall(self._key("node", node.decode()))
+            stats[node.decode()] = {
+                'jobs': int(h.get(b"jobs", 0)), 'failures': int(h.get(b"failures", 0)),
+                'busy': float(h.get(b"busy", 0)), 'first_seen': float(h[b"first_seen"]),
+                'last_seen': float(h[b"last_seen"])
+            }
+        return stats
+
+
+def open_broker(url, **kwargs):
+    """sqlite:///path/to/jobs.db, redis://host:6379/0 (or a plain path for SQLite)"""
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBroker(url, **kwargs)
+    return SQLiteBroker(url[len("sqlite:///"):] if url.startswith("sqlite:///") else url, **kwargs)
+
+
+# =============================================================================
+# PRODUCER
+# =============================================================================
+
+class JobQueue:
+    """Producer / reader side of a broker"""
+
+    def __init__(self, broker, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.broker = broker
+        self.max_attempts = max_attempts
+
+    def submit(self, path, job_id=None, **options):
+        """Queue one image reference; returns its job id (existing jobs are not duplicated)"""
+        unknown = set(options) - set(JOB_OPTIONS)
+        if unknown:
+            raise ValueError(f"Unknown job options {sorted(unknown)}, expected {JOB_OPTIONS}")
+        if 'max_size' in options:
+            options['max_size'] = list(options['max_size'])
+        job_id = job_id or job_id_for(path, options)
+        self.broker.enqueue(job_id, path, options, self.max_attempts)
+        return job_id
+
+    def submit_many(self, paths, **options):
+        return [self.submit(path, **options) for path in paths]
+
+    def result(self, job_id):
+        data = self.broker.result(job_id)
+        return None if data is None else AnalysisRecord.from_bytes(data)
+
+    def results(self):
+        """(job_id, path, AnalysisRecord) of finished jobs"""
+        for job_id, path, data in self.broker.results():
+            yield job_id, path, AnalysisRecord.from_bytes(data)
+
+    def wait(self, poll=1.0, timeout=None):
+        """Block until no job is queued or running; returns the final counts"""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            counts = self.broker.counts()
+            if counts['queued'] == 0 and counts['running'] == 0:
+                return counts
+            if deadline is not None and time.time() > deadline:
+                return counts
+            time.sleep(poll)
+
+    def throughput(self):
+        """{node: {'jobs', 'failures', 'jobs_per_s', 'busy_s'}}: jobs per wall-clock second on each node"""
+        out = {}
+        for node, s in self.broker.node_stats().items():
+            wall = max(s['last_seen'] - s['first_seen'], 1e-6)
+            out[node] = {'jobs': s['jobs'], 'failures': s['failures'],
+                         'jobs_per_s': s['jobs'] / wall, 'busy_s': s['busy']}
+        return out
+
+
+# =============================================================================
+# WORKERS
+# =============================================================================
+
+def _analyze_job(analyzer, job):
+    from PIL import Image
+    from pipeline import PIPELINES
+
+    options = dict(job.options)
+    if 'pipeline' in options:
+        options['pipeline'] = PIPELINES[options['pipeline']]
+    if 'max_size' in options:
+        options['max_size'] = tuple(options['max_size'])
+    with Image.open(job.path) as img:
+        result = analyzer.analyze(img.convert('RGB'), **options)
+    if result is None:
+        raise RuntimeError("analysis failed")
+    return AnalysisRecord.from_dict(result).to_bytes()
+
+
+def work(broker, worker=None, max_jobs=None, idle_exit=None, poll=DEFAULT_POLL):
+    """
+    Worker loop: reserve, analyze, acknowledge. Stops after `max_jobs`
+    jobs, or after `idle_exit` seconds without work once nothing is left
+    queued (None = run forever).
+    Returns the number of jobs processed.
+    """
+    from plant_care_system import UltimatePlantAnalyzer
+
+    worker = worker or f"{node_name()}:{os.getpid()}"
+    analyzer = UltimatePlantAnalyzer(strict=True)
+    done, idle_since = 0, time.time()
+    while max_jobs is None or done < max_jobs:
+        job = broker.reserve(worker)
+        if job is None:
+            # Idle: stop unless retries are still waiting out their backoff
+            if idle_exit is not None and time.time() - idle_since > idle_exit and not broker.counts()['queued']:
+                break
+            time.sleep(poll)
+            continue
+        start = time.perf_counter()
+        try:
+            data = _analyze_job(analyzer, job)
+        except Exception as e:
+            broker.nack(job, worker, e, time.perf_counter() - start)
+        else:
+            broker.ack(job, worker, data, time.perf_counter() - start)
+        done += 1
+        idle_since = time.time()
+    return done
+
+
+def _worker_main(url, idle_exit, threads):
+    import cv2
+    cv2.setNumThreads(threads)
+    work(open_broker(url), idle_exit=idle_exit)
+
+
+def run_workers(url, workers=None, idle_exit=None):
+    """Run `workers` worker processes on this node (default: one per core) until they go idle"""
+    from stage_scheduler import configure_threads
+
+    workers = workers or os.cpu_count() or 1
+    threads = configure_threads(1, batch_workers=workers)
+    processes = [mp.Process(target=_worker_main, args=(url, idle_exit, threads)) for _ in range(workers)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Distributed plant analysis job queue")
+    parser.add_argument("broker", help="sqlite:///jobs.db, a .db path, or redis://host:6379/0")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_submit = sub.add_parser("submit", help="queue images")
+    p_submit.add_argument("images", nargs="+")
+    p_submit.add_argument("--grabcut", action="store_true")
+    p_work = sub.add_parser("work", help="run workers on this node")
+    p_work.add_argument("-w", "--workers", type=int, default=None)
+    p_work.add_argument("--idle-exit", type=float, default=None, help="stop after this many idle seconds")
+    sub.add_parser("status", help="job counts and per-node throughput")
+    args = parser.parse_args()
+
+    if args.command == "submit":
+        ids = JobQueue(open_broker(args.broker)).submit_many(args.images, use_grabcut=args.grabcut)
+        print(f"{len(ids)} jobs submitted")
+    elif args.command == "work":
+        run_workers(args.broker, args.workers, args.idle_exit)
+    else:
+        q = JobQueue(open_broker(args.broker))
+        print(q.broker.counts())
+        for node, t in sorted(q.throughput().items()):
+            print(f"{node}: {t['jobs']} jobs, {t['failures']} failures, {t['jobs_per_s']:.2f} jobs/s")
+        for job_id, path, attempts, error in q.broker.failures():
+            print(f"dead {job_id} {path} after {attempts} attempts: {error}")
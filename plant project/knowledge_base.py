@@ -0,0 +1,195 @@
+"""
+=============================================================================
+PLANT KNOWLEDGE BASE
+=============================================================================
+Features:
+- PLANT_DATABASE stored in data/plant_database.json, loaded on first use
+- Inverted index: symptom keywords / detected conditions -> ranked problems
+- Constant-time treatment lookup per (plant, condition)
+=============================================================================
+"""
+
+import json
+import os
+import re
+import threading
+from collections.abc import Mapping
+
+
+DATABASE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "plant_database.json")
+
+# Detected condition -> keyword stems that identify a matching problem entry
+CONDITION_KEYWORDS = {
+    "necrosis": ["brown", "rot", "black", "blight", "dead", "soft", "mushy", "necro", "disease"],
+    "chlorosis": ["yellow", "chloro", "pale"],
+    "spots": ["spot", "mildew", "rust", "blight", "lesion"],
+    "fungal": ["fung", "mildew", "rust", "blight", "mold"],
+    "bacterial": ["bacter", "spot", "blight", "soft"],
+    "physical": ["tip", "edge", "scorch", "sunburn", "wrinkl", "damage"]
+}
+
+CONDITION_LABELS = {
+    "necrosis": "Brown/Dead Tissue",
+    "chlorosis": "Yellowing (Chlorosis)",
+    "spots": "Disease Spots",
+    "fungal": "Fungal-type Spots",
+    "bacterial": "Bacterial-type Spots",
+    "physical": "Physical Damage"
+}
+
+# Spot types produced by analyze_disease_spots -> condition
+SPOT_TYPE_CONDITIONS = {"Fungal": "fungal", "Bacterial": "bacterial", "Physical": "physical"}
+
+# Where a keyword hit counts most: the problem's own name, then causes, then diagnosis
+FIELD_WEIGHTS = (("name", 3.0), ("causes", 2.0), ("diagnosis", 1.0))
+
+_TOKEN_RE = re.compile(r"[a-z]+")
+
+
+def _tokens(text):
+    return _TOKEN_RE.findall(text.lower())
+
+
+def _stem(token):
+    return token[:-1] if len(token) > 3 and token.endswith("s") else token
+
+
+# =============================================================================
+# INVERTED INDEX
+# =============================================================================
+
+class KnowledgeIndex:
+    """Compiled lookup tables over the problems_and_solutions of every plant"""
+
+    def __init__(self, database):
+        self.symptoms = {}      # stemmed token -> [(weight, plant, problem)]
+        self.conditions = {}    # (plant, condition) -> [problem] best first
+        self.global_conditions = {}  # condition -> [(weight, plant, problem)]
+
+        for plant, info in database.items():
+            for problem, details in info.get("problems_and_solutions", {}).items():
+                fields = {
+                    "name": _tokens(problem),
+                    "causes": _tokens(" ".join(details.get("causes", []))),
+                    "diagnosis": _tokens(details.get("diagnosis", ""))
+                }
+
+                token_weights = {}
+                for field, weight in FIELD_WEIGHTS:
+                    for tok in fields[field]:
+                        tok = _stem(tok)
+                        token_weights[tok] = max(token_weights.get(tok, 0.0), weight)
+                for tok, weight in token_weights.items():
+                    self.symptoms.setdefault(tok, []).append((weight, plant, problem))
+
+                for condition, stems in CONDITION_KEYWORDS.items():
+                    score = sum(weight for tok, weight in token_weights.items()
+                                if any(tok.startswith(s) for s in stems))
+                    if score > 0:
+                        self.conditions.setdefault((plant, condition), []).append((score, problem))
+                        self.global_conditions.setdefault(condition, []).append((score, plant, problem))
+
+        # Rank once at build time so lookups are plain dict hits
+        for key, ranked in self.conditions.items():
+            ranked.sort(key=lambda x: -x[0])
+            self.conditions[key] = [problem for _, problem in ranked]
+        for postings in (*self.symptoms.values(), *self.global_conditions.values()):
+            postings.sort(key=lambda x: -x[0])
+
+    def problems_for(self, plant, condition):
+        """Ranked problem names of `plant` that match a detected condition"""
+        return self.conditions.get((plant, condition), [])
+
+    def lookup_symptom(self, word, plant=None):
+        """Ranked (plant, problem) pairs mentioning a symptom keyword"""
+        postings = self.symptoms.get(_stem(word.lower()), [])
+        return [(p, prob) for _, p, prob in postings if plant is None or p == plant]
+
+
+# =============================================================================
+# LAZY DATABASE
+# =============================================================================
+
+class PlantDatabase(Mapping):
+    """Read-only mapping over the plant JSON file, loaded and indexed on first use"""
+
+    def __init__(self, path=DATABASE_PATH):
+        self.path = path
+        self._data = None
+        self._index = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._data is None:
+            with self._lock:
+                if self._data is None:
+                    with open(self.path, encoding="utf-8") as f:
+                        self._data = json.load(f)
+        return self._data
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    @property
+    def index(self):
+        if self._index is None:
+            data = self._load()
+            with self._lock:
+                if self._index is None:
+                    self._index = KnowledgeIndex(data)
+        return self._index
+
+
+PLANT_DATABASE = PlantDatabase()
+
+
+# =============================================================================
+# RECOMMENDATIONS
+# =============================================================================
+
+def detect_conditions(result):
+    """Conditions present in an analyze() result, most important first"""
+    conditions = []
+    if result['ratios']['brown'] > 10:
+        conditions.append("necrosis")
+    if result['ratios']['yellow'] > 15:
+        conditions.append("chlorosis")
+
+    spots = result['spots']
+    if spots['total'] > 0:
+        counts = {}
+        for s in spots['types']:
+            counts[s['type']] = counts.get(s['type'], 0) + s['sev']
+        for spot_type, _ in sorted(counts.items(), key=lambda x: -x[1]):
+            if spot_type in SPOT_TYPE_CONDITIONS:
+                conditions.append(SPOT_TYPE_CONDITIONS[spot_type])
+        conditions.append("spots")
+    return conditions
+
+
+def find_relevant_problems(plant_name, result, database=PLANT_DATABASE, limit=2):
+    """[(condition label, problem name, details)] for the plant's best-matching problems"""
+    if plant_name not in database:
+        return []
+    health = result['health']
+    if not ("Diseased" in health['status'] or health['score'] < 70):
+        return []
+
+    plant_info = database[plant_name]
+    index = database.index
+    found, seen = [], set()
+    for condition in detect_conditions(result):
+        for problem in index.problems_for(plant_name, condition):
+            if problem not in seen:
+                seen.add(problem)
+                found.append((CONDITION_LABELS[condition], problem, plant_info['problems_and_solutions'][problem]))
+                break
+        if len(found) >= limit:
+            break
+    return found
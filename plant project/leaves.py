@@ -0,0 +1,358 @@
+"""
+=============================================================================
+LEAF INSTANCE SEGMENTATION
+=============================================================================
+Features:
+- Vegetation mask (green / yellow / brown pixels inside the foreground)
+- Touching leaves split with a distance transform + marker watershed
+- Per-leaf ratios, LBP entropy, spots and health score computed in one
+  vectorized pass over the label image (bincount), not one pipeline run
+  per leaf
+- Spots belong to the leaf around them: lesions the watershed cut out of a
+  leaf are filled back in before the lookup (`python leaves.py` checks this
+  on synthetic scenes)
+- LEAF_PIPELINE: the full pipeline plus the leaf stages
+=============================================================================
+"""
+
+import cv2
+import numpy as np
+
+try:
+    from scipy.ndimage import find_objects
+    HAS_SCIPY = True
+except ImportError:
+    HAS_SCIPY = False
+
+from pipeline import DEFAULT_PIPELINE, PIPELINES, RESULT_ARTIFACTS, Pipeline, analysis_scale, register_stage
+
+
+# Sizes in full-resolution (800 x 600) pixels, scaled for smaller runs
+LEAF_MIN_AREA = 400          # fragments smaller than this are not scored as leaves
+LEAF_MIN_WIDTH = 6           # minimum half-width of a leaf core (distance transform)
+LEAF_PEAK_RADIUS = 15        # neighbourhood in which only one leaf core may peak
+LEAF_CORE_FRACTION = 0.6     # core = pixels above this fraction of the local distance peak
+LEAF_MARGIN = 6              # brown within this distance of leaf tissue counts as leaf
+SPOT_ON_LEAF = 0.5           # share of a spot's pixels on / next to a leaf for it to count as that leaf's
+
+LBP_BINS = 26
+
+
+# =============================================================================
+# SEGMENTATION
+# =============================================================================
+
+def vegetation_mask(fg_mask, g_mask, y_mask, b_mask, scale=1.0):
+    """
+    Leaf tissue inside the foreground. Brown alone also matches soil and pots,
+    so brown pixels only count where they border on green / yellow tissue
+    (lesions and necrotic margins).
+    """
+    veg = cv2.bitwise_and(cv2.bitwise_or(g_mask, y_mask), fg_mask)
+    m = max(1, int(round(LEAF_MARGIN * scale)))
+    near = cv2.dilate(veg, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * m + 1, 2 * m + 1)))
+    veg = cv2.bitwise_or(veg, cv2.bitwise_and(cv2.bitwise_and(b_mask, fg_mask), near))
+
+    k = max(1, int(round(5 * scale)) | 1)
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (k, k))
+    cv2.morphologyEx(veg, cv2.MORPH_CLOSE, kernel, veg)
+    cv2.morphologyEx(veg, cv2.MORPH_OPEN, kernel, veg)
+    return veg
+
+
+def segment_leaves(image, veg_mask, scale=1.0):
+    """
+    Split the vegetation mask into leaves. Returns (labels, n_leaves):
+    int32 labels with 0 = background and 1..n_leaves one per leaf.
+    """
+    min_area = LEAF_MIN_AREA * scale ** 2
+    dist = cv2.distanceTransform(veg_mask, cv2.DIST_L2, 5)
+
+    # Leaf cores: pixels close to the highest distance value in their neighbourhood.
+    # Narrow necks between touching leaves fall below it and separate the cores.
+    r = max(1, int(round(LEAF_PEAK_RADIUS * scale)))
+    local_peak = cv2.dilate(dist, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * r + 1, 2 * r + 1)))
+    cores = ((dist >= LEAF_CORE_FRACTION * local_peak) & (dist >= LEAF_MIN_WIDTH * scale)).astype(np.uint8)
+    n_cores, markers = cv2.connectedComponents(cores, connectivity=8)
+
+    # Watershed markers: 1 = background, 2.. = cores, 0 = to be flooded
+    markers = markers + 1
+    markers[(veg_mask > 0) & (cores == 0)] = 0
+    cv2.watershed(image, markers)
+
+    labels = markers - 1
+    labels[(labels < 0) | (veg_mask == 0)] = 0
+
+    # Drop fragments and renumber the remaining leaves 1..n
+    areas = np.bincount(labels.ravel(), minlength=n_cores)
+    keep = areas >= min_area
+    keep[0] = False
+    lut = np.zeros(len(areas), np.int32)
+    lut[keep] = np.arange(1, keep.sum() + 1)
+    return lut[labels], int(keep.sum())
+
+
+# =============================================================================
+# PER-LEAF STATISTICS
+# =============================================================================
+
+def _per_leaf(labels, mask, n):
+    return np.bincount(labels[mask > 0], minlength=n + 1)[:n + 1]
+
+
+def leaf_boxes(labels, n):
+    """
+    (y0, y1, x0, x1) int arrays, index 0..n, end-exclusive, from one pass
+    over the label image; empty labels get y0 == y1.
+    """
+    boxes = np.zeros((n + 1, 4), np.int64)
+    if HAS_SCIPY:
+        for i, sl in enumerate(find_objects(labels, max_label=n), 1):
+            if sl is not None:
+                boxes[i] = sl[0].start, sl[0].stop, sl[1].start, sl[1].stop
+        return boxes.T
+    ys, xs = np.nonzero(labels)
+    ids = labels[ys, xs]
+    boxes[:, 0] = labels.shape[0]
+    boxes[:, 2] = labels.shape[1]
+    np.minimum.at(boxes[:, 0], ids, ys); np.maximum.at(boxes[:, 1], ids, ys + 1)
+    np.minimum.at(boxes[:, 2], ids, xs); np.maximum.at(boxes[:, 3], ids, xs + 1)
+    boxes[boxes[:, 1] == 0] = 0
+    return boxes.T
+
+
+def leaf_statistics(an, labels, n, g_mask, y_mask, b_mask, lbp_img, lbp_hist, veg_mask, scale=1.0):
+    """
+    One dict per leaf with area, bbox, centroid, ratios, lbp_e, spots and health.
+    Areas are in full-resolution pixels like spot areas; bbox / centroid are
+    coordinates in the analyzed image.
+    """
+    if n == 0:
+        return []
+    flat = labels.ravel()
+    area = np.bincount(flat, minlength=n + 1).astype(np.float64)
+    safe_area = np.maximum(area, 1)
+    ratios = {
+        color: _per_leaf(labels, m, n) / safe_area * 100
+        for color, m in (('green', g_mask), ('yellow', y_mask), ('brown', b_mask))
+    }
+
+    # Bounding boxes and centroids
+    boxes = leaf_boxes(labels, n)
+    y0, y1, x0, x1 = boxes
+    ys, xs = np.indices(labels.shape)
+    cx = np.bincount(flat, weights=xs.ravel(), minlength=n + 1) / safe_area
+    cy = np.bincount(flat, weights=ys.ravel(), minlength=n + 1) / safe_area
+
+    # LBP histogram per leaf from one joint (leaf, code) bincount
+    entropy = np.zeros(n + 1)
+    if lbp_hist:
+        codes = np.clip(lbp_img, 0, LBP_BINS - 1).astype(np.int64).ravel()
+        joint = np.bincount(flat * LBP_BINS + codes, minlength=(n + 1) * LBP_BINS).reshape(n + 1, LBP_BINS)
+        p = joint / np.maximum(joint.sum(axis=1, keepdims=True), 1)
+        entropy = -np.sum(np.where(p > 0, p * np.log2(p + 1e-10), 0), axis=1)
+
+    spots = leaf_spots(an, labels, n, b_mask, veg_mask, scale, boxes)
+
+    leaves = []
+    for i in range(1, n + 1):
+        leaf_ratios = {c: r[i] for c, r in ratios.items()}
+        lbp_e = round(float(entropy[i]), 3)
+        health = an.classify_health(leaf_ratios['green'], leaf_ratios['yellow'], leaf_ratios['brown'], spots[i], lbp_e)
+        leaves.append({
+            'id': i,
+            'area': int(round(area[i] / scale ** 2)),
+            'bbox': (int(x0[i]), int(y0[i]), int(x1[i] - x0[i]), int(y1[i] - y0[i])),
+            'centroid': (round(float(cx[i]), 1), round(float(cy[i]), 1)),
+            'ratios': {c: round(float(v), 2) for c, v in leaf_ratios.items()},
+            'lbp_e': lbp_e,
+            'spots': spots[i],
+            'health': health
+        })
+    return leaves
+
+
+def attribution_labels(labels, n, veg_mask, scale=1.0, boxes=None):
+    """
+    Leaf labels for spot attribution. Lesions have strong edges, so the
+    watershed often floods them from the background and cuts them out of
+    their leaf: holes inside a leaf are filled, and unlabeled vegetation
+    (or any pixel within LEAF_MARGIN of a leaf) takes the label of the
+    nearest leaf in the same vegetation component. Holes are filled per
+    leaf inside its bounding box (leaf_boxes(), computed if not given).
+    """
+    filled = labels.copy()
+    for i, (y0, y1, x0, x1) in enumerate(np.transpose(boxes if boxes is not None else leaf_boxes(labels, n))):
+        if i == 0 or y0 == y1:
+            continue
+        crop = filled[y0:y1, x0:x1]
+        contours, _ = cv2.findContours((labels[y0:y1, x0:x1] == i).astype(np.uint8), cv2.RETR_EXTERNAL,
+                                       cv2.CHAIN_APPROX_SIMPLE)
+        solid = np.zeros(crop.shape, np.uint8)
+        cv2.drawContours(solid, contours, -1, 1, cv2.FILLED)
+        crop[(solid > 0) & (crop == 0)] = i
+
+    leaf_px = filled > 0
+    if not leaf_px.any():
+        return filled
+    # Nearest leaf pixel for every other pixel (pixel labels number the leaf pixels in raster order)
+    dist, nearest = cv2.distanceTransformWithLabels((~leaf_px).astype(np.uint8), cv2.DIST_L2, 5,
+                                                    labelType=cv2.DIST_LABEL_PIXEL)
+    owner = filled[leaf_px][nearest - 1]
+    _, parts = cv2.connectedComponents(veg_mask, connectivity=8)
+    same_part = (parts > 0) & (parts == parts[leaf_px][nearest - 1])
+    near = ~leaf_px & (same_part | (dist <= LEAF_MARGIN * scale))
+    filled[near] = owner[near]
+    return filled
+
+
+def leaf_spots(an, labels, n, b_mask, veg_mask, scale=1.0, boxes=None):
+    """
+    Spot summaries per leaf (index 0 = background). Spots are found once on
+    the whole brown mask; a spot belongs to the leaf holding most of its
+    pixels in attribution_labels(), if that is at least SPOT_ON_LEAF of them.
+    """
+    spots = [{'total': 0, 'small': 0, 'medium': 0, 'large': 0, 'types': [], 'severity': 0} for _ in range(n + 1)]
+    contours, _ = cv2.findContours(b_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return spots
+
+    # Filled contour index map -> majority leaf per spot via a joint bincount
+    spot_ids = np.zeros(b_mask.shape, np.int32)
+    for i, c in enumerate(contours):
+        cv2.drawContours(spot_ids, [c], -1, i + 1, cv2.FILLED)
+    inside = spot_ids > 0
+    attr = attribution_labels(labels, n, veg_mask, scale, boxes)
+    joint = np.bincount(spot_ids[inside] * (n + 1) + attr[inside],
+                        minlength=(len(contours) + 1) * (n + 1)).reshape(-1, n + 1)
+    spot_px = np.maximum(joint.sum(axis=1), 1)
+    joint[:, 0] = 0
+    owner = np.where(joint.max(axis=1) >= SPOT_ON_LEAF * spot_px, joint.argmax(axis=1), 0)
+
+    area_scale = scale ** 2
+    for i, c in enumerate(contours):
+        area = cv2.contourArea(c) / area_scale
+        if area < 20:
+            continue
+        size, spot_type = an.classify_spot(area, cv2.arcLength(c, True) / scale)
+        leaf = spots[owner[i + 1]]
+        leaf['total'] += 1
+        leaf[size] += 1
+        if spot_type:
+            leaf['types'].append(spot_type)
+
+    for leaf in spots:
+        leaf['severity'] = an.spot_severity(leaf)
+    return spots
+
+
+def leaf_overlay(original, labels, leaves):
+    """Leaf outlines colored by grade, with leaf ids"""
+    overlay = original.copy()
+    colors = np.zeros((labels.max() + 1 if labels.size else 1, 3), np.uint8)
+    for leaf in leaves:
+        color = leaf['health']['color'].lstrip('#')
+        colors[leaf['id']] = [int(color[j:j + 2], 16) for j in (4, 2, 0)]
+
+    # Outlines of every leaf at once: leaf pixels with a differently labeled neighbour
+    lab = labels.astype(np.float32)
+    kernel = np.ones((5, 5), np.uint8)        # ~2 px wide, like the old drawContours outline
+    edge = (labels > 0) & ((cv2.erode(lab, kernel) != lab) | (cv2.dilate(lab, kernel) != lab))
+    edge &= colors.any(axis=1)[labels]
+    overlay[edge] = colors[labels[edge]]
+
+    for leaf in leaves:
+        bgr = tuple(int(c) for c in colors[leaf['id']])
+        cx, cy = leaf['centroid']
+        cv2.putText(overlay, str(leaf['id']), (int(cx), int(cy)), cv2.FONT_HERSHEY_SIMPLEX, 0.6, bgr, 2)
+    return overlay
+
+
+# =============================================================================
+# STAGES
+# =============================================================================
+
+@register_stage("vegetation", inputs=["fg_mask", "g_mask", "y_mask", "b_mask"], outputs=["veg_mask"])
+def stage_vegetation(an, options, fg_mask, g_mask, y_mask, b_mask):
+    veg = vegetation_mask(fg_mask, g_mask, y_mask, b_mask, analysis_scale(options))
+    an.processing_steps['veg_mask'] = veg
+    return {'veg_mask': veg}
+
+
+@register_stage("leaf_instances", inputs=["segmented", "veg_mask"], outputs=["leaf_labels", "n_leaves"])
+def stage_leaf_instances(an, options, segmented, veg_mask):
+    an.step_explanations.append(("leaf_instances", "Segmented"))
+    labels, n = segment_leaves(segmented, veg_mask, analysis_scale(options))
+    an.processing_steps['leaf_labels'] = labels
+    return {'leaf_labels': labels, 'n_leaves': n}
+
+
+@register_stage("leaf_scoring", inputs=["original", "leaf_labels", "n_leaves", "g_mask", "y_mask", "b_mask",
+                                        "lbp_img", "lbp_hist", "veg_mask"], outputs=["leaves"])
+def stage_leaf_scoring(an, options, original, leaf_labels, n_leaves, g_mask, y_mask, b_mask, lbp_img, lbp_hist,
+                       veg_mask):
+    leaves = leaf_statistics(an, leaf_labels, n_leaves, g_mask, y_mask, b_mask, lbp_img, lbp_hist, veg_mask,
+                             analysis_scale(options))
+    an.processing_steps['leaves'] = leaf_overlay(original, leaf_labels, leaves)
+    return {'leaves': leaves}
+
+
+LEAF_PIPELINE = Pipeline("leaves", [s.name for s in DEFAULT_PIPELINE.stages] +
+                         ["vegetation", "leaf_instances", "leaf_scoring"])
+PIPELINES["leaves"] = LEAF_PIPELINE
+
+# analyze(..., pipeline=LEAF_PIPELINE, outputs=LEAF_OUTPUTS)
+LEAF_OUTPUTS = RESULT_ARTIFACTS + ("leaves",)
+
+
+# =============================================================================
+# SELF-CHECK
+# =============================================================================
+
+def check_spot_attribution(analyzer, n=20, seed=0):
+    """
+    Spot attribution on synthetic scenes. The leaf stages run on the ground
+    truth color masks, so only segmentation and attribution are tested; every
+    spot is drawn inside a leaf and should be counted on the leaf around it.
+    Returns {'spots', 'on_own_leaf', 'on_other_leaf', 'on_background'}.
+    """
+    from synthetic import BROWN, GREEN, YELLOW, LeafSceneGenerator
+
+    counts = {'spots': 0, 'on_own_leaf': 0, 'on_other_leaf': 0, 'on_background': 0}
+    gen = LeafSceneGenerator(seed=seed, spots=(2, 12))
+    ring_kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (7, 7))
+    for index in range(n):
+        image, class_map = gen.render_labels(index)
+        g_mask, y_mask, b_mask = ((class_map == c).astype(np.uint8) * 255 for c in (GREEN, YELLOW, BROWN))
+        veg = vegetation_mask((class_map > 0).astype(np.uint8) * 255, g_mask, y_mask, b_mask)
+        labels, n_leaves = segment_leaves(cv2.cvtColor(image, cv2.COLOR_RGB2BGR), veg)
+        found = np.array([leaf['total'] for leaf in leaf_spots(analyzer, labels, n_leaves, b_mask, veg)])
+
+        # Expected leaf of each spot: the leaf label on the tissue ring around it
+        expected = np.zeros(n_leaves + 1, np.int64)
+        contours, _ = cv2.findContours(b_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        for c in contours:
+            if cv2.contourArea(c) < 20:
+                continue
+            spot = np.zeros(b_mask.shape, np.uint8)
+            cv2.drawContours(spot, [c], -1, 1, cv2.FILLED)
+            votes = np.bincount(labels[(cv2.dilate(spot, ring_kernel) > 0) & (spot == 0)], minlength=n_leaves + 1)
+            votes[0] = 0
+            expected[votes.argmax() if votes.any() else 0] += 1
+
+        own = int(np.minimum(found[1:], expected[1:]).sum())
+        counts['spots'] += int(found.sum())
+        counts['on_own_leaf'] += own
+        counts['on_other_leaf'] += int(found[1:].sum()) - own
+        counts['on_background'] += int(found[0])
+    return counts
+
+
+if __name__ == "__main__":
+    import sys
+    from plant_care_system import UltimatePlantAnalyzer
+
+    scenes = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    counts = check_spot_attribution(UltimatePlantAnalyzer(), scenes)
+    print(", ".join(f"{key}: {value}" for key, value in counts.items()))
+    sys.exit(0 if counts['on_background'] == 0 and counts['on_other_leaf'] == 0 else 1)
@@ -0,0 +1,327 @@
+"""
+=============================================================================
+LESION TRACKING ACROSS TIME
+=============================================================================
+Features:
+- "lesions" pipeline stage: centroid and area of every brown spot, plus
+  the grayscale frame used for registration
+- Frame-to-frame registration of fixed-camera series (ECC on a reduced
+  frame, or ORB feature matching) so small camera / plant movements do
+  not break tracks
+- Spatial index of spot centroids: SciPy cKDTree when available, a
+  vectorized uniform-grid index otherwise; all candidate pairs inside the
+  gate are found in one pass
+- Gated one-to-one matching (distance and area-change gates), per-lesion
+  area history, growth rates and new / lost lesion events
+=============================================================================
+
+    tracker = LesionTracker()
+    for timestamp, img in series:
+        result = analyzer.analyze(img, pipeline=LESION_PIPELINE, outputs=LESION_OUTPUTS)
+        update = tracker.update(result['lesions'], timestamp)
+        for event in update['events']:
+            print(event)
+"""
+
+import cv2
+import numpy as np
+
+try:
+    from scipy.spatial import cKDTree
+    HAS_SCIPY = True
+except ImportError:
+    HAS_SCIPY = False
+
+from pipeline import DEFAULT_PIPELINE, PIPELINES, RESULT_ARTIFACTS, Pipeline, analysis_scale, register_stage
+
+
+MIN_LESION_AREA = 20          # full-resolution pixels, as analyze_disease_spots
+GATE_PX = 12.0                # base matching distance (analysis pixels)
+GATE_RADII = 1.5              # ... plus this many lesion radii
+MAX_AREA_CHANGE = 3.0         # matched areas may differ by at most this factor either way
+MAX_MISSED = 2                # frames a lesion may go undetected before it is dropped
+REGISTRATION_WIDTH = 320      # ECC runs on frames downscaled to this width
+
+REGISTRATION_METHODS = ("ecc", "orb", "none")
+
+
+# =============================================================================
+# DETECTION
+# =============================================================================
+
+def extract_lesions(b_mask, scale=1.0):
+    """(centroids (n, 2) float32 in mask pixels, areas (n,) float32 in full-resolution pixels)"""
+    n, _, stats, centroids = cv2.connectedComponentsWithStats((b_mask > 0).astype(np.uint8), connectivity=8)
+    areas = stats[1:, cv2.CC_STAT_AREA].astype(np.float32) / scale ** 2
+    keep = areas >= MIN_LESION_AREA
+    return centroids[1:][keep].astype(np.float32), areas[keep]
+
+
+@register_stage("lesions", inputs=["original", "b_mask"], outputs=["lesions"])
+def stage_lesions(an, options, original, b_mask):
+    centroids, areas = extract_lesions(b_mask, analysis_scale(options))
+    return {'lesions': {
+        'centroids': centroids,
+        'areas': areas,
+        'gray': cv2.cvtColor(original, cv2.COLOR_BGR2GRAY)
+    }}
+
+
+LESION_PIPELINE = Pipeline("lesions", [s.name for s in DEFAULT_PIPELINE.stages] + ["lesions"])
+PIPELINES["lesions"] = LESION_PIPELINE
+
+# analyze(..., pipeline=LESION_PIPELINE, outputs=LESION_OUTPUTS)
+LESION_OUTPUTS = RESULT_ARTIFACTS + ("lesions",)
+
+
+# =============================================================================
+# REGISTRATION
+# =============================================================================
+
+def register_frames(prev_gray, gray, method="ecc"):
+    """
+    2x3 Euclidean / similarity warp taking `prev_gray` coordinates to
+    `gray` coordinates, and whether registration succeeded (identity if not).
+    """
+    identity = np.eye(2, 3, dtype=np.float32)
+    if method == "none" or prev_gray is None or prev_gray.shape != gray.shape:
+        return identity, method == "none"
+
+    if method == "ecc":
+        f = min(1.0, REGISTRATION_WIDTH / gray.shape[1])
+        small_prev = cv2.resize(prev_gray, None, fx=f, fy=f, interpolation=cv2.INTER_AREA)
+        small = cv2.resize(gray, None, fx=f, fy=f, interpolation=cv2.INTER_AREA)
+        warp = identity.copy()
+        try:
+            # findTransformECC(template, input): input(warp(x)) ~ template(x), i.e. prev -> current
+            _, warp = cv2.findTransformECC(small_prev, small, warp, cv2.MOTION_EUCLIDEAN,
+                                           (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 50, 1e-4), None, 5)
+        except cv2.error:
+            return identity, False
+        warp[:, 2] /= f
+        return warp, True
+
+    if method == "orb":
+        orb = cv2.ORB_create(1000)
+        kp1, d1 = orb.detectAndCompute(prev_gray, None)
+        kp2, d2 = orb.detectAndCompute(gray, None)
+        if d1 is None or d2 is None:
+            return identity, False
+        matches = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True).match(d1, d2)
+        if len(matches) < 8:
+            return identity, False
+        src = np.float32([kp1[m.queryIdx].pt for m in matches])
+        dst = np.float32([kp2[m.trainIdx].pt for m in matches])
+        warp, inliers = cv2.estimateAffinePartial2D(src, dst, method=cv2.RANSAC, ransacReprojThreshold=3.0)
+        if warp is None or inliers.sum() < 8:
+            return identity, False
+        return warp.astype(np.float32), True
+
+    raise ValueError(f"Unknown registration method '{method}', expected one of {REGISTRATION_METHODS}")
+
+
+def warp_points(points, warp):
+    return points @ warp[:, :2].T + warp[:, 2]
+
+
+# =============================================================================
+# SPATIAL INDEX
+# =============================================================================
+
+def candidate_pairs(a, b, radius):
+    """
+    All (i, j, distance) with |a[i] - b[j]| <= radius, as three arrays.
+    cKDTree sparse distance matrix when SciPy is present; otherwise a
+    uniform grid with `radius` cells, searched with sorted cell keys.
+    """
+    if len(a) == 0 or len(b) == 0:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float32)
+    if HAS_SCIPY:
+        pairs = cKDTree(a).sparse_distance_matrix(cKDTree(b), radius, output_type="ndarray")
+        return pairs['i'].astype(np.int64), pairs['j'].astype(np.int64), pairs['v'].astype(np.float32)
+    return _grid_pairs(a, b, radius)
+
+
+def _grid_pairs(a, b, radius):
+    origin = np.minimum(a.min(axis=0), b.min(axis=0))
+    cell_a = np.floor((a - origin) / radius).astype(np.int64)
+    cell_b = np.floor((b - origin) / radius).astype(np.int64)
+    stride = int(max(cell_a[:, 1].max(), cell_b[:, 1].max())) + 3
+    key_b = (cell_b[:, 0] + 1) * stride + cell_b[:, 1] + 1
+    order = np.argsort(key_b, kind="stable")
+    sorted_keys = key_b[order]
+
+    ii, jj = [], []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            key = (cell_a[:, 0] + 1 + dx) * stride + cell_a[:, 1] + 1 + dy
+            lo = np.searchsorted(sorted_keys, key, "left")
+            counts = np.searchsorted(sorted_keys, key, "right") - lo
+            total = int(counts.sum())
+            if total == 0:
+                continue
+            # Expand the variable-length [lo, lo + count) ranges without a Python loop
+            starts = np.repeat(lo - (np.cumsum(counts) - counts), counts)
+            ii.append(np.repeat(np.arange(len(a)), counts))
+            jj.append(order[np.arange(total) + starts])
+    if not ii:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float32)
+    i, j = np.concatenate(ii), np.concatenate(jj)
+    d = np.linalg.norm(a[i] - b[j], axis=1).astype(np.float32)
+    keep = d <= radius
+    return i[keep], j[keep], d[keep]
+
+
+def greedy_assignment(i, j, cost):
+    """One-to-one matches from candidate pairs, cheapest first"""
+    order = np.argsort(cost, kind="stable")
+    used_i, used_j = set(), set()
+    matches = []
+    for k in order:
+        a, b = int(i[k]), int(j[k])
+        if a not in used_i and b not in used_j:
+            used_i.add(a)
+            used_j.add(b)
+            matches.append((a, b))
+    return matches
+
+
+# =============================================================================
+# TRACKER
+# =============================================================================
+
+class Lesion:
+    """One tracked lesion and its area history"""
+
+    __slots__ = ("id", "x", "y", "area", "born", "last_seen", "missed", "times", "areas")
+
+    def __init__(self, lesion_id, x, y, area, t):
+        self.id = lesion_id
+        self.x, self.y = x, y
+        self.area = area
+        self.born = self.last_seen = t
+        self.missed = 0
+        self.times = [t]
+        self.areas = [area]
+
+    def growth_rate(self):
+        """(area growth per time unit, relative growth per time unit) by least squares over the history"""
+        if len(self.times) < 2:
+            return 0.0, 0.0
+        t = np.asarray(self.times, np.float64)
+        a = np.asarray(self.areas, np.float64)
+        if np.ptp(t) == 0:
+            return 0.0, 0.0
+        slope = np.polyfit(t, a, 1)[0]
+        log_slope = np.polyfit(t, np.log(np.maximum(a, 1.0)), 1)[0]
+        return float(slope), float(np.expm1(log_slope))
+
+    def to_dict(self):
+        rate, relative = self.growth_rate()
+        return {
+            'id': self.id, 'x': round(self.x, 1), 'y': round(self.y, 1), 'area': round(self.area, 1),
+            'born': self.born, 'last_seen': self.last_seen, 'observations': len(self.times),
+            'growth_rate': round(rate, 3), 'relative_growth': round(relative, 4)
+        }
+
+
+class LesionTracker:
+    """
+    Matches lesions of consecutive frames of one camera. Each update
+    registers the frame to the previous one, moves the live tracks with the
+    estimated warp, and matches them to the new detections with a distance
+    gate (GATE_PX + GATE_RADII lesion radii) and an area-change gate.
+    """
+
+    def __init__(self, registration="ecc", gate_px=GATE_PX, gate_radii=GATE_RADII,
+                 max_area_change=MAX_AREA_CHANGE, max_missed=MAX_MISSED):
+        if registration not in REGISTRATION_METHODS:
+            raise ValueError(f"Unknown registration method '{registration}', expected one of {REGISTRATION_METHODS}")
+        self.registration = registration
+        self.gate_px = gate_px
+        self.gate_radii = gate_radii
+        self.max_area_change = max_area_change
+        self.max_missed = max_missed
+        self.tracks = {}
+        self.finished = []
+        self.prev_gray = None
+        self.frames = 0
+        self._next_id = 1
+
+    def update(self, lesions, timestamp=None):
+        """
+        Feed one frame's `lesions` artifact; returns {'matched', 'new',
+        'lost', 'registered', 'warp', 'events'} for this frame.
+        """
+        t = self.frames if timestamp is None else timestamp
+        self.frames += 1
+        centroids = np.asarray(lesions['centroids'], np.float32).reshape(-1, 2)
+        areas = np.asarray(lesions['areas'], np.float32)
+
+        warp, registered = register_frames(self.prev_gray, lesions['gray'], self.registration)
+        self.prev_gray = lesions['gray']
+
+        live = list(self.tracks.values())
+        matches = []
+        if live:
+            # Every frame's warp moves the tracks, even when it has no detections:
+            # the next warp is measured from this frame
+            pos = warp_points(np.array([(l.x, l.y) for l in live], np.float32), warp)
+            for lesion, (x, y) in zip(live, pos):
+                lesion.x, lesion.y = float(x), float(y)
+        if live and len(centroids):
+            track_area = np.array([l.area for l in live], np.float32)
+            # Radius-dependent gate: the widest possible gate for the index query, exact per pair after
+            gate = self.gate_px + self.gate_radii * np.sqrt(track_area / np.pi)
+            i, j, d = candidate_pairs(pos, centroids, float(gate.max()))
+            ratio = areas[j] / np.maximum(track_area[i], 1e-6)
+            ok = (d <= gate[i]) & (ratio <= self.max_area_change) & (ratio >= 1 / self.max_area_change)
+            matches = greedy_assignment(i[ok], j[ok], d[ok])
+
+        events = []
+        matched_tracks, matched_dets = set(), set()
+        for ti, dj in matches:
+            lesion = live[ti]
+            lesion.x, lesion.y = float(centroids[dj, 0]), float(centroids[dj, 1])
+            lesion.area = float(areas[dj])
+            lesion.last_seen = t
+            lesion.missed = 0
+            lesion.times.append(t)
+            lesion.areas.append(lesion.area)
+            matched_tracks.add(ti)
+            matched_dets.add(dj)
+
+        lost = []
+        for ti, lesion in enumerate(live):
+            if ti in matched_tracks:
+                continue
+            lesion.missed += 1
+            if lesion.missed > self.max_missed:
+                del self.tracks[lesion.id]
+                self.finished.append(lesion)
+                lost.append(lesion.id)
+                events.append({'type': 'lost', 'id': lesion.id, 'time': t, 'area': round(lesion.area, 1)})
+
+        new = []
+        for dj in range(len(centroids)):
+            if dj in matched_dets:
+                continue
+            lesion = Lesion(self._next_id, float(centroids[dj, 0]), float(centroids[dj, 1]), float(areas[dj]), t)
+            self._next_id += 1
+            self.tracks[lesion.id] = lesion
+            new.append(lesion.id)
+            if self.frames > 1:
+                events.append({'type': 'new', 'id': lesion.id, 'time': t, 'x': round(lesion.x, 1),
+                               'y': round(lesion.y, 1), 'area': round(lesion.area, 1)})
+
+        return {'matched': len(matches), 'new': new, 'lost': lost, 'registered': registered,
+                'warp': warp, 'events': events}
+
+    def lesions(self, include_finished=False):
+        """Per-lesion summaries with growth rates (live tracks, optionally also dropped ones)"""
+        pool = list(self.tracks.values()) + (self.finished if include_finished else [])
+        return [l.to_dict() for l in pool]
+
+    def fastest_growing(self, n=10, min_observations=3):
+        rows = [l for l in self.lesions() if l['observations'] >= min_observations]
+        return sorted(rows, key=lambda l: l['relative_growth'], reverse=True)[:n]
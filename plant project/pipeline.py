@@ -0,0 +1,417 @@
+"""
+=============================================================================
+PLUGGABLE ANALYSIS PIPELINE
+=============================================================================
+Features:
+- Stage registry: every processing step is a plugin with declared
+  input and output artifacts
+- Declarative pipelines (ordered stage lists, loadable from dict/JSON specs)
+- Executor prunes stages whose outputs nobody requested and runs the rest
+  through the StageGraph scheduler (concurrently when allowed)
+=============================================================================
+
+A stage function receives the analyzer, the run options and its inputs as
+keyword arguments, and returns a dict with its outputs:
+
+    @register_stage("sharpness", inputs=["gray"], outputs=["sharpness"])
+    def sharpness(analyzer, options, gray):
+        return {"sharpness": cv2.Laplacian(gray, cv2.CV_64F).var()}
+"""
+
+import cv2
+import numpy as np
+
+from stage_scheduler import StageGraph
+
+
+# Artifacts supplied by the caller rather than produced by a stage
+SOURCE_ARTIFACTS = ("image",)
+
+STAGE_REGISTRY = {}
+
+
+class StageError(RuntimeError):
+    """A stage failed; carries the stage name and the underlying reason"""
+
+    def __init__(self, stage, reason):
+        super().__init__(f"stage '{stage}' failed: {reason}")
+        self.stage = stage
+        self.reason = reason
+
+
+class Stage:
+    """A registered processing step"""
+
+    def __init__(self, name, fn, inputs, outputs):
+        self.name = name
+        self.fn = fn
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+
+    def __repr__(self):
+        return f"Stage({self.name}: {list(self.inputs)} -> {list(self.outputs)})"
+
+
+def register_stage(name, inputs=(), outputs=()):
+    """Decorator adding a stage function to STAGE_REGISTRY"""
+    def decorator(fn):
+        STAGE_REGISTRY[name] = Stage(name, fn, inputs, outputs)
+        return fn
+    return decorator
+
+
+# =============================================================================
+# FOREGROUND ROI
+# =============================================================================
+
+ROI_PAD = 16              # >= the largest kernel radius downstream (heatmap blur: 7, LBP: 3 + interpolation)
+ROI_MAX_BOXES = 8         # more disjoint regions than this -> one box around all of them
+ROI_MAX_COVERAGE = 0.8    # boxes covering more of the frame than this -> just use the full frame
+
+
+def foreground_boxes(fg_mask, pad=ROI_PAD, max_boxes=ROI_MAX_BOXES, max_coverage=ROI_MAX_COVERAGE):
+    """Padded (x, y, w, h) boxes around the foreground, merged where they overlap"""
+    h, w = fg_mask.shape[:2]
+    n, _, stats, _ = cv2.connectedComponentsWithStats((fg_mask > 0).astype(np.uint8), connectivity=8)
+    boxes = [
+        [max(0, x - pad), max(0, y - pad), min(w, x + bw + pad), min(h, y + bh + pad)]
+        for x, y, bw, bh, _ in stats[1:]
+    ]
+    if not boxes:
+        return [(0, 0, w, h)]
+
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(len(boxes) - 1, i, -1):
+                a, b = boxes[i], boxes[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    boxes[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                    del boxes[j]
+                    merged = True
+
+    if len(boxes) > max_boxes:
+        boxes = [[min(b[0] for b in boxes), min(b[1] for b in boxes),
+                  max(b[2] for b in boxes), max(b[3] for b in boxes)]]
+    if sum((b[2] - b[0]) * (b[3] - b[1]) for b in boxes) > max_coverage * w * h:
+        return [(0, 0, w, h)]
+    return [(int(x0), int(y0), int(x1 - x0), int(y1 - y0)) for x0, y0, x1, y1 in boxes]
+
+
+def is_full_frame(roi, shape):
+    return len(roi) == 1 and tuple(roi[0]) == (0, 0, shape[1], shape[0])
+
+
+def map_boxes(roi, fn, *arrays, fill=0):
+    """
+    Run `fn` on the crops of `arrays` inside each ROI box and paste its
+    output(s) into full-size arrays pre-filled with `fill` (the value `fn`
+    produces on empty background). A full-frame ROI calls `fn` directly.
+    """
+    if is_full_frame(roi, arrays[0].shape):
+        return fn(*arrays)
+    h, w = arrays[0].shape[:2]
+    canvases, single = None, False
+    for x, y, bw, bh in roi:
+        produced = fn(*(a[y:y + bh, x:x + bw] for a in arrays))
+        single = not isinstance(produced, tuple)
+        produced = (produced,) if single else produced
+        if canvases is None:
+            canvases = [np.full((h, w) + p.shape[2:], fill, dtype=p.dtype) for p in produced]
+        for canvas, p in zip(canvases, produced):
+            canvas[y:y + bh, x:x + bw] = p
+    return canvases[0] if single else tuple(canvases)
+
+
+# =============================================================================
+# BUILT-IN STAGES
+# =============================================================================
+
+FULL_SIZE = (800, 600)
+
+
+def analysis_scale(options):
+    """Linear scale of this run relative to the full 800 x 600 analysis size"""
+    return options.get('max_size', FULL_SIZE)[0] / FULL_SIZE[0]
+
+
+@register_stage("resize", inputs=["image"], outputs=["original"])
+def stage_resize(an, options, image):
+    # Accept PIL images or RGB arrays
+    img_rgb = np.asarray(image)
+    h, w = img_rgb.shape[:2]
+    aspect = w / h
+    max_w, max_h = options.get('max_size', FULL_SIZE)
+    target_w, target_h = (max_w, int(max_w/aspect)) if aspect > 1.33 else (int(max_h*aspect), max_h)
+    # Resize first: the channel swap then runs at analysis resolution, not camera resolution
+    img_rgb = cv2.resize(img_rgb, (target_w, target_h), interpolation=cv2.INTER_AREA)
+    img_bgr = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2BGR)
+    an.processing_steps['original'] = img_bgr
+    return {'original': img_bgr}
+
+
+@register_stage("white_balance", inputs=["original"], outputs=["balanced"])
+def stage_white_balance(an, options, original):
+    # A camera profile (calibration.py) replaces the per-image Gray World estimate
+    cal = an.calibration
+    if cal is not None:
+        balanced = cal.correct(original)
+        # Drift is reported, not acted on: the profile stays until it is recalibrated
+        drift = " (drift detected: recalibrate)" if getattr(cal, 'needs_recalibration', False) else ""
+        an.step_explanations.append(("color_calibration", f"Profile '{cal.camera_id}'{drift}"))
+    else:
+        balanced = an.apply_white_balance(original)
+    an.processing_steps['white_balanced'] = balanced
+    return {'balanced': balanced}
+
+
+@register_stage("clahe", inputs=["balanced"], outputs=["enhanced"])
+def stage_clahe(an, options, balanced):
+    enhanced = an.apply_clahe(balanced)
+    an.processing_steps['clahe'] = enhanced
+    return {'enhanced': enhanced}
+
+
+@register_stage("denoise", inputs=["enhanced"], outputs=["denoised"])
+def stage_denoise(an, options, enhanced):
+    final = an.apply_denoising(enhanced)
+    an.processing_steps['denoised'] = final
+    return {'denoised': final}
+
+
+@register_stage("segmentation", inputs=["denoised"], outputs=["segmented", "fg_mask"])
+def stage_segmentation(an, options, denoised):
+    if options.get('use_grabcut'):
+        segmented, fg_mask = an.apply_grabcut(denoised)
+        an.processing_steps['segmented'] = segmented
+    else:
+        segmented = denoised
+        fg_mask = np.ones(denoised.shape[:2], dtype=np.uint8) * 255
+    an.processing_steps['fg_mask'] = fg_mask
+    return {'segmented': segmented, 'fg_mask': fg_mask}
+
+
+@register_stage("roi", inputs=["fg_mask"], outputs=["roi"])
+def stage_roi(an, options, fg_mask):
+    # crop_to_fg: downstream per-pixel stages only run inside the foreground boxes
+    if options.get('crop_to_fg'):
+        roi = foreground_boxes(fg_mask)
+    else:
+        roi = [(0, 0, fg_mask.shape[1], fg_mask.shape[0])]
+    return {'roi': roi}
+
+
+@register_stage("hsv_classification", inputs=["segmented", "roi"], outputs=["hsv", "g_mask", "y_mask", "b_mask"])
+def stage_hsv_classification(an, options, segmented, roi):
+    an.step_explanations.append(("hsv_segmentation", "Applied"))
+    an.step_explanations.append(("morphological_ops", "Applied"))
+    # 5x5 at full resolution; scaled down (odd size) for coarse runs so small lesions survive
+    k = max(1, int(round(5 * analysis_scale(options))) | 1)
+    kernel = np.ones((k, k), np.uint8)
+
+    def classify(img):
+        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        g_mask = cv2.inRange(hsv, an.green_lower, an.green_upper)
+        y_mask = cv2.inRange(hsv, an.yellow_lower, an.yellow_upper)
+        b_mask = cv2.inRange(hsv, an.brown_lower, an.brown_upper)
+        for m in [g_mask, y_mask, b_mask]:
+            cv2.morphologyEx(m, cv2.MORPH_OPEN, kernel, m)
+            cv2.morphologyEx(m, cv2.MORPH_CLOSE, kernel, m)
+        return hsv, g_mask, y_mask, b_mask
+
+    hsv, g_mask, y_mask, b_mask = map_boxes(roi, classify, segmented)
+    return {'hsv': hsv, 'g_mask': g_mask, 'y_mask': y_mask, 'b_mask': b_mask}
+
+
+# Quantized HSV histogram: H in steps of 5, S and V in steps of 16 (36 x 16 x 16 bins)
+HSV_HIST_BINS = (36, 16, 16)
+HSV_HIST_RANGES = (180, 256, 256)
+
+
+@register_stage("hsv_histogram", inputs=["hsv", "fg_mask"], outputs=["hsv_hist"])
+def stage_hsv_histogram(an, options, hsv, fg_mask):
+    # Sparse (flat bin index, count) pairs over the foreground, for histograms.py re-thresholding
+    hist = cv2.calcHist([hsv], [0, 1, 2], fg_mask, list(HSV_HIST_BINS),
+                        [0, HSV_HIST_RANGES[0], 0, HSV_HIST_RANGES[1], 0, HSV_HIST_RANGES[2]]).ravel()
+    bins = np.flatnonzero(hist).astype(np.uint16)
+    return {'hsv_hist': (bins, hist[bins].astype(np.uint32))}
+
+
+@register_stage("ratios", inputs=["fg_mask", "g_mask", "y_mask", "b_mask"], outputs=["ratios", "total"])
+def stage_ratios(an, options, fg_mask, g_mask, y_mask, b_mask):
+    total = np.sum(fg_mask > 0)
+    if total == 0:
+        total = 1
+    ratios = {
+        'green': (np.sum(g_mask > 0) / total) * 100,
+        'yellow': (np.sum(y_mask > 0) / total) * 100,
+        'brown': (np.sum(b_mask > 0) / total) * 100
+    }
+    return {'ratios': ratios, 'total': total}
+
+
+@register_stage("gray", inputs=["segmented", "roi"], outputs=["gray"])
+def stage_gray(an, options, segmented, roi):
+    gray = map_boxes(roi, lambda img: cv2.cvtColor(img, cv2.COLOR_BGR2GRAY), segmented)
+    an.processing_steps['gray'] = gray
+    return {'gray': gray}
+
+
+@register_stage("edges", inputs=["gray", "total", "fg_mask", "roi"], outputs=["edges", "edge_d"])
+def stage_edges(an, options, gray, total, fg_mask, roi):
+    an.step_explanations.append(("canny_edges", "Detected"))
+    edges = map_boxes(roi, lambda g: cv2.Canny(g, 50, 150), gray)
+    an.processing_steps['edges'] = edges
+    if options.get('crop_to_fg'):
+        # Numerator and denominator over the same pixels: edges inside the foreground only
+        n_edges = cv2.countNonZero(cv2.bitwise_and(edges, fg_mask))
+    else:
+        n_edges = np.sum(edges > 0)
+    return {'edges': edges, 'edge_d': (n_edges / total) * 100}
+
+
+@register_stage("lbp", inputs=["gray", "fg_mask", "roi"], outputs=["lbp_e", "lbp_img", "lbp_hist"])
+def stage_lbp(an, options, gray, fg_mask, roi):
+    lbp_e, lbp_img, lbp_hist = an.calculate_lbp(gray, fg_mask, roi)
+    an.processing_steps['lbp'] = lbp_img
+    return {'lbp_e': lbp_e, 'lbp_img': lbp_img, 'lbp_hist': lbp_hist}
+
+
+@register_stage("spots", inputs=["b_mask"], outputs=["spots"])
+def stage_spots(an, options, b_mask):
+    return {'spots': an.analyze_disease_spots(b_mask, analysis_scale(options))}
+
+
+@register_stage("heatmap", inputs=["original", "y_mask", "b_mask", "roi"], outputs=["heatmap", "damage"])
+def stage_heatmap(an, options, original, y_mask, b_mask, roi):
+    heatmap, dmg_map = an.create_damage_heatmap(original, y_mask, b_mask, roi)
+    an.processing_steps['heatmap'] = heatmap
+    an.processing_steps['damage'] = dmg_map
+    return {'heatmap': heatmap, 'damage': dmg_map}
+
+
+@register_stage("scoring", inputs=["ratios", "spots", "lbp_e"], outputs=["health"])
+def stage_scoring(an, options, ratios, spots, lbp_e):
+    an.step_explanations.append(("health_scoring", "Calculated"))
+    health = an.classify_health(ratios['green'], ratios['yellow'], ratios['brown'], spots, lbp_e)
+    return {'health': health}
+
+
+# =============================================================================
+# DECLARATIVE PIPELINES
+# =============================================================================
+
+class Pipeline:
+    """An ordered list of registered stages"""
+
+    def __init__(self, name, stages):
+        self.name = name
+        self.stages = [STAGE_REGISTRY[s] if isinstance(s, str) else s for s in stages]
+        self.producers = {}
+        available = set(SOURCE_ARTIFACTS)
+        for stage in self.stages:
+            missing = [i for i in stage.inputs if i not in available]
+            if missing:
+                raise ValueError(f"Pipeline '{name}': stage '{stage.name}' needs {missing} "
+                                 f"which no earlier stage produces")
+            for out in stage.outputs:
+                self.producers[out] = stage
+            available.update(stage.outputs)
+
+    @classmethod
+    def from_spec(cls, spec):
+        """Build from {"name": ..., "stages": [...]} (e.g. parsed JSON)"""
+        return cls(spec.get("name", "custom"), spec["stages"])
+
+    def to_spec(self):
+        return {"name": self.name, "stages": [s.name for s in self.stages]}
+
+    def required_stages(self, outputs):
+        """Stages needed for `outputs`, in pipeline order"""
+        needed, todo = set(), list(outputs)
+        while todo:
+            artifact = todo.pop()
+            if artifact in SOURCE_ARTIFACTS:
+                continue
+            if artifact not in self.producers:
+                raise KeyError(f"Pipeline '{self.name}' cannot produce '{artifact}'")
+            stage = self.producers[artifact]
+            if stage.name not in needed:
+                needed.add(stage.name)
+                todo.extend(stage.inputs)
+        return [s for s in self.stages if s.name in needed]
+
+    def run(self, analyzer, sources, outputs=None, options=None, max_workers=1):
+        """Execute the stages needed for `outputs` (all when None); returns all produced artifacts"""
+        options = options or {}
+        stages = self.stages if outputs is None else self.required_stages(outputs)
+
+        graph = StageGraph()
+        for stage in stages:
+            deps = sorted({self.producers[i].name for i in stage.inputs if i not in SOURCE_ARTIFACTS})
+            graph.add(stage.name, _stage_node(stage, analyzer, options, sources), deps)
+
+        artifacts = dict(sources)
+        for produced in graph.run(max_workers).values():
+            artifacts.update(produced)
+        return artifacts
+
+
+def _stage_node(stage, analyzer, options, sources):
+    def run(*dep_outputs):
+        available = dict(sources)
+        for produced in dep_outputs:
+            available.update(produced)
+        # Lets a supervisor attribute a timeout or memory breach to the stage in progress
+        if getattr(analyzer, 'on_stage', None) is not None:
+            analyzer.on_stage(stage.name)
+        try:
+            produced = stage.fn(analyzer, options, **{k: available[k] for k in stage.inputs})
+        except StageError:
+            raise
+        except Exception as e:
+            raise StageError(stage.name, f"{type(e).__name__}: {e}") from e
+        missing = [o for o in stage.outputs if o not in produced]
+        if missing:
+            raise StageError(stage.name, f"did not produce {missing}")
+        # Forward upstream artifacts so downstream stages see the full lineage
+        available.update(produced)
+        return available
+    return run
+
+
+DEFAULT_PIPELINE = Pipeline("full", [
+    "resize", "white_balance", "clahe", "denoise", "segmentation", "roi",
+    "hsv_classification", "ratios", "gray", "edges", "lbp", "spots", "heatmap", "scoring",
+    "hsv_histogram"
+])
+
+PIPELINES = {"full": DEFAULT_PIPELINE}
+
+# Artifacts that make up the analyze() result dict, plus the heatmap / damage map the app tab,
+# reports and the artifact store read from processing_steps; pruning them is opt-in (SCORING_OUTPUTS)
+RESULT_ARTIFACTS = ("ratios", "edge_d", "lbp_e", "lbp_hist", "spots", "health", "g_mask", "y_mask", "b_mask",
+                    "heatmap", "damage")
+
+# Optional: add "hsv_hist" to `outputs` to also emit the sparse HSV histogram
+# Headless scoring: skips Canny and the heatmap entirely
+SCORING_OUTPUTS = ("ratios", "lbp_e", "lbp_hist", "spots", "health")
+
+
+def build_result(artifacts):
+    """analyze()-style result dict from whichever artifacts were produced"""
+    result = {}
+    if 'ratios' in artifacts:
+        result['ratios'] = {k: round(v, 2) for k, v in artifacts['ratios'].items()}
+    if 'edge_d' in artifacts:
+        result['edge_d'] = round(artifacts['edge_d'], 2)
+    for key in ('lbp_e', 'lbp_hist', 'spots', 'health', 'leaves', 'hsv_hist', 'lesions', 'area'):
+        if key in artifacts:
+            result[key] = artifacts[key]
+    if all(k in artifacts for k in ('g_mask', 'y_mask', 'b_mask')):
+        result['masks'] = {'g': artifacts['g_mask'], 'y': artifacts['y_mask'], 'b': artifacts['b_mask']}
+    if 'original' in artifacts:
+        h, w = artifacts['original'].shape[:2]
+        result['resolution'] = {'width': w, 'height': h}
+    return result
@@ -11,12 +11,24 @@ Features:
 =============================================================================
 """
 
-import streamlit as st
 import cv2
 import numpy as np
 from PIL import Image
 import matplotlib.pyplot as plt
 
+from grading import (HEALTH_GRADES, HEALTH_STATUSES, STATUS_THRESHOLDS, classify_health, classify_spot,
+                     spot_severity)
+from knowledge_base import PLANT_DATABASE, find_relevant_problems
+from report import REPORT_MIME, generate_report
+from species import SpeciesClassifier, identify_and_analyze
+from pipeline import DEFAULT_PIPELINE, RESULT_ARTIFACTS, build_result, map_boxes
+from leaves import LEAF_OUTPUTS, LEAF_PIPELINE
+
+try:
+    import streamlit as st
+    HAS_STREAMLIT = True
+except ImportError:
+    HAS_STREAMLIT = False
 
 try:
     from skimage.feature import local_binary_pattern
@@ -30,628 +42,6 @@ try:
 except ImportError:
     HAS_PLOTLY = False
 
-# =============================================================================
-# COMPREHENSIVE PLANT DATABASE - 10 Plants
-# =============================================================================
-
-PLANT_DATABASE = {
-    "Pothos (بوتس)": {
-        "scientific_name": "Epipremnum aureum",
-        "difficulty": "Easy",
-        "image_url": "img/download (8).jpg",
-        "care": {
-            "water": "💧 Water once per week, allow top 2 inches of soil to dry between waterings",
-            "light": "☀️ Indirect bright light to low light (100-200 foot-candles)",
-            "temperature": "🌡️ 18-29°C (65-85°F) - avoid cold drafts",
-            "humidity": "💨 Medium humidity 40-60% - mist occasionally",
-            "soil": "🌱 Well-draining potting mix with perlite",
-            "fertilizer": "🌿 Liquid fertilizer every 4-6 weeks during growing season",
-            "pruning": "✂️ Trim yellow leaves and long vines to encourage bushiness"
-        },
-        "problems_and_solutions": {
-            "Yellow Leaves": {
-                "causes": ["Overwatering", "Poor drainage", "Root rot", "Insufficient light"],
-                "diagnosis": "Check soil moisture - if soggy, it's overwatering",
-                "treatment": [
-                    "1. Reduce watering frequency immediately",
-                    "2. Check drainage holes - ensure water flows freely",
-                    "3. Remove yellow leaves to prevent fungal spread",
-                    "4. If root rot suspected, repot in fresh dry soil",
-                    "5. Move to brighter location gradually"
-                ],
-                "prevention": "Water only when top 2 inches of soil are dry"
-            },
-            "Brown Tips": {
-                "causes": ["Low humidity", "Fluoride/chlorine in tap water", "Over-fertilizing", "Salt buildup"],
-                "diagnosis": "Brown, crispy leaf tips while rest of leaf is green",
-                "treatment": [
-                    "1. Increase humidity with pebble tray or humidifier",
-                    "2. Switch to filtered or distilled water",
-                    "3. Flush soil with clean water to remove salt buildup",
-                    "4. Reduce fertilizer frequency",
-                    "5. Trim brown tips with clean scissors"
-                ],
-                "prevention": "Use filtered water and maintain 50%+ humidity"
-            },
-            "Leggy Growth": {
-                "causes": ["Insufficient light", "Natural aging"],
-                "diagnosis": "Long stems with few leaves, spaces between leaves",
-                "treatment": [
-                    "1. Move to brighter location (indirect light)",
-                    "2. Prune long vines to encourage branching",
-                    "3. Propagate cuttings to create fuller plant",
-                    "4. Rotate plant weekly for even growth"
-                ],
-                "prevention": "Provide consistent bright indirect light"
-            }
-        },
-        "fun_facts": "Pothos can purify air by removing toxins like formaldehyde and benzene. Can grow over 40 feet in nature!"
-    },
-
-    "Snake Plant (نبات الثعبان)": {
-        "scientific_name": "Sansevieria trifasciata",
-        "difficulty": "Very Easy",
-        "image_url": "img/s.jpg",
-        "care": {
-            "water": "💧 Water every 2-3 weeks, drought tolerant - less in winter",
-            "light": "☀️ Low to bright indirect light - very adaptable",
-            "temperature": "🌡️ 15-29°C (60-85°F) - tolerates temperature fluctuations",
-            "humidity": "💨 Low humidity preferred - very drought tolerant",
-            "soil": "🌱 Cactus/succulent mix with excellent drainage",
-            "fertilizer": "🌿 Once in spring with diluted cactus fertilizer",
-            "pruning": "✂️ Remove damaged leaves at soil level"
-        },
-        "problems_and_solutions": {
-            "Root Rot (Yellow/Mushy Leaves)": {
-                "causes": ["Severe overwatering", "Poor drainage", "Cold temperatures"],
-                "diagnosis": "Yellow leaves that are soft and mushy, foul smell from soil",
-                "treatment": [
-                    "1. STOP watering immediately",
-                    "2. Remove plant from pot and inspect roots",
-                    "3. Cut away ALL brown/mushy roots with sterile scissors",
-                    "4. Let roots dry for 24 hours",
-                    "5. Repot in completely fresh, dry cactus soil",
-                    "6. Do NOT water for 1-2 weeks",
-                    "7. Resume watering very sparingly"
-                ],
-                "prevention": "Water only when soil is completely dry, ensure drainage holes"
-            },
-            "Brown Spots": {
-                "causes": ["Inconsistent watering", "Fungal infection", "Cold damage"],
-                "diagnosis": "Brown circular spots with yellow halos",
-                "treatment": [
-                    "1. Isolate plant from other plants",
-                    "2. Remove affected leaves completely",
-                    "3. Improve air circulation",
-                    "4. Apply fungicide if spreading",
-                    "5. Establish consistent watering schedule"
-                ],
-                "prevention": "Maintain consistent care routine, avoid wetting leaves"
-            },
-            "Wrinkled Leaves": {
-                "causes": ["Severe under-watering", "Root damage"],
-                "diagnosis": "Leaves appear thin, wrinkled, and droopy",
-                "treatment": [
-                    "1. Water thoroughly until water drains from bottom",
-                    "2. Check roots for damage",
-                    "3. Resume normal watering schedule",
-                    "4. Recovery may take 2-3 weeks"
-                ],
-                "prevention": "Don't let soil stay completely dry for extended periods"
-            }
-        },
-        "fun_facts": "Produces oxygen at night! Perfect for bedrooms. Can survive weeks without water."
-    },
-
-    "Spider Plant (نبات العنكبوت)": {
-        "scientific_name": "Chlorophytum comosum",
-        "difficulty": "Easy",
-        "image_url": "img/Spider Plant.jpg",
-        "care": {
-            "water": "💧 Water 2-3 times per week, keep soil evenly moist but not soggy",
-            "light": "☀️ Bright indirect light - can tolerate some shade",
-            "temperature": "🌡️ 18-32°C (65-90°F) - very temperature tolerant",
-            "humidity": "💨 Medium to high humidity 40-80%",
-            "soil": "🌱 Rich, well-draining potting soil with organic matter",
-            "fertilizer": "🌿 Every 2 weeks during growing season with balanced fertilizer",
-            "pruning": "✂️ Remove brown tips, propagate baby plantlets"
-        },
-        "problems_and_solutions": {
-            "Brown Leaf Tips": {
-                "causes": ["Fluoride/chlorine in tap water", "Salt buildup", "Low humidity", "Over-fertilizing"],
-                "diagnosis": "Brown, crispy tips on otherwise healthy leaves",
-                "treatment": [
-                    "1. Switch to distilled or rainwater immediately",
-                    "2. Flush soil with distilled water (run 2-3x pot volume through)",
-                    "3. Stop fertilizing for 1 month",
-                    "4. Increase humidity with humidifier or pebble tray",
-                    "5. Trim brown tips with clean scissors (cut at an angle)",
-                    "6. Mist leaves with distilled water daily"
-                ],
-                "prevention": "Always use filtered/distilled water, fertilize at half strength"
-            },
-            "Yellow Leaves": {
-                "causes": ["Overwatering", "Poor drainage", "Nutrient deficiency"],
-                "diagnosis": "Leaves turn yellow from base upward",
-                "treatment": [
-                    "1. Check drainage - soil should dry between waterings",
-                    "2. Reduce watering frequency",
-                    "3. Feed with balanced liquid fertilizer",
-                    "4. Remove yellow leaves to redirect energy"
-                ],
-                "prevention": "Let top inch of soil dry before watering"
-            },
-            "No Baby Plantlets": {
-                "causes": ["Insufficient light", "Too young", "Pot-bound"],
-                "diagnosis": "Healthy plant but no spiderettes forming",
-                "treatment": [
-                    "1. Move to brighter location (not direct sun)",
-                    "2. Ensure plant is at least 1 year old",
-                    "3. Slightly pot-bound plants produce more babies",
-                    "4. Be patient - can take 6-12 months"
-                ],
-                "prevention": "Provide bright indirect light and slight root constraint"
-            }
-        },
-        "fun_facts": "Produces baby plants (spiderettes) that can be propagated. NASA rates it highly for air purification!"
-    },
-
-    "Peace Lily (زنبق السلام)": {
-        "scientific_name": "Spathiphyllum",
-        "difficulty": "Medium",
-        "image_url": "img/House Plant Lovers Addicts.jpg",
-        "care": {
-            "water": "💧 Water when top inch of soil is dry - loves moisture",
-            "light": "☀️ Low to medium indirect light - no direct sun",
-            "temperature": "🌡️ 18-27°C (65-80°F) - avoid cold drafts",
-            "humidity": "💨 High humidity 50-60% - mist regularly",
-            "soil": "🌱 Rich, well-draining peat-based potting mix",
-            "fertilizer": "🌿 Monthly with diluted balanced fertilizer during growing season",
-            "pruning": "✂️ Remove spent flowers and brown leaves at base"
-        },
-        "problems_and_solutions": {
-            "Brown Leaf Tips": {
-                "causes": ["Low humidity", "Fluoride in water", "Over-fertilizing", "Underwatering"],
-                "diagnosis": "Brown, dry tips on leaf edges",
-                "treatment": [
-                    "1. Increase humidity dramatically (60%+)",
-                    "2. Use distilled or rainwater only",
-                    "3. Place on humidity tray with pebbles and water",
-                    "4. Mist leaves twice daily",
-                    "5. Group with other plants for microclimate",
-                    "6. Stop fertilizing for 2 months",
-                    "7. Trim brown tips carefully"
-                ],
-                "prevention": "Maintain high humidity, use filtered water"
-            },
-            "Drooping/Wilting": {
-                "causes": ["Under-watering (most common)", "Root-bound", "Temperature shock"],
-                "diagnosis": "Entire plant droops dramatically but perks up after watering",
-                "treatment": [
-                    "1. Water thoroughly until water drains freely",
-                    "2. Plant should recover within hours",
-                    "3. Check if root-bound - repot if needed",
-                    "4. Avoid letting plant wilt repeatedly (stresses plant)",
-                    "5. Establish consistent watering schedule"
-                ],
-                "prevention": "Water before soil dries completely, check soil daily"
-            },
-            "No Flowers": {
-                "causes": ["Insufficient light", "Immature plant", "Over-fertilizing"],
-                "diagnosis": "Healthy leaves but no white flower spathes",
-                "treatment": [
-                    "1. Move to brighter location (still indirect)",
-                    "2. Ensure plant is mature (1+ years old)",
-                    "3. Reduce nitrogen, increase phosphorus fertilizer",
-                    "4. Provide 12-14 hours of light daily",
-                    "5. Be patient - blooms come with proper care"
-                ],
-                "prevention": "Provide bright indirect light and balanced fertilization"
-            }
-        },
-        "fun_facts": "Flowers aren't actually flowers - white 'petals' are modified leaves called spathes! Excellent air purifier."
-    },
-
-    "Rubber Plant (نبات المطاط)": {
-        "scientific_name": "Ficus elastica",
-        "difficulty": "Medium",
-        "image_url": "img/Rubber Plant.jpg",
-        "care": {
-            "water": "💧 Water when top 2 inches are dry - less in winter",
-            "light": "☀️ Bright indirect light - can tolerate some direct morning sun",
-            "temperature": "🌡️ 15-27°C (60-80°F) - avoid sudden changes",
-            "humidity": "💨 Medium humidity 40-50% - wipe leaves weekly",
-            "soil": "🌱 Well-draining potting mix with peat and perlite",
-            "fertilizer": "🌿 Monthly spring through summer with balanced fertilizer",
-            "pruning": "✂️ Prune in spring to control size and shape"
-        },
-        "problems_and_solutions": {
-            "Leaf Drop": {
-                "causes": ["Overwatering", "Temperature shock", "Moving plant", "Drafts"],
-                "diagnosis": "Leaves turning yellow then dropping, often lower leaves first",
-                "treatment": [
-                    "1. Check soil moisture - if wet, reduce watering",
-                    "2. Ensure stable temperature (no AC/heating vents nearby)",
-                    "3. Don't move plant - it hates relocation",
-                    "4. Maintain consistent watering schedule",
-                    "5. Remove dropped leaves to prevent pests",
-                    "6. New growth should appear in 3-4 weeks with proper care"
-                ],
-                "prevention": "Avoid moving, maintain stable conditions, proper watering"
-            },
-            "Brown/Yellow Spots": {
-                "causes": ["Sunburn", "Leaf spot disease", "Pest damage"],
-                "diagnosis": "Brown or yellow spots with defined edges on leaves",
-                "treatment": [
-                    "1. If sunburn: move away from direct sun immediately",
-                    "2. If disease: isolate plant, remove affected leaves",
-                    "3. Improve air circulation around plant",
-                    "4. Apply neem oil if pests present",
-                    "5. Avoid misting (promotes fungal growth)",
-                    "6. Wipe leaves with damp cloth weekly"
-                ],
-                "prevention": "Provide bright indirect light, good air circulation"
-            },
-            "Leggy Growth": {
-                "causes": ["Insufficient light", "Natural growth pattern"],
-                "diagnosis": "Long stems between leaves, leaves smaller than normal",
-                "treatment": [
-                    "1. Move to brighter location",
-                    "2. Prune back to encourage branching",
-                    "3. Propagate top cuttings if desired",
-                    "4. Rotate plant weekly for even growth"
-                ],
-                "prevention": "Provide consistently bright indirect light"
-            }
-        },
-        "fun_facts": "Used to produce rubber in the past! Leaves can grow up to 12 inches long. Can reach 100 feet in nature!"
-    },
-
-    "Monstera (مونستيرا)": {
-        "scientific_name": "Monstera deliciosa",
-        "difficulty": "Medium",
-        "image_url": "img/download (7).jpg",
-        "care": {
-            "water": "💧 Water when top 2-3 inches dry - likes moisture but not soggy",
-            "light": "☀️ Bright indirect light - can tolerate medium light",
-            "temperature": "🌡️ 18-27°C (65-80°F) - tropical plant",
-            "humidity": "💨 High humidity 60-80% - mist daily in dry climates",
-            "soil": "🌱 Rich, chunky, well-draining mix with orchid bark and perlite",
-            "fertilizer": "🌿 Every 2 weeks during growing season with balanced fertilizer",
-            "pruning": "✂️ Prune aerials roots and control size as needed",
-            "support": "🎋 Provide moss pole or trellis for climbing"
-        },
-        "problems_and_solutions": {
-            "Yellow Leaves": {
-                "causes": ["Overwatering", "Nutrient deficiency", "Natural aging", "Poor drainage"],
-                "diagnosis": "Leaves turn yellow, especially older lower leaves",
-                "treatment": [
-                    "1. Check soil - if constantly wet, reduce watering",
-                    "2. Ensure drainage holes are clear",
-                    "3. Feed with balanced fertilizer (especially nitrogen)",
-                    "4. Remove completely yellow leaves",
-                    "5. If many leaves yellowing: repot in fresh soil",
-                    "6. One yellow leaf occasionally is normal aging"
-                ],
-                "prevention": "Water when top 2-3 inches dry, fertilize regularly"
-            },
-            "Brown Edges/Tips": {
-                "causes": ["Low humidity", "Under-watering", "Salt buildup", "Pest damage"],
-                "diagnosis": "Brown, crispy edges on leaves",
-                "treatment": [
-                    "1. Increase humidity immediately (aim for 60%+)",
-                    "2. Use humidifier near plant",
-                    "3. Mist leaves twice daily",
-                    "4. Flush soil with distilled water to remove salts",
-                    "5. Check for spider mites (fine webbing)",
-                    "6. Wipe leaves with neem oil solution weekly"
-                ],
-                "prevention": "Maintain high humidity, regular misting"
-            },
-            "No Leaf Splits (Fenestrations)": {
-                "causes": ["Insufficient light", "Young plant", "Poor nutrition", "No climbing support"],
-                "diagnosis": "Leaves grow but remain solid without splits/holes",
-                "treatment": [
-                    "1. Move to brighter location (bright indirect)",
-                    "2. Provide moss pole for climbing - triggers fenestrations!",
-                    "3. Feed with balanced fertilizer every 2 weeks",
-                    "4. Be patient - plant needs to mature (1-3 years)",
-                    "5. Ensure adequate watering and humidity",
-                    "6. Older, larger leaves split more"
-                ],
-                "prevention": "Bright light, climbing support, mature plant, good nutrition"
-            }
-        },
-        "fun_facts": "Fenestrations (leaf holes) help wind pass through in nature! Fruit is edible when ripe (tastes like fruit salad)."
-    },
-
-    "Aloe Vera (صبار الألوفيرا)": {
-        "scientific_name": "Aloe barbadensis miller",
-        "difficulty": "Easy",
-        "image_url": "img/Aloe Vera.jpg",
-        "care": {
-            "water": "💧 Water deeply every 2-3 weeks when soil completely dry",
-            "light": "☀️ Bright indirect to direct light - at least 6 hours daily",
-            "temperature": "🌡️ 13-27°C (55-80°F) - frost sensitive",
-            "humidity": "💨 Low humidity preferred - very drought tolerant",
-            "soil": "🌱 Cactus/succulent well-draining mix with sand and perlite",
-            "fertilizer": "🌿 Once in spring with diluted cactus fertilizer",
-            "pruning": "✂️ Remove dead leaves at base, harvest mature outer leaves"
-        },
-        "problems_and_solutions": {
-            "Brown/Soft Leaves": {
-                "causes": ["Root rot from overwatering", "Fungal infection"],
-                "diagnosis": "Leaves soft, mushy, brown at base",
-                "treatment": [
-                    "1. CRITICAL: Stop watering immediately",
-                    "2. Remove plant from pot",
-                    "3. Inspect roots - brown/mushy = rotted",
-                    "4. Cut ALL rotten roots with sterile knife",
-                    "5. Let plant dry completely for 3-5 days",
-                    "6. Dust roots with cinnamon (natural fungicide)",
-                    "7. Repot in completely DRY cactus soil",
-                    "8. Don't water for 2 weeks",
-                    "9. Resume very light watering (every 3-4 weeks)"
-                ],
-                "prevention": "Water only when soil bone dry, ensure excellent drainage"
-            },
-            "Thin/Drooping Leaves": {
-                "causes": ["Severe under-watering", "Root damage"],
-                "diagnosis": "Leaves thin, wrinkled, drooping inward",
-                "treatment": [
-                    "1. Water thoroughly (first time in emergency)",
-                    "2. Water should drain completely through pot",
-                    "3. Leaves should plump up within 24-48 hours",
-                    "4. Resume normal watering schedule (every 2-3 weeks)",
-                    "5. Check roots for damage during next repotting"
-                ],
-                "prevention": "Don't ignore completely - water when leaves start to thin"
-            },
-            "Red/Brown Leaf Color": {
-                "causes": ["Too much direct sun", "Stress", "Cold damage"],
-                "diagnosis": "Leaves turn red, brown, or purple",
-                "treatment": [
-                    "1. If sunburn: move to bright indirect light",
-                    "2. Gradually acclimate to brighter light over 2 weeks",
-                    "3. Damaged areas won't recover - remove if severe",
-                    "4. If cold damage: move to warmer location",
-                    "5. Some reddening in winter is normal stress response"
-                ],
-                "prevention": "Acclimate gradually to direct sun, protect from cold"
-            }
-        },
-        "fun_facts": "Gel inside leaves has medicinal properties! Can treat minor burns and skin irritations. Plant can live 100+ years!"
-    },
-
-    "Basil (ريحان)": {
-        "scientific_name": "Ocimum basilicum",
-        "difficulty": "Easy",
-        "image_url": "img/v.jpg",
-        "care": {
-            "water": "💧 Water daily to keep soil consistently moist - wilts quickly when dry",
-            "light": "☀️ 6-8 hours direct sunlight daily - full sun preferred",
-            "temperature": "🌡️ 18-27°C (65-80°F) - heat-loving herb",
-            "humidity": "💨 Medium humidity 40-60%",
-            "soil": "🌱 Rich, well-draining soil with compost",
-            "fertilizer": "🌿 Every 2 weeks with fish emulsion or balanced fertilizer",
-            "pruning": "✂️ Pinch off flowers immediately, harvest from top to encourage bushiness",
-            "harvest": "🌿 Harvest regularly for best growth - pinch leaves from top"
-        },
-        "problems_and_solutions": {
-            "Yellow Leaves": {
-                "causes": ["Overwatering", "Nitrogen deficiency", "Natural aging", "Disease"],
-                "diagnosis": "Lower leaves turn yellow first",
-                "treatment": [
-                    "1. Check soil - if constantly soggy, reduce watering frequency",
-                    "2. Improve drainage if needed",
-                    "3. Feed with nitrogen-rich fertilizer (fish emulsion excellent)",
-                    "4. Remove yellowing leaves to prevent disease spread",
-                    "5. If many leaves yellow: check for root rot",
-                    "6. Ensure 6+ hours direct sunlight"
-                ],
-                "prevention": "Well-draining soil, regular feeding, proper light"
-            },
-            "Black Spots (Downy Mildew)": {
-                "causes": ["Fungal disease from excess moisture", "Poor air circulation", "Overhead watering"],
-                "diagnosis": "Black or dark brown spots on leaves, yellow patches",
-                "treatment": [
-                    "1. ISOLATE plant immediately",
-                    "2. Remove ALL affected leaves and destroy (don't compost)",
-                    "3. Stop misting - water soil only, not leaves",
-                    "4. Improve air circulation drastically",
-                    "5. Apply fungicide if spreading",
-                    "6. May need to start fresh plant if severe",
-                    "7. Prevent: water morning only, never wet leaves"
-                ],
-                "prevention": "Water soil only, never leaves. Good air flow. Morning watering."
-            },
-            "Wilting Despite Moist Soil": {
-                "causes": ["Root rot", "Fusarium wilt disease", "Extreme heat"],
-                "diagnosis": "Plant wilts but soil is wet",
-                "treatment": [
-                    "1. Check roots - if brown/slimy = root rot",
-                    "2. If root rot: may not be salvageable",
-                    "3. Try taking healthy stem cuttings to propagate",
-                    "4. Start new plant in fresh soil",
-                    "5. If heat stress: provide afternoon shade",
-                    "6. Mist leaves to cool plant"
-                ],
-                "prevention": "Don't overwater, ensure drainage, provide air circulation"
-            },
-            "Leggy/Sparse Growth": {
-                "causes": ["Insufficient light", "Not harvesting/pinching", "Flowering"],
-                "diagnosis": "Tall, thin stems with few leaves",
-                "treatment": [
-                    "1. Move to full sun location immediately",
-                    "2. Pinch off ALL flower buds (prevents flowering)",
-                    "3. Harvest aggressively from top 1/3 of plant",
-                    "4. Cut back stems to encourage branching",
-                    "5. Feed with balanced fertilizer"
-                ],
-                "prevention": "Full sun, pinch regularly, remove flowers immediately"
-            }
-        },
-        "fun_facts": "Over 60 varieties exist! Pinching flowers makes plant bushier and more flavorful. Natural mosquito repellent!"
-    },
-
-    "Tomato (طماطم)": {
-        "scientific_name": "Solanum lycopersicum",
-        "difficulty": "Medium",
-        "image_url": "img/t.jpg",
-        "care": {
-            "water": "💧 Water deeply 2-3 times per week - consistent moisture critical",
-            "light": "☀️ Full sun 6-8 hours daily - more is better",
-            "temperature": "🌡️ 21-27°C (70-80°F) day, 15-18°C (60-65°F) night",
-            "humidity": "💨 Medium humidity 40-70%",
-            "soil": "🌱 Rich, well-draining soil with organic matter, pH 6.0-6.8",
-            "fertilizer": "🌿 Weekly with tomato-specific fertilizer once flowering",
-            "pruning": "✂️ Remove suckers, prune lower leaves for air flow",
-            "support": "🎋 Stake or cage required - plants get heavy with fruit"
-        },
-        "problems_and_solutions": {
-            "Yellow Lower Leaves": {
-                "causes": ["Nitrogen deficiency", "Natural aging", "Early blight", "Overwatering"],
-                "diagnosis": "Lower leaves turn yellow, may have brown spots",
-                "treatment": [
-                    "1. If natural aging (a few leaves): simply remove them",
-                    "2. If many leaves: likely nitrogen deficiency",
-                    "3. Feed with nitrogen-rich fertilizer immediately",
-                    "4. Apply compost or fish emulsion",
-                    "5. If brown spots present: early blight disease",
-                    "6. For blight: remove affected leaves, apply copper fungicide",
-                    "7. Mulch soil to prevent splash-up during watering",
-                    "8. Improve air circulation"
-                ],
-                "prevention": "Regular feeding, mulch, water soil not leaves, prune for airflow"
-            },
-            "Blossom End Rot": {
-                "causes": ["Calcium deficiency", "Irregular watering", "Rapid growth"],
-                "diagnosis": "Dark, sunken spots on bottom (blossom end) of fruit",
-                "treatment": [
-                    "1. NOT a disease - it's physiological disorder",
-                    "2. Establish consistent watering schedule",
-                    "3. Water deeply and regularly - no drought/flood cycle",
-                    "4. Add calcium: crushed eggshells around plant",
-                    "5. Spray leaves with calcium chloride solution",
-                    "6. Mulch to maintain even soil moisture",
-                    "7. Affected fruit won't recover - pick and discard",
-                    "8. New fruit should be healthy with proper care"
-                ],
-                "prevention": "Consistent watering schedule, calcium-rich soil, mulching"
-            },
-            "Brown Spots on Leaves (Blight)": {
-                "causes": ["Early blight fungus", "Late blight", "Septoria leaf spot"],
-                "diagnosis": "Brown spots with yellow halos, spreading pattern",
-                "treatment": [
-                    "1. CRITICAL: Act fast - blight spreads rapidly",
-                    "2. Remove ALL affected leaves immediately",
-                    "3. Dispose in trash (not compost)",
-                    "4. Apply organic copper fungicide",
-                    "5. Treat every 7-10 days",
-                    "6. Never water from above - soil only",
-                    "7. Increase spacing between plants",
-                    "8. Prune for maximum air circulation",
-                    "9. Apply mulch to prevent soil splash",
-                    "10. May need to remove entire plant if severe"
-                ],
-                "prevention": "Plant resistant varieties, proper spacing, morning watering (soil only), mulch, good air flow"
-            },
-            "No Fruit/Flower Drop": {
-                "causes": ["Temperature stress (too hot/cold)", "Insufficient pollination", "Too much nitrogen"],
-                "diagnosis": "Flowers form but drop without setting fruit",
-                "treatment": [
-                    "1. Check temperature - ideal is 21-27°C days",
-                    "2. If too hot (>32°C): provide afternoon shade, mist plants",
-                    "3. If too cold (<13°C): protect or wait for warmth",
-                    "4. Hand pollinate: gently shake flowers or use cotton swab",
-                    "5. Reduce nitrogen fertilizer - switch to bloom formula (higher phosphorus)",
-                    "6. Ensure good pollinator access if outdoors",
-                    "7. Tap flower stems daily to help pollination"
-                ],
-                "prevention": "Maintain optimal temperatures, balanced fertilization, gentle flower tapping"
-            }
-        },
-        "fun_facts": "Over 10,000 tomato varieties exist! Technically a fruit, legally a vegetable in US. Lycopene increases when cooked!"
-    },
-
-    "Mint (نعناع)": {
-        "scientific_name": "Mentha",
-        "difficulty": "Very Easy",
-        "image_url": "img/mint plant.jpg",
-        "care": {
-            "water": "💧 Water frequently to keep soil consistently moist - never dry",
-            "light": "☀️ Partial shade to full sun - afternoon shade in hot climates",
-            "temperature": "🌡️ 15-25°C (60-75°F) - cool season herb",
-            "humidity": "💨 Medium to high humidity 50-70%",
-            "soil": "🌱 Rich, moist, well-draining soil with organic matter",
-            "fertilizer": "🌿 Monthly with balanced fertilizer during growing season",
-            "pruning": "✂️ Harvest regularly from top, pinch flowers to prevent seeding",
-            "containment": "⚠️ Grow in containers - extremely invasive in gardens!"
-        },
-        "problems_and_solutions": {
-            "Rust Fungus (Orange/Brown Spots)": {
-                "causes": ["Fungal disease (Puccinia menthae)", "High humidity", "Poor air circulation", "Overhead watering"],
-                "diagnosis": "Orange-brown spots on undersides of leaves, leaves may yellow",
-                "treatment": [
-                    "1. ISOLATE plant immediately - rust spreads rapidly",
-                    "2. Remove ALL affected leaves and destroy (don't compost)",
-                    "3. Cut plant back to 2 inches if severely infected",
-                    "4. Dispose of all plant debris",
-                    "5. Apply sulfur or copper fungicide",
-                    "6. Treat weekly for 3-4 weeks",
-                    "7. Improve air circulation drastically",
-                    "8. Water soil only - never wet leaves",
-                    "9. Thin plants to increase spacing",
-                    "10. May need to start fresh from healthy cutting"
-                ],
-                "prevention": "Water morning only (soil only), excellent air flow, proper spacing, avoid crowding"
-            },
-            "Yellow Leaves": {
-                "causes": ["Overwatering", "Poor drainage", "Nutrient deficiency", "Root-bound"],
-                "diagnosis": "Leaves turn yellow, plant may look stunted",
-                "treatment": [
-                    "1. Check drainage - mint likes moisture but not waterlogged",
-                    "2. Ensure pot has drainage holes",
-                    "3. If root-bound: repot to larger container immediately",
-                    "4. Feed with nitrogen-rich fertilizer",
-                    "5. Add compost to soil",
-                    "6. Remove yellow leaves",
-                    "7. Ensure adequate sunlight"
-                ],
-                "prevention": "Well-draining soil, regular feeding, repot annually"
-            },
-            "Slow/Leggy Growth": {
-                "causes": ["Insufficient light", "Nutrient deficiency", "Root-bound", "Not harvesting"],
-                "diagnosis": "Thin, weak stems with sparse leaves",
-                "treatment": [
-                    "1. Move to location with more light (but not hot direct sun)",
-                    "2. Feed with balanced fertilizer",
-                    "3. Check if root-bound - roots circling pot edge",
-                    "4. Repot to larger container with fresh soil",
-                    "5. Harvest aggressively from top 1/3",
-                    "6. Pinch off all flowers",
-                    "7. Cut back leggy stems to encourage branching"
-                ],
-                "prevention": "Adequate light, regular feeding, harvest frequently, repot yearly"
-            },
-            "Black/Brown Stems": {
-                "causes": ["Stem rot", "Root rot", "Fungal disease"],
-                "diagnosis": "Stems turn black/brown at base, plant may wilt",
-                "treatment": [
-                    "1. If entire plant affected: may not be salvageable",
-                    "2. Take healthy stem cuttings from top immediately",
-                    "3. Root cuttings in water",
-                    "4. Start fresh plant in new, sterile soil",
-                    "5. Improve drainage in new pot",
-                    "6. Reduce watering frequency slightly"
-                ],
-                "prevention": "Don't overwater, ensure excellent drainage, good air circulation"
-            }
-        },
-        "fun_facts": "Over 25 species and hundreds of varieties! Spreads aggressively through underground runners. Natural pest deterrent!"
-    }
-}
-
 # =============================================================================
 # IMAGE PROCESSING EXPLANATIONS
 # =============================================================================
@@ -674,6 +64,7 @@ PROCESSING_EXPLANATIONS = {
            - k_R = Gray_avg / R_avg
         4. Apply correction: New_pixel = Old_pixel × k_channel
         5. Clip values to valid range [0, 255]
+        (Steps 4-5 are precomputed as a 256-entry lookup table per channel.)
         
         **Why it matters for plants:**
         - Different lighting (sunlight vs artificial) creates color casts
@@ -683,6 +74,30 @@ PROCESSING_EXPLANATIONS = {
         "example": "Yellow-tinted image from indoor light → Corrected neutral colors"
     },
 
+    "color_calibration": {
+        "title": "Camera Color Calibration (Reference Card Profile)",
+        "theory": """
+        **What it does:** Replaces the per-image Gray World estimate with a profile measured once per camera.
+        
+        **Calibration (once per camera):**
+        1. Photograph a gray card or ColorChecker under the camera's normal lighting
+        2. Gains from the neutral patches: k_c = Gray_avg / C_avg (same formula as Gray World, but on a known gray)
+        3. ColorChecker only: least-squares 3×4 color matrix from the 24 measured patches to their reference colors
+        4. Gains and matrix are baked into a lookup table (64×64×64 cube)
+        
+        **Per frame:** one table lookup; the scene content no longer changes the correction.
+        
+        **Drift detection:**
+        - Gray card left in view: re-measured every frame; the gains are recalibrated after 5 drifting frames
+        - No card: an optional plant-free background region is tracked (EWMA); a sustained shift is reported as "recalibrate" (the plants' own color is never used, so yellowing is not mistaken for drift)
+        
+        **Why it matters for plants:**
+        - A frame full of green leaves pulls the Gray World assumption off
+        - Fixed profiles keep ratios consistent across frames and cameras
+        """,
+        "example": "Greenhouse camera under sodium lamps → gains (1.42, 1.05, 0.71) applied to every frame"
+    },
+
     "clahe": {
         "title": "CLAHE (Contrast Limited Adaptive Histogram Equalization)",
         "theory": """
@@ -1038,6 +453,30 @@ PROCESSING_EXPLANATIONS = {
         "example": "Round spots (C=0.82) → Fungal infection | Irregular spots (C=0.45) → Bacterial blight"
     },
 
+    "leaf_instances": {
+        "title": "Leaf Instance Segmentation (Distance Transform + Watershed)",
+        "theory": """
+        **What it does:** Splits a whole-plant photo into individual leaves and scores each one.
+        
+        **Algorithm Steps:**
+        1. Vegetation mask = green ∪ yellow, plus brown pixels bordering them (lesions)
+        2. Distance transform: each leaf pixel → distance to the nearest background pixel
+        3. Leaf cores: pixels near the local distance maximum (≥ 60% of the peak within 15 px)
+        4. Each core becomes a watershed marker; the rest of the leaf is flooded from the markers
+        5. Narrow necks where leaves touch become the boundaries between leaves
+        
+        **Per-leaf statistics (one pass over the label image):**
+        - Pixel counts per leaf and color via np.bincount
+        - LBP histogram per leaf via a joint (leaf, code) bincount
+        - Each spot is assigned to the leaf covering most of its pixels
+        
+        **Why it matters for plants:**
+        - In a whole-plant photo one diseased leaf is diluted by many healthy ones
+        - Per-leaf scores show exactly which leaf needs attention
+        """,
+        "example": "Whole-plant photo → 14 leaves, each with its own score and grade"
+    },
+
     "health_scoring": {
         "title": "Health Score Calculation (Weighted Feature Fusion)",
         "theory": """
@@ -1101,37 +540,57 @@ PROCESSING_EXPLANATIONS = {
 # ULTIMATE PLANT ANALYZER CLASS
 # =============================================================================
 
+# Coarse-to-fine analysis (analyze_adaptive)
+COARSE_SIZE = (200, 150)
+COARSE_SCORE_MARGIN = 3.0    # points from a grade boundary
+COARSE_RATIO_MARGIN = 0.2    # fraction of a status threshold (capped at 3 points)
+COARSE_MAX_YELLOW = 5.0
+COARSE_MAX_BROWN = 2.0
+
 class UltimatePlantAnalyzer:
     """Ultimate analyzer with comprehensive analysis and explanations"""
 
-    def __init__(self):
+    def __init__(self, stage_workers=1, calibration=None, strict=False, area_scale=None):
         self.green_lower = np.array([35, 40, 40])
         self.green_upper = np.array([85, 255, 255])
         self.yellow_lower = np.array([20, 40, 40])
         self.yellow_upper = np.array([35, 255, 255])
         self.brown_lower = np.array([10, 40, 20])
         self.brown_upper = np.array([20, 255, 200])
+        # Status cut points; species profiles (species.py) may override them
+        self.status_thresholds = dict(STATUS_THRESHOLDS)
         self.processing_steps = {}
         self.step_explanations = []
+        self.stage_workers = stage_workers
+        # calibration.CalibrationProfile / CalibratedBalancer; None = Gray World per image
+        self.calibration = calibration
+        # strict: failures raise pipeline.StageError instead of falling back to neutral values
+        self.strict = strict
+        # growth.AreaScale: converts pixel areas to cm² in the leaf_area stage; None = pixels only
+        self.area_scale = area_scale
+        self.on_stage = None
 
     def apply_white_balance(self, img):
         """White Balance using Gray World Algorithm"""
         self.step_explanations.append(("white_balance", "Applied"))
-        result = img.copy().astype(np.float32)
-        b_avg, g_avg, r_avg = [np.mean(result[:, :, i]) for i in range(3)]
+        b_avg, g_avg, r_avg = cv2.mean(img)[:3]
         gray_avg = (b_avg + g_avg + r_avg) / 3
-        for i, avg in enumerate([b_avg, g_avg, r_avg]):
-            result[:, :, i] = np.clip(result[:, :, i] * (gray_avg / (avg + 1e-6)), 0, 255)
-        return result.astype(np.uint8)
+        # Gains applied through one 256-entry table per channel: no float frame copy
+        levels = np.arange(256, dtype=np.float32)
+        lut = np.stack([
+            np.clip(levels * np.float32(gray_avg / (avg + 1e-6)), 0, 255)
+            for avg in (b_avg, g_avg, r_avg)
+        ], axis=-1).astype(np.uint8)
+        return cv2.LUT(img, lut.reshape(1, 256, 3))
 
     def apply_clahe(self, img):
         """CLAHE Enhancement"""
         self.step_explanations.append(("clahe", "Applied"))
         lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
-        l, a, b = cv2.split(lab)
         clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
-        l = clahe.apply(l)
-        return cv2.cvtColor(cv2.merge([l, a, b]), cv2.COLOR_LAB2BGR)
+        # Only L changes: rewrite it in place instead of splitting/merging all three planes
+        cv2.insertChannel(clahe.apply(cv2.extractChannel(lab, 0)), lab, 0)
+        return cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
 
     def apply_denoising(self, img):
         """Bilateral Filter"""
@@ -1150,216 +609,170 @@ class UltimatePlantAnalyzer:
             cv2.grabCut(img, mask, rect, bgd, fgd, 5, cv2.GC_INIT_WITH_RECT)
             mask2 = np.where((mask == 2) | (mask == 0), 0, 1).astype('uint8')
             return img * mask2[:, :, np.newaxis], mask2 * 255
-        except:
+        except Exception:
+            if self.strict:
+                raise
             return img, np.ones(img.shape[:2], dtype=np.uint8) * 255
 
-    def calculate_lbp(self, gray, mask):
-        """LBP Texture Analysis"""
+    def calculate_lbp(self, gray, mask, roi=None):
+        """LBP Texture Analysis (codes computed only inside `roi` boxes when given)"""
         self.step_explanations.append(("lbp", "Applied"))
         if not HAS_SKIMAGE:
+            if self.strict:
+                raise ImportError("LBP texture analysis requires scikit-image")
             return 0.0, gray, []
         try:
-            lbp = local_binary_pattern(gray, 24, 3, method='uniform')
+            if roi is None:
+                lbp = local_binary_pattern(gray, 24, 3, method='uniform')
+            else:
+                # Flat (empty) background has the all-ones pattern: code 24
+                lbp = map_boxes(roi, lambda g: local_binary_pattern(g, 24, 3, method='uniform'), gray, fill=24)
             lbp_masked = lbp[mask > 0]
             if len(lbp_masked) == 0:
                 return 0.0, lbp, []
             hist, _ = np.histogram(lbp_masked, bins=26, range=(0, 26), density=True)
             entropy = -np.sum(hist[hist > 0] * np.log2(hist[hist > 0] + 1e-10))
             return round(entropy, 3), lbp, hist.tolist()
-        except:
+        except Exception:
+            if self.strict:
+                raise
             return 0.0, gray, []
 
-    def create_damage_heatmap(self, original, y_mask, b_mask):
-        """Spatial Damage Heatmap"""
+    def create_damage_heatmap(self, original, y_mask, b_mask, roi=None):
+        """Spatial Damage Heatmap (blurred only inside `roi` boxes when given)"""
         self.step_explanations.append(("damage_heatmap", "Created"))
         try:
-            damage = (y_mask.astype(float) * 0.5) + (b_mask.astype(float) * 1.0)
-            damage = np.clip(damage, 0, 255).astype(np.uint8)
-            damage = cv2.GaussianBlur(damage, (15, 15), 0)
+            def blur(y, b):
+                damage = (y.astype(float) * 0.5) + (b.astype(float) * 1.0)
+                damage = np.clip(damage, 0, 255).astype(np.uint8)
+                return cv2.GaussianBlur(damage, (15, 15), 0)
+
+            damage = blur(y_mask, b_mask) if roi is None else map_boxes(roi, blur, y_mask, b_mask)
             if damage.max() > 0:
                 damage = (damage / damage.max() * 255).astype(np.uint8)
             heatmap = cv2.applyColorMap(damage, cv2.COLORMAP_JET)
             result = cv2.addWeighted(original, 0.6, heatmap, 0.4, 0)
             return result, damage
-        except:
+        except Exception:
+            if self.strict:
+                raise
             return original, np.zeros(original.shape[:2], dtype=np.uint8)
 
-    def analyze_disease_spots(self, mask):
+    def analyze_disease_spots(self, mask, scale=1.0):
         """Disease spot analysis with shape classification"""
         self.step_explanations.append(("disease_spots", "Analyzed"))
         try:
             contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
             spots = {'total': 0, 'small': 0, 'medium': 0, 'large': 0, 'types': [], 'severity': 0}
+            # Size classes are defined in full-resolution (800 x 600) pixels
+            area_scale = scale ** 2
 
             for c in contours:
-                area = cv2.contourArea(c)
+                area = cv2.contourArea(c) / area_scale
                 if area < 20:
                     continue
 
+                size, spot_type = self.classify_spot(area, cv2.arcLength(c, True) / scale)
                 spots['total'] += 1
+                spots[size] += 1
+                if spot_type:
+                    spots['types'].append(spot_type)
 
-                if area < 100:
-                    spots['small'] += 1
-                    sev = 1
-                elif area < 500:
-                    spots['medium'] += 1
-                    sev = 2
-                else:
-                    spots['large'] += 1
-                    sev = 3
-
-                perim = cv2.arcLength(c, True)
-                if perim > 0:
-                    circ = 4 * np.pi * area / (perim ** 2)
-                    dtype = "Fungal" if circ > 0.75 else "Bacterial" if circ > 0.5 else "Physical"
-                    spots['types'].append({'type': dtype, 'circ': round(circ, 2), 'sev': sev})
-
-            spots['severity'] = min(100, spots['small']*5 + spots['medium']*15 + spots['large']*30)
+            spots['severity'] = self.spot_severity(spots)
             return spots
-        except:
+        except Exception:
+            if self.strict:
+                raise
             return {'total': 0, 'small': 0, 'medium': 0, 'large': 0, 'types': [], 'severity': 0}
 
-    def analyze(self, pil_image, use_grabcut=False):
-        """Complete analysis pipeline with explanations"""
+    def classify_spot(self, area, perim):
+        """Size class and shape type of one spot (area / perimeter in full-resolution pixels)"""
+        return classify_spot(area, perim)
+
+    def spot_severity(self, spots):
+        return spot_severity(spots)
+
+    def analyze(self, pil_image, use_grabcut=False, outputs=None, pipeline=None, max_size=(800, 600),
+                crop_to_fg=False):
+        """
+        Complete analysis pipeline with explanations.
+
+        `outputs` limits the run to the stages needed for those artifacts
+        (e.g. pipeline.SCORING_OUTPUTS for headless scoring); `pipeline`
+        swaps in a custom declarative Pipeline; `max_size` is the analysis
+        resolution bound (width, height). `crop_to_fg` runs the stages after
+        segmentation only inside padded foreground boxes (useful with GrabCut;
+        edge density then counts foreground edges only). Returns None on
+        failure, or raises pipeline.StageError in strict mode.
+        """
         self.step_explanations = []
 
         try:
-            # 1. Convert and resize
-            img_bgr = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
-            h, w = img_bgr.shape[:2]
-            aspect = w / h
-            target_w, target_h = (800, int(800/aspect)) if aspect > 1.33 else (int(600*aspect), 600)
-            img_bgr = cv2.resize(img_bgr, (target_w, target_h), interpolation=cv2.INTER_AREA)
-
-            self.processing_steps['original'] = img_bgr.copy()
-
-            # 2. Enhancement pipeline
-            balanced = self.apply_white_balance(img_bgr)
-            self.processing_steps['white_balanced'] = balanced.copy()
-
-            enhanced = self.apply_clahe(balanced)
-            self.processing_steps['clahe'] = enhanced.copy()
-
-            final = self.apply_denoising(enhanced)
-            self.processing_steps['denoised'] = final.copy()
-
-            # 3. Optional GrabCut
-            if use_grabcut:
-                segmented, fg_mask = self.apply_grabcut(final)
-                self.processing_steps['segmented'] = segmented.copy()
-            else:
-                segmented = final
-                fg_mask = np.ones(final.shape[:2], dtype=np.uint8) * 255
-
-            self.processing_steps['fg_mask'] = fg_mask
-
-            # 4. HSV Segmentation
-            self.step_explanations.append(("hsv_segmentation", "Applied"))
-            hsv = cv2.cvtColor(segmented, cv2.COLOR_BGR2HSV)
-            g_mask = cv2.inRange(hsv, self.green_lower, self.green_upper)
-            y_mask = cv2.inRange(hsv, self.yellow_lower, self.yellow_upper)
-            b_mask = cv2.inRange(hsv, self.brown_lower, self.brown_upper)
-
-            # 5. Morphological operations
-            self.step_explanations.append(("morphological_ops", "Applied"))
-            kernel = np.ones((5, 5), np.uint8)
-            for m in [g_mask, y_mask, b_mask]:
-                cv2.morphologyEx(m, cv2.MORPH_OPEN, kernel, m)
-                cv2.morphologyEx(m, cv2.MORPH_CLOSE, kernel, m)
-
-            # 6. Calculate ratios
-            total = np.sum(fg_mask > 0)
-            if total == 0:
-                total = 1
-
-            green_r = (np.sum(g_mask > 0) / total) * 100
-            yellow_r = (np.sum(y_mask > 0) / total) * 100
-            brown_r = (np.sum(b_mask > 0) / total) * 100
-
-            # 7. Edge detection
-            self.step_explanations.append(("canny_edges", "Detected"))
-            gray = cv2.cvtColor(segmented, cv2.COLOR_BGR2GRAY)
-            self.processing_steps['gray'] = gray.copy()
-
-            edges = cv2.Canny(gray, 50, 150)
-            self.processing_steps['edges'] = edges.copy()
-
-            edge_d = (np.sum(edges > 0) / total) * 100
-
-            # 8. LBP Texture
-            lbp_e, lbp_img, lbp_hist = self.calculate_lbp(gray, fg_mask)
-            self.processing_steps['lbp'] = lbp_img
-
-            # 9. Disease spots
-            spots = self.analyze_disease_spots(b_mask)
-
-            # 10. Heatmap
-            heatmap, dmg_map = self.create_damage_heatmap(img_bgr, y_mask, b_mask)
-            self.processing_steps['heatmap'] = heatmap
-
-            # 11. Health classification
-            self.step_explanations.append(("health_scoring", "Calculated"))
-            health = self.classify_health(green_r, yellow_r, brown_r, spots, lbp_e)
-
-            return {
-                'ratios': {'green': round(green_r, 2), 'yellow': round(yellow_r, 2), 'brown': round(brown_r, 2)},
-                'edge_d': round(edge_d, 2),
-                'lbp_e': lbp_e,
-                'lbp_hist': lbp_hist,
-                'spots': spots,
-                'health': health,
-                'masks': {'g': g_mask, 'y': y_mask, 'b': b_mask}
-            }
+            artifacts = (pipeline or DEFAULT_PIPELINE).run(
+                self, {'image': pil_image},
+                outputs=RESULT_ARTIFACTS if outputs is None else outputs,
+                options={'use_grabcut': use_grabcut, 'max_size': max_size, 'crop_to_fg': crop_to_fg},
+                max_workers=self.stage_workers
+            )
+            return build_result(artifacts)
 
         except Exception as e:
-            st.error(f"Analysis error: {str(e)}")
+            if self.strict:
+                raise
+            if HAS_STREAMLIT:
+                st.error(f"Analysis error: {str(e)}")
+            return None
+
+    def analyze_adaptive(self, pil_image, use_grabcut=False, outputs=None, pipeline=None, coarse_size=COARSE_SIZE):
+        """Coarse-to-fine: analyze a thumbnail, escalate to full resolution only if it is ambiguous"""
+        if outputs is not None:
+            outputs = tuple(outputs) + tuple(o for o in ('ratios', 'spots', 'health') if o not in outputs)
+        result = self.analyze(pil_image, use_grabcut, outputs, pipeline, max_size=coarse_size)
+        if result is None:
             return None
 
+        reasons = self.escalation_reasons(result)
+        if reasons:
+            result = self.analyze(pil_image, use_grabcut, outputs, pipeline)
+            if result is None:
+                return None
+        result['resolution'].update({'mode': 'full' if reasons else 'coarse', 'escalated_because': reasons})
+        return result
+
+    def escalation_reasons(self, result):
+        """Why a coarse result cannot be trusted (empty list = it can)"""
+        reasons = []
+        score = result['health']['score']
+        for floor, grade, _, _ in HEALTH_GRADES[:-1]:
+            if abs(score - floor) < COARSE_SCORE_MARGIN:
+                reasons.append(f"score {score} near grade {grade} boundary ({floor})")
+        for color, thresholds in self.status_thresholds.items():
+            for t in thresholds:
+                if abs(result['ratios'][color] - t) < min(3.0, COARSE_RATIO_MARGIN * t):
+                    reasons.append(f"{color} {result['ratios'][color]}% near status threshold {t}%")
+        # Spot size classes are defined in full-resolution pixels
+        if result['spots']['total'] > 0:
+            reasons.append(f"{result['spots']['total']} spots detected")
+        if result['ratios']['yellow'] > COARSE_MAX_YELLOW:
+            reasons.append(f"yellow {result['ratios']['yellow']}% above {COARSE_MAX_YELLOW}%")
+        if result['ratios']['brown'] > COARSE_MAX_BROWN:
+            reasons.append(f"brown {result['ratios']['brown']}% above {COARSE_MAX_BROWN}%")
+        return reasons
+
     def classify_health(self, green, yellow, brown, spots, lbp):
-        """Health classification with scoring"""
-        score = 100
-        score += green * 0.5 - yellow * 1.2 - brown * 2.5 - lbp * 2 - spots['severity'] * 0.3
-        score = max(0, min(100, round(score, 1)))
-
-        if score >= 90:
-            grade, text, color = "A+", "Excellent", "#00ff88"
-        elif score >= 80:
-            grade, text, color = "A", "Very Good", "#66ff00"
-        elif score >= 70:
-            grade, text, color = "B", "Good", "#ccff00"
-        elif score >= 60:
-            grade, text, color = "C", "Fair", "#ffaa00"
-        elif score >= 50:
-            grade, text, color = "D", "Poor", "#ff6600"
-        else:
-            grade, text, color = "F", "Critical", "#ff4444"
-
-        if green > 85 and yellow < 5 and brown < 2:
-            status = "Healthy (صحي)"
-            problems = ["No significant issues detected"]
-        elif brown > 15:
-            status = "Diseased/Necrotic (مريض/نخر)"
-            problems = [f"High necrosis ({brown}%)", "Possible fungal infection"]
-        elif yellow > 15:
-            status = "Water/Nutrient Stress (إجهاد)"
-            problems = [f"Chlorosis detected ({yellow}%)", "Check watering/nutrients"]
-        else:
-            status = "Moderate Issues (مشاكل متوسطة)"
-            problems = ["Early stress signs", "Monitor closely"]
-
-        return {
-            'status': status,
-            'score': score,
-            'grade': grade,
-            'text': text,
-            'color': color,
-            'problems': problems
-        }
+        """Health classification with scoring (this analyzer's status thresholds)"""
+        return classify_health(green, yellow, brown, spots, lbp, self.status_thresholds)
 
 # =============================================================================
 # STREAMLIT UI
 # =============================================================================
 
+def get_species_classifier():
+    """Reference index over the bundled plant images, built once per session"""
+    if 'species_classifier' not in st.session_state:
+        st.session_state.species_classifier = SpeciesClassifier(UltimatePlantAnalyzer()).build_from_database()
+    return st.session_state.species_classifier
+
 def main():
     st.set_page_config(
         page_title="🌿 Plant Care Complete",
@@ -1398,6 +811,18 @@ def main():
             help="Slower but removes background completely"
         )
 
+        auto_species = st.checkbox(
+            "Auto-detect species from photo",
+            value=False,
+            help="Identifies the plant from the image and uses its care profile"
+        )
+
+        per_leaf = st.checkbox(
+            "Score each leaf separately",
+            value=False,
+            help="Splits whole-plant photos into leaves (watershed) and grades every leaf"
+        )
+
         st.divider()
 
         if selected_plant:
@@ -1448,12 +873,24 @@ def main():
             if st.button("Run Complete Analysis", type="primary"):
                 with st.spinner("🔄 Processing image..."):
                     analyzer = UltimatePlantAnalyzer()
-                    results = analyzer.analyze(img, use_grabcut)
+                    pipeline, outputs = (LEAF_PIPELINE, LEAF_OUTPUTS) if per_leaf else (None, None)
+                    if auto_species:
+                        results = identify_and_analyze(analyzer, get_species_classifier(), img, use_grabcut,
+                                                       pipeline=pipeline, outputs=outputs)
+                    else:
+                        results = analyzer.analyze(img, use_grabcut, outputs, pipeline)
 
                     if results:
                         st.session_state.results = results
                         st.session_state.analyzer = analyzer
+                        st.session_state.reports = {}    # report bytes per (plant, format) for these results
                         st.session_state.selected_plant = selected_plant
+                        if results.get('species', {}).get('name'):
+                            st.session_state.selected_plant = results['species']['name']
+                            st.info(f"🔎 Identified: **{results['species']['name']}** "
+                                    f"(confidence {results['species']['confidence']:.0%})")
+                        elif 'species' in results:
+                            st.warning("🔎 Species not recognised - default analysis settings used")
                         st.success("✅ Analysis Complete!")
                         st.balloons()
 
@@ -1480,6 +917,26 @@ def main():
             m3.metric("Necrosis %", f"{res['ratios']['brown']:.1f}%")
             m4.metric("Disease Spots", res['spots']['total'])
 
+            if res.get('leaves'):
+                st.subheader(f"🍃 Per-Leaf Health ({len(res['leaves'])} leaves)")
+                leaf_c1, leaf_c2 = st.columns([1.2, 1])
+                with leaf_c1:
+                    st.image(cv2.cvtColor(analyzer.processing_steps['leaves'], cv2.COLOR_BGR2RGB),
+                             caption="Leaves outlined by grade", use_container_width=True)
+                with leaf_c2:
+                    st.dataframe([
+                        {
+                            "Leaf": leaf['id'],
+                            "Score": leaf['health']['score'],
+                            "Grade": leaf['health']['grade'],
+                            "Green %": leaf['ratios']['green'],
+                            "Yellow %": leaf['ratios']['yellow'],
+                            "Brown %": leaf['ratios']['brown'],
+                            "Spots": leaf['spots']['total']
+                        }
+                        for leaf in sorted(res['leaves'], key=lambda l: l['health']['score'])
+                    ], hide_index=True, use_container_width=True)
+
             # Tabs
             tab1, tab2, tab3, tab4, tab5 = st.tabs([
                 "📍 Damage Heatmap",
@@ -1614,29 +1071,37 @@ def main():
                 st.success(f"**Lighting:** {plant_info['care']['light']}")
 
                 # Show relevant problem solutions
-                if "Diseased" in health['status'] or health['score'] < 70:
+                relevant = find_relevant_problems(st.session_state.selected_plant, res)
+                if relevant:
                     st.warning("### ⚠️ Recommended Actions:")
 
-                    # Find most relevant problem
-                    if res['ratios']['brown'] > 10:
-                        st.markdown("**Detected: Brown/Dead Tissue**")
-                        for prob_name, prob_details in plant_info['problems_and_solutions'].items():
-                            if any(keyword in prob_name.lower() for keyword in ['brown', 'spot', 'rot', 'disease']):
-                                st.markdown(f"**{prob_name}:** {prob_details['diagnosis']}")
-                                st.markdown("**Treatment:**")
-                                for i, step in enumerate(prob_details['treatment'][:5], 1):
-                                    st.markdown(step)
-                                break
-
-                    elif res['ratios']['yellow'] > 15:
-                        st.markdown("**Detected: Yellowing (Chlorosis)**")
-                        for prob_name, prob_details in plant_info['problems_and_solutions'].items():
-                            if 'yellow' in prob_name.lower():
-                                st.markdown(f"**{prob_name}:** {prob_details['diagnosis']}")
-                                st.markdown("**Treatment:**")
-                                for i, step in enumerate(prob_details['treatment'][:5], 1):
-                                    st.markdown(step)
-                                break
+                    for label, prob_name, prob_details in relevant:
+                        st.markdown(f"**Detected: {label}**")
+                        st.markdown(f"**{prob_name}:** {prob_details['diagnosis']}")
+                        st.markdown("**Treatment:**")
+                        for step in prob_details['treatment'][:5]:
+                            st.markdown(step)
+
+            # Downloadable report
+            st.markdown("---")
+            st.subheader("📄 Download Health Report")
+
+            report_plant = st.session_state.get('selected_plant')
+            report_fmt = st.radio("Report format", ["HTML", "PDF", "JSON"], horizontal=True).lower()
+            # Built once per analysis and format: Streamlit reruns the script on every widget change
+            reports = st.session_state.setdefault('reports', {})
+            if (report_plant, report_fmt) not in reports:
+                reports[(report_plant, report_fmt)] = generate_report(
+                    res, report_plant, PLANT_DATABASE.get(report_plant),
+                    analyzer.processing_steps, fmt=report_fmt
+                )
+            report_bytes = reports[(report_plant, report_fmt)]
+            st.download_button(
+                f"⬇️ Download {report_fmt.upper()} Report",
+                data=report_bytes,
+                file_name=f"plant_health_report.{report_fmt}",
+                mime=REPORT_MIME[report_fmt]
+            )
 
         else:
             st.info("👆 Upload a plant leaf image and click 'Run Complete Analysis'!")
@@ -0,0 +1,315 @@
+"""
+=============================================================================
+PRIORITY SCHEDULER
+=============================================================================
+Features:
+- Priority classes (interactive, camera, backfill) in front of a pool of
+  analyzer threads, one UltimatePlantAnalyzer per thread
+- Weighted fair queuing (self-clocked): each class gets service in
+  proportion to its weight while backlogged, so backfill never starves
+  but cannot delay interactive uploads by more than one image
+- Preemption between images: every image is its own job, so a new
+  interactive request is dispatched as soon as any worker finishes its
+  current image
+- Admission control: a request is rejected up front when its predicted
+  queueing delay exceeds the class limit
+- Per-class latency metrics and SLO attainment, as a dict or in the
+  Prometheus text format
+=============================================================================
+
+    scheduler = PriorityScheduler(workers=2)
+    future = scheduler.submit(img, "interactive")
+    for path in archive:
+        scheduler.submit_path(path, "backfill")
+    result = future.result()
+    print(scheduler.prometheus_text())
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class PriorityClass:
+    """Scheduling parameters of one request class"""
+
+    __slots__ = ("name", "weight", "slo_ms", "max_wait_ms")
+
+    def __init__(self, name, weight, slo_ms, max_wait_ms=None):
+        self.name = name
+        self.weight = weight
+        self.slo_ms = slo_ms              # end-to-end latency target (queue + analysis)
+        self.max_wait_ms = max_wait_ms    # admission limit on the predicted queueing delay; None = always admit
+
+
+DEFAULT_CLASSES = (
+    PriorityClass("interactive", weight=16, slo_ms=3000, max_wait_ms=5000),
+    PriorityClass("camera", weight=4, slo_ms=30000, max_wait_ms=120000),
+    PriorityClass("backfill", weight=1, slo_ms=None)
+)
+
+DEFAULT_SERVICE_S = 0.5       # initial analysis time estimate per image
+SERVICE_ALPHA = 0.2           # EWMA weight of the newest measured analysis time
+LATENCY_WINDOW = 2048         # recent latencies kept per class for percentiles
+
+
+class AdmissionError(RuntimeError):
+    """A request was rejected because its class queue is too far behind"""
+
+    def __init__(self, cls, predicted_ms, limit_ms):
+        super().__init__(f"{cls}: predicted wait {predicted_ms:.0f} ms exceeds {limit_ms:.0f} ms")
+        self.cls = cls
+        self.predicted_ms = predicted_ms
+        self.limit_ms = limit_ms
+
+
+class _Job:
+    __slots__ = ("cls", "load", "kwargs", "future", "submitted", "finish_tag")
+
+    def __init__(self, cls, load, kwargs, future, submitted, finish_tag):
+        self.cls = cls
+        self.load = load
+        self.kwargs = kwargs
+        self.future = future
+        self.submitted = submitted
+        self.finish_tag = finish_tag
+
+
+class _ClassState:
+    """Queue, fair-queuing tag and metrics of one class"""
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.queue = deque()
+        self.last_tag = 0.0
+        self.service_s = DEFAULT_SERVICE_S
+        self.latencies = deque(maxlen=LATENCY_WINDOW)     # (queue ms, total ms)
+        self.counts = {'submitted': 0, 'rejected': 0, 'completed': 0, 'failed': 0, 'slo_met': 0}
+
+    def backlog_s(self):
+        return len(self.queue) * self.service_s
+
+
+# =============================================================================
+# SCHEDULER
+# =============================================================================
+
+class PriorityScheduler:
+    """
+    Dispatches analysis jobs from per-class FIFO queues to `workers` threads.
+
+    Fair queuing: a job's finish tag is max(virtual time, its class's last
+    tag) + estimated cost / class weight; the job with the smallest tag
+    runs next and the virtual time advances to that tag.
+    """
+
+    def __init__(self, workers=1, classes=DEFAULT_CLASSES, analyzer_factory=None, **analyze_defaults):
+        self.classes = {c.name: _ClassState(c) for c in classes}
+        self.analyze_defaults = analyze_defaults
+        self.analyzer_factory = analyzer_factory
+        self.virtual_time = 0.0
+        self.busy = 0
+        self._heads = []                  # (finish tag, sequence, class) of each non-empty class queue
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._threads = [threading.Thread(target=self._worker, name=f"analyze-{i}", daemon=True)
+                         for i in range(workers)]
+        for t in self._threads:
+            t.start()
+
+    # -------------------------------------------------------------------------
+    # Submission and admission control
+    # -------------------------------------------------------------------------
+
+    def predicted_wait_s(self, cls):
+        """
+        Queueing delay a new `cls` job would see. While its class drains,
+        every other backlogged class is served in proportion to its weight
+        (capped by that class's own backlog); running images finish first.
+        """
+        with self._cond:
+            return self._predicted_wait_s(self.classes[cls])
+
+    def _predicted_wait_s(self, state):
+        own = state.backlog_s()
+        ahead = own
+        for other in self.classes.values():
+            if other is not state:
+                ahead += min(other.backlog_s(), own * other.spec.weight / state.spec.weight)
+        workers = len(self._threads)
+        in_flight = min(self.busy, workers) * state.service_s / 2     # half an image left on average
+        return (ahead + in_flight) / workers
+
+    def submit(self, image, cls="interactive", **kwargs):
+        """Queue a PIL image / RGB array; returns a Future of the analyze() result"""
+        return self._submit(cls, lambda: image, kwargs)
+
+    def submit_path(self, path, cls="backfill", **kwargs):
+        """Queue an image file (opened only when the job runs)"""
+        def load():
+            from PIL import Image
+            with Image.open(path) as img:
+                return img.convert('RGB')
+        return self._submit(cls, load, kwargs)
+
+    def _submit(self, cls, load, kwargs):
+        state = self.classes[cls]
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("scheduler is shut down")
+            state.counts['submitted'] += 1
+            limit = state.spec.max_wait_ms
+            if limit is not None:
+                predicted_ms = self._predicted_wait_s(state) * 1000
+                if predicted_ms > limit:
+                    state.counts['rejected'] += 1
+                    raise AdmissionError(cls, predicted_ms, limit)
+
+            tag = max(self.virtual_time, state.last_tag) + state.service_s / state.spec.weight
+            state.last_tag = tag
+            state.queue.append(_Job(cls, load, kwargs, future, time.perf_counter(), tag))
+            if len(state.queue) == 1:
+                heapq.heappush(self._heads, (tag, next(self._seq), cls))
+            self._cond.notify()
+        return future
+
+    # -------------------------------------------------------------------------
+    # Dispatch
+    # -------------------------------------------------------------------------
+
+    def _next_job(self):
+        """Job with the smallest finish tag (caller holds the lock)"""
+        tag, _, cls = heapq.heappop(self._heads)
+        state = self.classes[cls]
+        job = state.queue.popleft()
+        self.virtual_time = max(self.virtual_time, tag)
+        if state.queue:
+            heapq.heappush(self._heads, (state.queue[0].finish_tag, next(self._seq), cls))
+        return job
+
+    def _worker(self):
+        from plant_care_system import UltimatePlantAnalyzer
+
+        analyzer = (self.analyzer_factory or UltimatePlantAnalyzer)()
+        while True:
+            with self._cond:
+                while not self._heads and not self._closed:
+                    self._cond.wait()
+                if not self._heads:
+                    return
+                job = self._next_job()
+                self.busy += 1
+            if not job.future.set_running_or_notify_cancel():
+                with self._cond:
+                    self.busy -= 1
+                continue
+
+            started = time.perf_counter()
+            try:
+                result = analyzer.analyze(job.load(), **{**self.analyze_defaults, **job.kwargs})
+                error = None
+            except Exception as e:
+                result, error = None, e
+            finished = time.perf_counter()
+            self._record(job, started, finished, failed=error is not None or result is None)
+            if error is not None:
+                job.future.set_exception(error)
+            else:
+                job.future.set_result(result)
+
+    def _record(self, job, started, finished, failed):
+        state = self.classes[job.cls]
+        with self._cond:
+            self.busy -= 1
+            state.service_s += SERVICE_ALPHA * ((finished - started) - state.service_s)
+            if failed:
+                state.counts['failed'] += 1
+                return
+            total_ms = (finished - job.submitted) * 1000
+            state.latencies.append(((started - job.submitted) * 1000, total_ms))
+            state.counts['completed'] += 1
+            if state.spec.slo_ms is None or total_ms <= state.spec.slo_ms:
+                state.counts['slo_met'] += 1
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        """Stop accepting work; queued jobs still run unless `cancel_futures`"""
+        with self._cond:
+            self._closed = True
+            if cancel_futures:
+                for state in self.classes.values():
+                    for job in state.queue:
+                        job.future.cancel()
+                    state.queue.clear()
+                self._heads.clear()
+            self._cond.notify_all()
+        if wait:
+            for t in self._threads:
+                t.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+    # -------------------------------------------------------------------------
+    # Metrics
+    # -------------------------------------------------------------------------
+
+    def metrics(self):
+        """{class: counts, queue depth, latency percentiles (ms) and SLO attainment}"""
+        out = {}
+        with self._cond:
+            for name, state in self.classes.items():
+                lat = np.array(state.latencies, dtype=np.float64).reshape(-1, 2)
+                m = dict(state.counts)
+                m.update({
+                    'queued': len(state.queue),
+                    'weight': state.spec.weight,
+                    'slo_ms': state.spec.slo_ms,
+                    'service_ms': round(state.service_s * 1000, 1),
+                    'predicted_wait_ms': round(self._predicted_wait_s(state) * 1000, 1),
+                    'slo_attainment': m['slo_met'] / m['completed'] if m['completed'] else None
+                })
+                for q in (50, 95, 99):
+                    m[f'queue_p{q}_ms'] = round(float(np.percentile(lat[:, 0], q)), 1) if len(lat) else None
+                    m[f'latency_p{q}_ms'] = round(float(np.percentile(lat[:, 1], q)), 1) if len(lat) else None
+                out[name] = m
+        return out
+
+    def prometheus_text(self, prefix="plant_scheduler"):
+        """Metrics in the Prometheus exposition format (latency summaries in seconds)"""
+        lines = []
+
+        def emit(name, kind, help_text, samples):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"{prefix}_{name}{{{label_text}}} {value}")
+
+        metrics = self.metrics()
+        for counter in ('submitted', 'rejected', 'completed', 'failed', 'slo_met'):
+            emit(f"{counter}_total", "counter", f"Requests {counter.replace('_', ' ')}",
+                 [({'class': c}, m[counter]) for c, m in metrics.items()])
+        emit("queued", "gauge", "Requests waiting", [({'class': c}, m['queued']) for c, m in metrics.items()])
+        emit("predicted_wait_seconds", "gauge", "Predicted queueing delay of a new request",
+             [({'class': c}, m['predicted_wait_ms'] / 1000) for c, m in metrics.items()])
+        for kind, key in (("queue", "queue"), ("latency", "latency")):
+            samples = []
+            for c, m in metrics.items():
+                for q in (50, 95, 99):
+                    value = m[f'{key}_p{q}_ms']
+                    if value is not None:
+                        samples.append(({'class': c, 'quantile': q / 100}, value / 1000))
+            emit(f"{kind}_seconds", "summary", f"Recent {kind} time per request", samples)
+        emit("slo_seconds", "gauge", "End-to-end latency objective",
+             [({'class': c}, m['slo_ms'] / 1000) for c, m in metrics.items() if m['slo_ms'] is not None])
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,348 @@
+"""
+=============================================================================
+DOWNLOADABLE HEALTH REPORTS
+=============================================================================
+Features:
+- JSON / HTML / PDF reports from an `analyze` result + PLANT_DATABASE entry
+- Multi-plant batch reports written entry by entry (streaming)
+- Images encoded once at report resolution, never kept after writing
+- No Streamlit dependency - usable from scripts and batch jobs
+=============================================================================
+"""
+
+import base64
+import datetime
+import html
+import io
+import json
+
+import cv2
+import numpy as np
+
+from knowledge_base import PLANT_DATABASE, find_relevant_problems
+
+
+REPORT_FORMATS = ("json", "html", "pdf")
+REPORT_MIME = {
+    "json": "application/json",
+    "html": "text/html",
+    "pdf": "application/pdf"
+}
+
+# Width (px) images are encoded at; processing images are never larger than 800 px
+REPORT_IMAGE_WIDTH = 480
+REPORT_IMAGE_QUALITY = 85
+
+# processing_steps keys embedded in reports, in display order
+REPORT_IMAGES = [
+    ("original", "Original"),
+    ("heatmap", "Damage Heatmap")
+]
+
+
+# =============================================================================
+# REPORT CONTENT
+# =============================================================================
+
+def encode_report_image(img_bgr, width=REPORT_IMAGE_WIDTH):
+    """Downscale to report resolution and JPEG-encode once"""
+    h, w = img_bgr.shape[:2]
+    if w > width:
+        img_bgr = cv2.resize(img_bgr, (width, max(1, int(h * width / w))), interpolation=cv2.INTER_AREA)
+    ok, buf = cv2.imencode('.jpg', img_bgr, [cv2.IMWRITE_JPEG_QUALITY, REPORT_IMAGE_QUALITY])
+    return buf.tobytes() if ok else None
+
+
+def _plain(value):
+    """Convert NumPy scalars/containers to plain Python for serialization"""
+    if isinstance(value, dict):
+        return {k: _plain(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def build_report_entry(result, plant_name=None, plant_info=None, images=None, title=None):
+    """Assemble one report entry; `images` are BGR arrays keyed like processing_steps"""
+    spots = result['spots']
+    spot_types = {}
+    for s in spots['types']:
+        spot_types[s['type']] = spot_types.get(s['type'], 0) + 1
+
+    entry = {
+        'title': title or plant_name or "Plant Analysis",
+        'plant': plant_name,
+        'health': {k: v for k, v in result['health'].items() if k != 'color'},
+        'ratios': result['ratios'],
+        'edge_d': result['edge_d'],
+        'lbp_e': result['lbp_e'],
+        'spots': {k: spots[k] for k in ('total', 'small', 'medium', 'large', 'severity')},
+        'spot_types': spot_types,
+        'care': {},
+        'recommendations': []
+    }
+
+    if plant_info is None and plant_name in PLANT_DATABASE:
+        plant_info = PLANT_DATABASE[plant_name]
+    if plant_info:
+        entry['scientific_name'] = plant_info.get('scientific_name')
+        entry['care'] = dict(plant_info.get('care', {}))
+        for label, prob_name, details in find_relevant_problems(plant_name, result):
+            entry['recommendations'].append({
+                'detected': label,
+                'problem': prob_name,
+                'diagnosis': details['diagnosis'],
+                'treatment': details['treatment'][:5],
+                'prevention': details['prevention']
+            })
+
+    # Encode each image exactly once; the encoded bytes are all the writers see
+    entry['images'] = []
+    for key, caption in REPORT_IMAGES:
+        if images is not None and images.get(key) is not None:
+            data = encode_report_image(images[key])
+            if data:
+                entry['images'].append((caption, data))
+
+    return _plain(entry)
+
+
+# =============================================================================
+# STREAMING WRITERS
+# =============================================================================
+
+class _JsonReportWriter:
+    """Writes {"generated": ..., "reports": [...]} one entry at a time"""
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.count = 0
+
+    def begin(self, generated):
+        self.fp.write(f'{{"generated": {json.dumps(generated)}, "reports": [\n'.encode())
+
+    def write(self, entry):
+        entry = dict(entry)
+        entry['images'] = [
+            {'caption': caption, 'mime': 'image/jpeg', 'data': base64.b64encode(data).decode('ascii')}
+            for caption, data in entry['images']
+        ]
+        if self.count:
+            self.fp.write(b',\n')
+        self.fp.write(json.dumps(entry, ensure_ascii=False).encode('utf-8'))
+        self.count += 1
+
+    def end(self):
+        self.fp.write(b'\n]}\n')
+
+
+class _HtmlReportWriter:
+    """Self-contained HTML report with inline base64 images"""
+
+    STYLE = """
+        body { font-family: sans-serif; background: #0e1117; color: #e6e6e6; margin: 30px; }
+        h1 { color: #00ff88; }
+        section { background: #1a1f2e; border-radius: 10px; padding: 20px; margin: 20px 0; page-break-inside: avoid; }
+        .grade { font-size: 1.3em; font-weight: bold; }
+        table { border-collapse: collapse; margin: 10px 0; }
+        td, th { border: 1px solid #30363d; padding: 4px 10px; text-align: left; }
+        img { max-width: 48%; margin: 5px; border-radius: 6px; }
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+
+    def _w(self, text):
+        self.fp.write(text.encode('utf-8'))
+
+    def begin(self, generated):
+        self._w(f"<!DOCTYPE html><html><head><meta charset='utf-8'><title>Plant Health Report</title>"
+                f"<style>{self.STYLE}</style></head><body>"
+                f"<h1>🌿 Plant Health Report</h1><p>Generated: {html.escape(generated)}</p>\n")
+
+    def write(self, entry):
+        e = html.escape
+        health = entry['health']
+        ratios = entry['ratios']
+        spots = entry['spots']
+        parts = [f"<section><h2>{e(entry['title'])}</h2>"]
+        if entry.get('scientific_name'):
+            parts.append(f"<p><i>{e(entry['scientific_name'])}</i></p>")
+        parts.append(f"<p class='grade'>{e(health['status'])} - Score {health['score']}/100 "
+                     f"(Grade {e(health['grade'])}, {e(health['text'])})</p>")
+        parts.append("<table><tr><th>Healthy %</th><th>Stress %</th><th>Necrosis %</th>"
+                     "<th>Edge Density %</th><th>LBP Entropy</th></tr>"
+                     f"<tr><td>{ratios['green']}</td><td>{ratios['yellow']}</td><td>{ratios['brown']}</td>"
+                     f"<td>{entry['edge_d']}</td><td>{entry['lbp_e']}</td></tr></table>")
+        parts.append(f"<p><b>Disease spots:</b> {spots['total']} (small {spots['small']}, "
+                     f"medium {spots['medium']}, large {spots['large']}) - severity {spots['severity']}</p>")
+        if entry['spot_types']:
+            parts.append("<p><b>Spot types:</b> " +
+                         ", ".join(f"{e(k)}: {v}" for k, v in entry['spot_types'].items()) + "</p>")
+        parts.append("<ul>" + "".join(f"<li>{e(p)}</li>" for p in health['problems']) + "</ul>")
+        for caption, data in entry['images']:
+            b64 = base64.b64encode(data).decode('ascii')
+            parts.append(f"<img src='data:image/jpeg;base64,{b64}' alt='{e(caption)}' title='{e(caption)}'>")
+        if entry['care']:
+            parts.append("<h3>Care Guide</h3><table>" + "".join(
+                f"<tr><th>{e(k.title())}</th><td>{e(v)}</td></tr>" for k, v in entry['care'].items()) + "</table>")
+        for rec in entry['recommendations']:
+            parts.append(f"<h3>⚠️ Detected: {e(rec['detected'])} - {e(rec['problem'])}</h3>"
+                         f"<p>{e(rec['diagnosis'])}</p><ul>" +
+                         "".join(f"<li>{e(step)}</li>" for step in rec['treatment']) +
+                         f"</ul><p><b>Prevention:</b> {e(rec['prevention'])}</p>")
+        parts.append("</section>\n")
+        self._w("".join(parts))
+
+    def end(self):
+        self._w("</body></html>\n")
+
+
+class _PdfReportWriter:
+    """One PDF page per entry via Matplotlib; each page is flushed and freed"""
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.pdf = None
+
+    def begin(self, generated):
+        from matplotlib.backends.backend_pdf import PdfPages
+        self.pdf = PdfPages(self.fp, metadata={'Title': 'Plant Health Report', 'Subject': generated})
+
+    def write(self, entry):
+        from matplotlib.figure import Figure
+
+        health = entry['health']
+        ratios = entry['ratios']
+        spots = entry['spots']
+        lines = [
+            f"{health['status']}",
+            f"Score: {health['score']}/100   Grade: {health['grade']} ({health['text']})",
+            f"Healthy {ratios['green']}%   Stress {ratios['yellow']}%   Necrosis {ratios['brown']}%",
+            f"Edge density {entry['edge_d']}%   LBP entropy {entry['lbp_e']}",
+            f"Spots: {spots['total']} (S {spots['small']} / M {spots['medium']} / L {spots['large']})"
+            f"   Severity {spots['severity']}",
+            ""
+        ]
+        lines += [f"- {p}" for p in health['problems']]
+        for rec in entry['recommendations']:
+            lines += ["", f"Detected: {rec['detected']} - {rec['problem']}", rec['diagnosis']]
+            lines += rec['treatment']
+        if entry['care']:
+            lines.append("")
+            lines += [f"{k.title()}: {v}" for k, v in entry['care'].items()]
+
+        # A4 portrait; Matplotlib's PDF fonts lack Arabic/emoji glyphs, keep ASCII
+        fig = Figure(figsize=(8.27, 11.69))
+        fig.text(0.06, 0.96, _ascii(entry['title']), fontsize=16, weight='bold', va='top')
+        fig.text(0.06, 0.92, _ascii("\n".join(lines)), fontsize=8.5, va='top', wrap=True, family='monospace')
+        n = len(entry['images'])
+        for i, (caption, data) in enumerate(entry['images']):
+            img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+            ax = fig.add_axes([0.06 + i * (0.88 / n), 0.04, 0.88 / n - 0.02, 0.36])
+            ax.imshow(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+            ax.set_title(caption, fontsize=9)
+            ax.axis('off')
+        self.pdf.savefig(fig)
+
+    def end(self):
+        self.pdf.close()
+
+
+def _ascii(text):
+    return str(text).encode('ascii', 'ignore').decode('ascii').strip()
+
+
+_WRITERS = {
+    "json": _JsonReportWriter,
+    "html": _HtmlReportWriter,
+    "pdf": _PdfReportWriter
+}
+
+
+class ReportWriter:
+    """
+    Streaming report writer.
+
+    Usage:
+        with ReportWriter("report.html") as report:
+            for result, images in analyses:
+                report.add(result, plant_name, plant_info, images)
+
+    Each entry is encoded and written immediately, so memory stays at one
+    entry regardless of how many analyses the report contains.
+    """
+
+    def __init__(self, target, fmt="html"):
+        fmt = fmt.lower()
+        if fmt not in _WRITERS:
+            raise ValueError(f"Unknown report format '{fmt}', expected one of {REPORT_FORMATS}")
+        self.fmt = fmt
+        self._owns_fp = isinstance(target, str)
+        self.fp = open(target, 'wb') if self._owns_fp else target
+        self.writer = _WRITERS[fmt](self.fp)
+        self.count = 0
+        self.writer.begin(datetime.datetime.now().isoformat(timespec='seconds'))
+
+    def add(self, result, plant_name=None, plant_info=None, images=None, title=None):
+        self.writer.write(build_report_entry(result, plant_name, plant_info, images, title))
+        self.count += 1
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.end()
+            self.writer = None
+            if self._owns_fp:
+                self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def generate_report(result, plant_name=None, plant_info=None, images=None, fmt="html"):
+    """Single-analysis report as bytes (for download buttons)"""
+    buf = io.BytesIO()
+    with ReportWriter(buf, fmt) as report:
+        report.add(result, plant_name, plant_info, images)
+    return buf.getvalue()
+
+
+def iter_analyses(paths, analyzer, use_grabcut=False):
+    """Analyze images lazily, yielding (path, result, processing_steps)"""
+    from PIL import Image
+
+    for path in paths:
+        with Image.open(path) as img:
+            result = analyzer.analyze(img.convert('RGB'), use_grabcut)
+        if result is not None:
+            yield path, result, analyzer.processing_steps
+
+
+def write_batch_report(target, paths, analyzer, plant_name=None, plant_info=None, fmt="html", use_grabcut=False):
+    """Analyze and report many images; only one analysis is alive at a time"""
+    with ReportWriter(target, fmt) as report:
+        for path, result, steps in iter_analyses(paths, analyzer, use_grabcut):
+            report.add(result, plant_name, plant_info, steps, title=f"{plant_name or 'Plant'} - {path}")
+        return report.count
+
+
+if __name__ == "__main__":
+    import argparse
+    from plant_care_system import UltimatePlantAnalyzer
+
+    parser = argparse.ArgumentParser(description="Generate a plant health report without the Streamlit UI")
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("-o", "--output", required=True)
+    parser.add_argument("-f", "--format", choices=REPORT_FORMATS, default="html")
+    parser.add_argument("-p", "--plant", choices=list(PLANT_DATABASE.keys()))
+    parser.add_argument("--grabcut", action="store_true")
+    args = parser.parse_args()
+
+    n = write_batch_report(args.output, args.images, UltimatePlantAnalyzer(), args.plant,
+                           fmt=args.format, use_grabcut=args.grabcut)
+    print(f"Wrote {n} analyses to {args.output}")
@@ -0,0 +1,234 @@
+"""
+=============================================================================
+COMPACT RESULT OBJECTS
+=============================================================================
+Features:
+- Slotted result classes (ColorRatios, SpotStats, HealthResult, AnalysisRecord)
+- Spot list stored in two byte arrays instead of one dict per spot
+- Grade / status stored as small codes; text and colors come from the tables
+- Fixed-layout binary serialization (to_bytes / from_bytes); lossless at the
+  precision analyze() reports (LBP histogram kept as float64)
+- Memory benchmark against the dict form: python results.py
+=============================================================================
+"""
+
+import struct
+import sys
+from array import array
+
+from grading import HEALTH_GRADES, HEALTH_STATUSES
+
+
+SPOT_TYPES = ("Fungal", "Bacterial", "Physical")
+_SPOT_TYPE_CODES = {t: i for i, t in enumerate(SPOT_TYPES)}
+
+_STATUS_KEYS = tuple(HEALTH_STATUSES)
+_STATUS_CODES = {text: i for i, text in enumerate(HEALTH_STATUSES.values())}
+_GRADE_CODES = {grade: i for i, (_, grade, _, _) in enumerate(HEALTH_GRADES)}
+
+# ratios(3) edge_d lbp_e score | grade status has_hist | total small medium large severity n_spots
+_HEADER = struct.Struct("<6f3B6I")
+_LBP_BINS = 26
+
+
+class ColorRatios:
+    """Green / yellow / brown percentages"""
+
+    __slots__ = ("green", "yellow", "brown")
+
+    def __init__(self, green, yellow, brown):
+        self.green = green
+        self.yellow = yellow
+        self.brown = brown
+
+    def to_dict(self):
+        return {'green': self.green, 'yellow': self.yellow, 'brown': self.brown}
+
+
+class SpotStats:
+    """
+    Spot counts plus per-spot data in two byte arrays:
+    codes[i] = type * 4 + severity, circ[i] = round(circularity * 100)
+    """
+
+    __slots__ = ("total", "small", "medium", "large", "severity", "codes", "circ")
+
+    def __init__(self, total, small, medium, large, severity, codes=None, circ=None):
+        self.total = total
+        self.small = small
+        self.medium = medium
+        self.large = large
+        self.severity = severity
+        self.codes = codes if codes is not None else array('B')
+        self.circ = circ if circ is not None else array('B')
+
+    @classmethod
+    def from_dict(cls, spots):
+        types = spots['types']
+        codes = array('B', (_SPOT_TYPE_CODES[s['type']] * 4 + s['sev'] for s in types))
+        circ = array('B', (min(255, int(round(s['circ'] * 100))) for s in types))
+        return cls(spots['total'], spots['small'], spots['medium'], spots['large'], spots['severity'], codes, circ)
+
+    @property
+    def types(self):
+        return [{'type': SPOT_TYPES[c >> 2], 'circ': ci / 100, 'sev': c & 3} for c, ci in zip(self.codes, self.circ)]
+
+    def to_dict(self):
+        return {'total': self.total, 'small': self.small, 'medium': self.medium, 'large': self.large,
+                'types': self.types, 'severity': self.severity}
+
+
+class HealthResult:
+    """Score with grade/status codes; text, color and problems are derived"""
+
+    __slots__ = ("score", "grade_code", "status_code")
+
+    def __init__(self, score, grade_code, status_code):
+        self.score = score
+        self.grade_code = grade_code
+        self.status_code = status_code
+
+    @classmethod
+    def from_dict(cls, health):
+        return cls(health['score'], _GRADE_CODES[health['grade']], _STATUS_CODES[health['status']])
+
+    @property
+    def grade(self):
+        return HEALTH_GRADES[self.grade_code][1]
+
+    @property
+    def status(self):
+        return HEALTH_STATUSES[_STATUS_KEYS[self.status_code]]
+
+    def problems(self, ratios):
+        # Same texts as classify_health, with the stored (2-decimal) ratio
+        key = _STATUS_KEYS[self.status_code]
+        if key == 'healthy':
+            return ["No significant issues detected"]
+        if key == 'diseased':
+            return [f"High necrosis ({ratios.brown}%)", "Possible fungal infection"]
+        if key == 'stress':
+            return [f"Chlorosis detected ({ratios.yellow}%)", "Check watering/nutrients"]
+        return ["Early stress signs", "Monitor closely"]
+
+    def to_dict(self, ratios):
+        _, grade, text, color = HEALTH_GRADES[self.grade_code]
+        return {'status': self.status, 'score': self.score, 'grade': grade, 'text': text,
+                'color': color, 'problems': self.problems(ratios)}
+
+
+class AnalysisRecord:
+    """Compact, mask-free form of an analyze() result"""
+
+    __slots__ = ("ratios", "edge_d", "lbp_e", "lbp_hist", "spots", "health")
+
+    def __init__(self, ratios, edge_d, lbp_e, lbp_hist, spots, health):
+        self.ratios = ratios
+        self.edge_d = edge_d
+        self.lbp_e = lbp_e
+        self.lbp_hist = lbp_hist
+        self.spots = spots
+        self.health = health
+
+    @classmethod
+    def from_dict(cls, result):
+        r = result['ratios']
+        return cls(
+            ColorRatios(float(r['green']), float(r['yellow']), float(r['brown'])),
+            float(result.get('edge_d', 0.0)),
+            float(result['lbp_e']),
+            array('d', result['lbp_hist']) if result.get('lbp_hist') else None,
+            SpotStats.from_dict(result['spots']),
+            HealthResult.from_dict(result['health'])
+        )
+
+    def to_dict(self):
+        return {
+            'ratios': self.ratios.to_dict(),
+            'edge_d': self.edge_d,
+            'lbp_e': self.lbp_e,
+            'lbp_hist': list(self.lbp_hist) if self.lbp_hist is not None else [],
+            'spots': self.spots.to_dict(),
+            'health': self.health.to_dict(self.ratios)
+        }
+
+    def to_bytes(self):
+        s = self.spots
+        header = _HEADER.pack(
+            self.ratios.green, self.ratios.yellow, self.ratios.brown, self.edge_d, self.lbp_e, self.health.score,
+            self.health.grade_code, self.health.status_code, self.lbp_hist is not None,
+            s.total, s.small, s.medium, s.large, s.severity, len(s.codes)
+        )
+        hist = self.lbp_hist.tobytes() if self.lbp_hist is not None else b""
+        return header + hist + s.codes.tobytes() + s.circ.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        (green, yellow, brown, edge_d, lbp_e, score, grade_code, status_code, has_hist,
+         total, small, medium, large, severity, n) = _HEADER.unpack_from(data)
+        pos = _HEADER.size
+        hist = None
+        if has_hist:
+            hist = array('d')
+            hist.frombytes(data[pos:pos + 8 * _LBP_BINS])
+            pos += 8 * _LBP_BINS
+        codes, circ = array('B'), array('B')
+        codes.frombytes(data[pos:pos + n])
+        circ.frombytes(data[pos + n:pos + 2 * n])
+        # float32 header fields: round back to the 2/3 decimals analyze() reports
+        return cls(
+            ColorRatios(round(green, 2), round(yellow, 2), round(brown, 2)),
+            round(edge_d, 2), round(lbp_e, 3), hist,
+            SpotStats(total, small, medium, large, severity, codes, circ),
+            HealthResult(round(score, 1), grade_code, status_code)
+        )
+
+
+# =============================================================================
+# MEMORY BENCHMARK
+# =============================================================================
+
+def benchmark_memory(results, copies=1000):
+    """Bytes per result held as dicts vs AnalysisRecord (tracemalloc, masks excluded)"""
+    import copy
+    import tracemalloc
+
+    plain = [{k: v for k, v in r.items() if k not in ('masks', 'resolution', 'species', 'dedup')} for r in results]
+    n = len(plain) * copies
+
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    as_dicts = [copy.deepcopy(r) for _ in range(copies) for r in plain]
+    dict_bytes = tracemalloc.get_traced_memory()[0] - base
+    del as_dicts
+
+    base = tracemalloc.get_traced_memory()[0]
+    as_records = [AnalysisRecord.from_dict(r) for _ in range(copies) for r in plain]
+    record_bytes = tracemalloc.get_traced_memory()[0] - base
+    serialized = sum(len(rec.to_bytes()) for rec in as_records[:len(plain)]) * copies
+    del as_records
+    tracemalloc.stop()
+
+    return {
+        'results': n,
+        'dict_bytes_per_result': dict_bytes / n,
+        'record_bytes_per_result': record_bytes / n,
+        'serialized_bytes_per_result': serialized / n
+    }
+
+
+if __name__ == "__main__":
+    import glob
+    import os
+    from PIL import Image
+    from plant_care_system import UltimatePlantAnalyzer
+
+    analyzer = UltimatePlantAnalyzer()
+    here = os.path.dirname(os.path.abspath(__file__))
+    sample = []
+    for path in sorted(glob.glob(os.path.join(here, "img", "*.jpg"))):
+        with Image.open(path) as img:
+            sample.append(analyzer.analyze(img.convert('RGB')))
+    copies = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    for key, value in benchmark_memory([r for r in sample if r], copies).items():
+        print(f"{key}: {value:,.0f}")
@@ -0,0 +1,232 @@
+"""
+=============================================================================
+AUTOMATIC SPECIES IDENTIFICATION
+=============================================================================
+Features:
+- Classical features only: HSV color histogram, LBP histogram, leaf shape
+- k-nearest-neighbour index built from reference images (e.g. img/)
+- Runs on a small thumbnail - a few milliseconds per image
+- Selects the species profile (care info + analysis settings) automatically
+- Rejects non-plant photos and photos too far from every reference
+  ("unknown": default analysis settings)
+=============================================================================
+"""
+
+import os
+
+import cv2
+import numpy as np
+
+from knowledge_base import PLANT_DATABASE
+
+
+THUMB_WIDTH = 160
+HUE_BINS, SAT_BINS = 18, 4
+N_SHAPE = 12
+
+# Relative influence of each feature block in the distance
+FEATURE_WEIGHTS = {"color": 1.0, "texture": 0.7, "shape": 0.5}
+
+# Analyzer attributes a species "analysis" profile may override
+HSV_KEYS = ("green_lower", "green_upper", "yellow_lower", "yellow_upper", "brown_lower", "brown_upper")
+PROFILE_KEYS = HSV_KEYS + ("status_thresholds",)
+
+# Rejection ("unknown"): measured on the reference images, same-species photos (flipped, cropped,
+# rotated, re-exposed) scored confidence >= 0.43 and stayed within 0.76 x the typical distance
+# between two different reference species; other species scored <= 0.40
+DEFAULT_MIN_CONFIDENCE = 0.42
+MAX_DISTANCE_RATIO = 0.8      # x median nearest-neighbour distance between references
+MIN_VEGETATION = 0.05         # thumbnail fraction in the plant color ranges; below = not a plant
+
+
+# =============================================================================
+# FEATURE EXTRACTION
+# =============================================================================
+
+def _thumbnail(img_bgr, width=THUMB_WIDTH):
+    h, w = img_bgr.shape[:2]
+    if w <= width:
+        return img_bgr
+    return cv2.resize(img_bgr, (width, max(1, int(h * width / w))), interpolation=cv2.INTER_AREA)
+
+
+def vegetation_mask(hsv, analyzer):
+    """Union of the analyzer's green/yellow/brown HSV ranges"""
+    mask = cv2.inRange(hsv, analyzer.green_lower, analyzer.green_upper)
+    mask |= cv2.inRange(hsv, analyzer.yellow_lower, analyzer.yellow_upper)
+    mask |= cv2.inRange(hsv, analyzer.brown_lower, analyzer.brown_upper)
+    return mask
+
+
+def shape_descriptors(mask):
+    """Hu moments + solidity/extent/aspect/circularity of the dominant leaf region"""
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    feats = np.zeros(N_SHAPE, np.float32)
+    if not contours:
+        return feats
+
+    c = max(contours, key=cv2.contourArea)
+    area = cv2.contourArea(c)
+    if area < 1:
+        return feats
+
+    hu = cv2.HuMoments(cv2.moments(c)).flatten()
+    feats[:7] = -np.sign(hu) * np.log10(np.abs(hu) + 1e-30)
+    hull_area = cv2.contourArea(cv2.convexHull(c))
+    x, y, w, h = cv2.boundingRect(c)
+    perim = cv2.arcLength(c, True)
+    feats[7] = area / (hull_area + 1e-6)                 # solidity
+    feats[8] = area / (w * h + 1e-6)                     # extent
+    feats[9] = min(w, h) / (max(w, h) + 1e-6)            # aspect
+    feats[10] = 4 * np.pi * area / (perim ** 2 + 1e-6)   # circularity
+    feats[11] = np.log1p(len(contours))                  # fragmentation (many leaves vs one)
+    return feats
+
+
+def extract_features(img_bgr, analyzer):
+    """Concatenated, block-normalised feature vector for one BGR image"""
+    return _features(img_bgr, analyzer)[0]
+
+
+def _features(img_bgr, analyzer):
+    """(feature vector, vegetation fraction of the thumbnail)"""
+    thumb = _thumbnail(img_bgr)
+    hsv = cv2.cvtColor(thumb, cv2.COLOR_BGR2HSV)
+    mask = vegetation_mask(hsv, analyzer)
+    vegetation = cv2.countNonZero(mask) / mask.size
+    if vegetation < 0.02:
+        mask = np.full(mask.shape, 255, np.uint8)
+
+    color = cv2.calcHist([hsv], [0, 1], mask, [HUE_BINS, SAT_BINS], [0, 180, 0, 256]).flatten()
+    color /= color.sum() + 1e-6
+
+    gray = cv2.cvtColor(thumb, cv2.COLOR_BGR2GRAY)
+    _, _, lbp_hist = analyzer.calculate_lbp(gray, mask)
+    texture = np.asarray(lbp_hist, np.float32) if lbp_hist else np.zeros(26, np.float32)
+
+    shape = shape_descriptors(mask)
+
+    return np.concatenate([
+        np.sqrt(color) * FEATURE_WEIGHTS["color"],      # Hellinger mapping for histograms
+        np.sqrt(texture) * FEATURE_WEIGHTS["texture"],
+        shape * FEATURE_WEIGHTS["shape"]
+    ]).astype(np.float32), vegetation
+
+
+# =============================================================================
+# NEAREST-NEIGHBOUR CLASSIFIER
+# =============================================================================
+
+class SpeciesClassifier:
+    """
+    k-NN species identification over reference feature vectors. A photo is
+    "unknown" (species None) when it has too little plant color, its vote
+    share is below `min_confidence`, or its nearest reference is farther
+    than `max_distance_ratio` x the typical distance between references.
+    """
+
+    def __init__(self, analyzer, k=3, min_confidence=DEFAULT_MIN_CONFIDENCE, max_distance_ratio=MAX_DISTANCE_RATIO):
+        self.analyzer = analyzer
+        self.k = k
+        self.min_confidence = min_confidence
+        self.max_distance_ratio = max_distance_ratio
+        self.labels = []
+        self.features = np.zeros((0, 0), np.float32)
+        self._scale = None
+        self._max_distance = np.inf
+
+    def add_reference(self, species, img_bgr):
+        vec = extract_features(img_bgr, self.analyzer)
+        self.features = vec[None, :] if not len(self.labels) else np.vstack([self.features, vec])
+        self.labels.append(species)
+        self._scale = None
+
+    def build_from_database(self, base_dir=None, database=PLANT_DATABASE):
+        """Index every plant's reference image (image_url, relative to base_dir)"""
+        base_dir = base_dir or os.path.dirname(os.path.abspath(__file__))
+        for species, info in database.items():
+            img = cv2.imread(os.path.join(base_dir, info.get('image_url', '')))
+            if img is not None:
+                self.add_reference(species, img)
+        return self
+
+    def _scaled(self, x):
+        # Shape descriptors live on a different scale from histograms; standardise per dimension
+        if self._scale is None:
+            std = self.features.std(axis=0) if len(self.labels) > 1 else np.ones(self.features.shape[1])
+            self._scale = 1.0 / np.where(std > 1e-6, std, 1.0).astype(np.float32)
+            self._ref_scaled = self.features * self._scale
+            self._max_distance = np.inf
+            labels = np.array(self.labels)
+            if len(set(self.labels)) > 1 and self.max_distance_ratio is not None:
+                ref = self._ref_scaled
+                pair = np.sqrt(((ref[:, None] - ref[None]) ** 2).sum(axis=2))
+                pair[labels[:, None] == labels[None]] = np.inf
+                self._max_distance = self.max_distance_ratio * float(np.median(pair.min(axis=1)))
+        return x * self._scale
+
+    def predict(self, img_bgr):
+        """(species or None if unknown, confidence 0-1, [(species, distance)] nearest first)"""
+        if not self.labels:
+            return None, 0.0, []
+        vec, vegetation = _features(img_bgr, self.analyzer)
+        q = self._scaled(vec)
+        d = np.sqrt(((self._ref_scaled - q) ** 2).sum(axis=1))
+        order = np.argsort(d)[:self.k]
+
+        votes = {}
+        for i in order:
+            votes[self.labels[i]] = votes.get(self.labels[i], 0.0) + 1.0 / (d[i] + 1e-6)
+        best = max(votes, key=votes.get)
+        confidence = round(float(votes[best] / sum(votes.values())), 3)
+        neighbours = [(self.labels[i], round(float(d[i]), 3)) for i in order]
+        if vegetation < MIN_VEGETATION or confidence < self.min_confidence or d[order[0]] > self._max_distance:
+            return None, confidence, neighbours
+        return best, confidence, neighbours
+
+    def save(self, path):
+        np.savez_compressed(path, features=self.features, labels=np.array(self.labels))
+
+    def load(self, path):
+        data = np.load(path)
+        self.features = data['features'].astype(np.float32)
+        self.labels = data['labels'].tolist()
+        self._scale = None
+        return self
+
+
+def apply_species_profile(analyzer, species, database=PLANT_DATABASE):
+    """
+    Apply a species' "analysis" profile (HSV bounds, status thresholds) to
+    the analyzer; keys it omits, or species None, restore the defaults.
+    """
+    defaults = analyzer.__dict__.setdefault('_default_profile', {
+        **{key: getattr(analyzer, key).copy() for key in HSV_KEYS},
+        'status_thresholds': dict(analyzer.status_thresholds)
+    })
+    profile = database.get(species, {}).get('analysis', {}) if species is not None else {}
+    for key in HSV_KEYS:
+        setattr(analyzer, key, np.array(profile[key]) if key in profile else defaults[key])
+    thresholds = dict(defaults['status_thresholds'])
+    thresholds.update({k: tuple(v) for k, v in profile.get('status_thresholds', {}).items()})
+    analyzer.status_thresholds = thresholds
+    return profile
+
+
+def identify_and_analyze(analyzer, classifier, pil_image, use_grabcut=False, min_confidence=None,
+                         pipeline=None, outputs=None):
+    """
+    Identify species, configure the analyzer for it, then run the full
+    analysis; an unknown species (name None) runs with the default settings.
+    `min_confidence` adds a stricter confidence cutoff than the classifier's own.
+    """
+    img_bgr = cv2.cvtColor(np.array(pil_image.convert('RGB')), cv2.COLOR_RGB2BGR)
+    species, confidence, neighbours = classifier.predict(img_bgr)
+    if min_confidence is not None and confidence < min_confidence:
+        species = None
+    apply_species_profile(analyzer, species)
+
+    result = analyzer.analyze(pil_image, use_grabcut, outputs, pipeline)
+    if result is not None:
+        result['species'] = {'name': species, 'confidence': confidence, 'neighbours': neighbours}
+    return result
@@ -0,0 +1,86 @@
+"""
+=============================================================================
+STAGE SCHEDULER
+=============================================================================
+Features:
+- Small DAG of analysis stages with declared dependencies
+- Independent stages run concurrently on a shared thread pool
+  (OpenCV and most NumPy kernels release the GIL)
+- Thread budgeting that cooperates with cv2.setNumThreads so batch
+  workers x stage threads x OpenCV threads does not oversubscribe cores
+=============================================================================
+"""
+
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import cv2
+
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_pool(max_workers):
+    """Process-wide thread pool per size, reused across analyses"""
+    with _POOLS_LOCK:
+        if max_workers not in _POOLS:
+            _POOLS[max_workers] = ThreadPoolExecutor(max_workers, thread_name_prefix="stage")
+        return _POOLS[max_workers]
+
+
+def configure_threads(stage_workers=1, batch_workers=1, cpu_count=None):
+    """
+    Split the machine's cores between batch processes, stage threads and
+    OpenCV's internal threads. Returns the OpenCV thread count applied.
+
+    Interactive API (one image at a time): configure_threads(stage_workers=4)
+    Batch with 8 processes:               configure_threads(1, batch_workers=8)
+    """
+    cores = cpu_count or os.cpu_count() or 1
+    cv_threads = max(1, cores // max(1, stage_workers * batch_workers))
+    cv2.setNumThreads(cv_threads)
+    return cv_threads
+
+
+class StageGraph:
+    """
+    Stages are callables receiving their dependencies' results positionally:
+
+        graph = StageGraph()
+        graph.add('gray', lambda: cv2.cvtColor(img, cv2.COLOR_BGR2GRAY))
+        graph.add('edges', lambda gray: cv2.Canny(gray, 50, 150), deps=['gray'])
+        results = graph.run(max_workers=4)
+    """
+
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, name, fn, deps=()):
+        for d in deps:
+            if d not in self.stages:
+                raise ValueError(f"Stage '{name}' depends on unknown stage '{d}'")
+        self.stages[name] = (fn, tuple(deps))
+        return self
+
+    def run(self, max_workers=1):
+        """Execute all stages; returns {stage name: result}"""
+        results = {}
+        if max_workers <= 1:
+            # Insertion order is a valid topological order (deps must exist when added)
+            for name, (fn, deps) in self.stages.items():
+                results[name] = fn(*(results[d] for d in deps))
+            return results
+
+        pool = get_pool(max_workers)
+        pending = dict(self.stages)
+        running = {}
+        while pending or running:
+            for name in [n for n, (_, deps) in pending.items() if all(d in results for d in deps)]:
+                fn, deps = pending.pop(name)
+                running[pool.submit(fn, *(results[d] for d in deps))] = name
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                results[running.pop(fut)] = fut.result()
+        return results
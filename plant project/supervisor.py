@@ -0,0 +1,320 @@
+"""
+=============================================================================
+SUPERVISED BATCH EXECUTION
+=============================================================================
+Features:
+- Each image is analyzed in a worker process under a wall-clock timeout
+  and a resident-memory (RSS) limit, both enforced from outside by the
+  supervisor (a stuck GrabCut cannot stall the batch)
+- Workers run the analyzer in strict mode: a failing stage is reported
+  with its name and reason instead of neutral zero values
+- Workers are killed and respawned on a limit breach or a crash, and
+  recycled after a fixed number of images
+- Every image yields an Outcome: a result record, or an explicit
+  failure (stage, reason) that never enters the metrics
+=============================================================================
+
+    supervisor = Supervisor(workers=4, timeout=30, max_rss_mb=1500)
+    for outcome in supervisor.run(paths):
+        if not outcome.ok:
+            print(outcome.path, outcome.stage, outcome.reason)
+"""
+
+import multiprocessing as mp
+import os
+import time
+from collections import deque
+from multiprocessing.connection import wait
+
+try:
+    import psutil
+    HAS_PSUTIL = True
+except ImportError:
+    HAS_PSUTIL = False
+
+from pipeline import RESULT_ARTIFACTS, StageError
+from results import AnalysisRecord
+
+
+DEFAULT_TIMEOUT = 60.0        # seconds per image
+DEFAULT_MAX_RSS_MB = 2048     # resident memory per worker
+DEFAULT_MAX_TASKS = 200       # images per worker process before it is replaced
+CHECK_INTERVAL = 0.1          # supervisor polling period (seconds)
+
+_STAGE_NAME_SIZE = 32
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def rss_mb(pid):
+    """Resident memory of a process in MB (None if it cannot be measured)"""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE / 2 ** 20
+    except (OSError, IndexError, ValueError):
+        pass
+    if HAS_PSUTIL:
+        try:
+            return psutil.Process(pid).memory_info().rss / 2 ** 20
+        except psutil.Error:
+            pass
+    return None
+
+
+class Outcome:
+    """Result of one image: `record` on success, otherwise the failing `stage` and `reason`"""
+
+    __slots__ = ("task_id", "path", "record", "stage", "reason", "seconds")
+
+    def __init__(self, task_id, path, record=None, stage=None, reason=None, seconds=0.0):
+        self.task_id = task_id
+        self.path = path
+        self.record = record
+        self.stage = stage
+        self.reason = reason
+        self.seconds = seconds
+
+    @property
+    def ok(self):
+        return self.record is not None
+
+    def to_dict(self):
+        out = {'task_id': self.task_id, 'path': self.path, 'ok': self.ok, 'seconds': round(self.seconds, 3)}
+        if self.ok:
+            out['result'] = self.record.to_dict()
+        else:
+            out.update({'stage': self.stage, 'reason': self.reason})
+        return out
+
+    def __repr__(self):
+        return f"Outcome({self.path!r}, ok)" if self.ok else f"Outcome({self.path!r}, {self.stage}: {self.reason})"
+
+
+# =============================================================================
+# WORKER
+# =============================================================================
+
+def _worker_main(conn, stage_name, options, max_tasks, max_rss_mb):
+    from PIL import Image
+    from plant_care_system import UltimatePlantAnalyzer
+
+    def set_stage(name):
+        stage_name.value = name.encode()[:_STAGE_NAME_SIZE - 1]
+
+    analyzer = UltimatePlantAnalyzer(strict=True)
+    analyzer.on_stage = set_stage
+    for n in range(max_tasks):
+        task = conn.recv()
+        if task is None:
+            break
+        task_id, path = task
+        start = time.perf_counter()
+        try:
+            set_stage("load")
+            with Image.open(path) as img:
+                img = img.convert('RGB')
+            result = analyzer.analyze(img, **options)
+            reply = (task_id, AnalysisRecord.from_dict(result).to_bytes(), None, None)
+        except StageError as e:
+            reply = (task_id, None, e.stage, e.reason)
+        except Exception as e:
+            reply = (task_id, None, stage_name.value.decode(), f"{type(e).__name__}: {e}")
+        set_stage("")
+        # Memory freed by a huge image is not always returned to the OS: start fresh. The reply
+        # says so, so the supervisor never sends the next task to a worker on its way out.
+        rss = rss_mb(os.getpid())
+        exiting = n + 1 >= max_tasks or bool(max_rss_mb and rss is not None and rss > max_rss_mb)
+        conn.send(reply + (time.perf_counter() - start, exiting))
+        if exiting:
+            break
+    conn.close()
+
+
+class _Slot:
+    """One worker process and the task it is running"""
+
+    def __init__(self, ctx, options, max_tasks, max_rss_mb):
+        self.conn, child = ctx.Pipe()
+        self.stage_name = ctx.Array('c', _STAGE_NAME_SIZE)
+        self.process = ctx.Process(target=_worker_main,
+                                   args=(child, self.stage_name, options, max_tasks, max_rss_mb), daemon=True)
+        self.process.start()
+        child.close()
+        self.max_tasks = max_tasks
+        self.tasks = 0
+        self.task = None
+        self.started = 0.0
+        self.exiting = False
+
+    @property
+    def stage(self):
+        return self.stage_name.value.decode() or None
+
+    @property
+    def spent(self):
+        """True once the worker has exited or announced that it is exiting"""
+        return self.exiting or self.tasks >= self.max_tasks or not self.process.is_alive()
+
+    def send(self, task):
+        self.task = task
+        self.started = None
+        self.conn.send(task)
+
+    def running_for(self):
+        """Seconds since the worker picked up its task (a fresh worker is still importing before that)"""
+        if self.started is None:
+            if self.stage is None:
+                return 0.0
+            self.started = time.perf_counter()
+        return time.perf_counter() - self.started
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def stop(self):
+        if self.process.is_alive():
+            try:
+                self.conn.send(None)
+            except OSError:
+                pass
+            self.process.join(timeout=5)
+            if self.process.is_alive():
+                self.process.kill()
+                self.process.join()
+        self.conn.close()
+
+
+# =============================================================================
+# SUPERVISOR
+# =============================================================================
+
+class Supervisor:
+    """
+    Runs images through `workers` supervised processes. `stats` counts
+    recycled workers, kills by cause (timeout / memory / crash) and requeued tasks.
+    """
+
+    def __init__(self, workers=None, timeout=DEFAULT_TIMEOUT, max_rss_mb=DEFAULT_MAX_RSS_MB,
+                 max_tasks=DEFAULT_MAX_TASKS, use_grabcut=False, outputs=RESULT_ARTIFACTS, max_size=(800, 600),
+                 start_method=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.max_rss_mb = max_rss_mb
+        self.max_tasks = max_tasks
+        self.options = {'use_grabcut': use_grabcut, 'outputs': outputs, 'max_size': max_size}
+        self.ctx = mp.get_context(start_method)
+        self.stats = {'recycled': 0, 'timeout': 0, 'memory': 0, 'crashed': 0, 'requeued': 0}
+
+    def _spawn(self):
+        return _Slot(self.ctx, self.options, self.max_tasks, self.max_rss_mb)
+
+    def _failure(self, slot, reason):
+        task_id, path = slot.task
+        return Outcome(task_id, path, stage=slot.stage, reason=reason, seconds=slot.running_for())
+
+    def run(self, paths):
+        """Generator of one Outcome per path, in completion order (task_id = index in `paths`)"""
+        from stage_scheduler import configure_threads
+
+        configure_threads(1, batch_workers=self.workers)
+        tasks = deque(enumerate(paths))
+        requeued = set()
+        slots = [self._spawn() for _ in range(min(self.workers, len(tasks)))]
+        try:
+            while tasks or any(s.task is not None for s in slots):
+                for i, slot in enumerate(slots):
+                    if slot.task is None and tasks:
+                        if slot.spent:
+                            slot.stop()
+                            self.stats['recycled'] += 1
+                            slots[i] = slot = self._spawn()
+                        task = tasks.popleft()
+                        try:
+                            slot.send(task)
+                        except OSError:
+                            # Worker gone between tasks (BrokenPipeError): replace it, the task is not charged
+                            slot.kill()
+                            self.stats['recycled'] += 1
+                            slots[i] = slot = self._spawn()
+                            slot.send(task)
+                        slot.tasks += 1
+
+                busy = [s for s in slots if s.task is not None]
+                ready = wait([s.conn for s in busy], timeout=CHECK_INTERVAL)
+                for i, slot in enumerate(slots):
+                    if slot.task is None:
+                        continue
+                    if slot.conn in ready:
+                        try:
+                            task_id, data, stage, reason, seconds, exiting = slot.conn.recv()
+                        except (EOFError, OSError):
+                            slot.process.join()
+                            if slot.process.exitcode == 0 and slot.task[0] not in requeued:
+                                # Clean exit before it took the task: run it elsewhere, once
+                                requeued.add(slot.task[0])
+                                tasks.appendleft(slot.task)
+                                self.stats['requeued'] += 1
+                            else:
+                                yield self._failure(slot, f"worker died (exit code {slot.process.exitcode})")
+                                self.stats['crashed'] += 1
+                            slots[i] = self._spawn()
+                            continue
+                        path = slot.task[1]
+                        slot.task = None
+                        slot.exiting = exiting
+                        if data is None:
+                            yield Outcome(task_id, path, stage=stage, reason=reason, seconds=seconds)
+                        else:
+                            yield Outcome(task_id, path, AnalysisRecord.from_bytes(data), seconds=seconds)
+                        continue
+
+                    # Still running: enforce the limits from outside
+                    elapsed = slot.running_for()
+                    rss = rss_mb(slot.process.pid) if self.max_rss_mb else None
+                    if elapsed > self.timeout:
+                        cause, reason = 'timeout', f"timeout after {elapsed:.1f} s"
+                    elif rss is not None and rss > self.max_rss_mb:
+                        cause, reason = 'memory', f"memory limit: {rss:.0f} MB > {self.max_rss_mb} MB"
+                    else:
+                        continue
+                    outcome = self._failure(slot, reason)
+                    slot.kill()
+                    self.stats[cause] += 1
+                    slots[i] = self._spawn()
+                    yield outcome
+        finally:
+            for slot in slots:
+                slot.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Supervised batch analysis with per-image limits")
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("-w", "--workers", type=int, default=None)
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help="seconds per image")
+    parser.add_argument("--max-rss", type=float, default=DEFAULT_MAX_RSS_MB, help="MB per worker")
+    parser.add_argument("--max-tasks", type=int, default=DEFAULT_MAX_TASKS, help="images per worker process")
+    parser.add_argument("--grabcut", action="store_true")
+    parser.add_argument("-o", "--output", help="write all outcomes as JSON lines")
+    args = parser.parse_args()
+
+    sup = Supervisor(args.workers, args.timeout, args.max_rss, args.max_tasks, args.grabcut)
+    ok = failed = 0
+    out = open(args.output, "w") if args.output else None
+    try:
+        for o in sup.run(args.images):
+            if o.ok:
+                ok += 1
+            else:
+                failed += 1
+                print(f"FAILED {o.path}: [{o.stage}] {o.reason}")
+            if out:
+                out.write(json.dumps(o.to_dict(), default=float) + "\n")
+    finally:
+        if out:
+            out.close()
+    print(f"{ok} analyzed, {failed} failed; workers {sup.stats}")
@@ -0,0 +1,349 @@
+"""
+=============================================================================
+SYNTHETIC LEAF IMAGES WITH GROUND TRUTH
+=============================================================================
+Features:
+- Deterministic, seedable scenes: image i of generator seed s is always
+  the same, so any image can be re-rendered from (seed, index) alone
+- Leaf-shaped regions with controllable yellow (chlorosis) fraction and
+  brown spot count, sizes and circularities
+- Textured low-saturation backgrounds, leaf veins and sensor noise
+- Ground truth in the fields of analyze(): ratios, spots (small / medium /
+  large, types with circularity, severity), the health status key and
+  optionally the per-class masks
+- Rendered in memory on the fly (stream()); write_dataset() produces an
+  evaluation.py dataset when files are wanted
+=============================================================================
+
+    gen = LeafSceneGenerator(seed=7, spots=(0, 20))
+    for image, truth in gen.stream(1_000_000):
+        result = analyzer.analyze(image)
+        ...
+"""
+
+import json
+import os
+
+import cv2
+import numpy as np
+
+from grading import HEALTH_STATUSES, classify_health, classify_spot, spot_severity
+
+
+# Label values of the ground-truth class map
+BACKGROUND, GREEN, YELLOW, BROWN = 0, 1, 2, 3
+_VEIN = 4                          # render-only paint class (green tissue)
+
+# OpenCV HSV ranges (H 0-180) each class is drawn from, well inside the analyzer's bands
+CLASS_HSV = {
+    GREEN: ((45, 72), (110, 220), (80, 190)),
+    YELLOW: ((24, 31), (130, 230), (150, 225)),
+    BROWN: ((12, 18), (110, 200), (60, 140))
+}
+BACKGROUND_MAX_SATURATION = 25     # below the analyzer's S >= 40: never counted as leaf color
+
+MIN_SPOT_AREA = 20                 # analyze_disease_spots ignores smaller contours
+SPOT_GAP = 4                       # minimum pixels between spots and to the leaf edge
+
+_STATUS_KEYS = {text: key for key, text in HEALTH_STATUSES.items()}
+
+
+def _uniform(rng, bounds):
+    lo, hi = bounds
+    return rng.uniform(lo, hi)
+
+
+def _smooth_noise(rng, shape, cell):
+    """Low-frequency noise in [0, 1] (random grid upsampled with bicubic interpolation)"""
+    h, w = shape
+    grid = rng.random((max(2, h // cell + 2), max(2, w // cell + 2))).astype(np.float32)
+    return np.clip(cv2.resize(grid, (w, h), interpolation=cv2.INTER_CUBIC), 0, 1)
+
+
+def circularity(contour):
+    perim = cv2.arcLength(contour, True)
+    return 4 * np.pi * cv2.contourArea(contour) / perim ** 2 if perim > 0 else 0.0
+
+
+# =============================================================================
+# GROUND TRUTH
+# =============================================================================
+
+def truth_from_labels(labels, include_masks=False):
+    """analyze()-style ground truth of a class map (ratios over the whole frame, like analyze without GrabCut)"""
+    total = labels.size
+    counts = np.bincount(labels.ravel(), minlength=4)
+    ratios = {
+        'green': round(counts[GREEN] / total * 100, 2),
+        'yellow': round(counts[YELLOW] / total * 100, 2),
+        'brown': round(counts[BROWN] / total * 100, 2)
+    }
+
+    spots = {'total': 0, 'small': 0, 'medium': 0, 'large': 0, 'types': [], 'severity': 0}
+    contours, _ = cv2.findContours((labels == BROWN).astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    for c in contours:
+        area = cv2.contourArea(c)
+        if area < MIN_SPOT_AREA:
+            continue
+        size, spot_type = classify_spot(area, cv2.arcLength(c, True))
+        spots['total'] += 1
+        spots[size] += 1
+        if spot_type:
+            spots['types'].append(spot_type)
+    spots['severity'] = spot_severity(spots)
+
+    health = classify_health(ratios['green'], ratios['yellow'], ratios['brown'], spots, 0.0)
+    truth = {'ratios': ratios, 'spots': spots, 'label': _STATUS_KEYS[health['status']]}
+    if include_masks:
+        truth['masks'] = {'g': labels == GREEN, 'y': labels == YELLOW, 'b': labels == BROWN}
+    return truth
+
+
+# =============================================================================
+# GENERATOR
+# =============================================================================
+
+class LeafSceneGenerator:
+    """
+    Random leaf scenes. Every range is (low, high), sampled per image:
+    `coverage` fraction of the frame covered by leaves, `yellow` fraction of
+    leaf area turned chlorotic, `spots` number of brown spots, `spot_area`
+    spot size in pixels and `spot_circularity` the accepted 4*pi*A/P^2 of
+    each spot. `noise` is the sensor noise sigma (RGB levels).
+    """
+
+    def __init__(self, seed=0, size=(800, 600), leaves=(1, 4), coverage=(0.25, 0.7), yellow=(0.0, 0.3),
+                 spots=(0, 12), spot_area=(40, 1200), spot_circularity=(0.3, 1.0), noise=(0.0, 4.0),
+                 include_masks=False):
+        self.seed = seed
+        self.size = size
+        self.leaves = leaves
+        self.coverage = coverage
+        self.yellow = yellow
+        self.spots = spots
+        self.spot_area = spot_area
+        self.spot_circularity = spot_circularity
+        self.noise = noise
+        self.include_masks = include_masks
+
+    def rng(self, index):
+        return np.random.default_rng([self.seed, index])
+
+    def render(self, index):
+        """(RGB uint8 image, ground truth dict) of scene `index`"""
+        image, labels = self.render_labels(index)
+        return image, truth_from_labels(labels, self.include_masks)
+
+    def render_labels(self, index):
+        """(RGB uint8 image, class map) of scene `index`"""
+        rng = self.rng(index)
+        w, h = self.size
+        labels = np.zeros((h, w), np.uint8)
+        veins = np.zeros((h, w), np.uint8)
+
+        n_leaves = int(rng.integers(self.leaves[0], self.leaves[1] + 1))
+        leaf_area = _uniform(rng, self.coverage) * w * h / n_leaves
+        for _ in range(n_leaves):
+            self._draw_leaf(rng, labels, veins, leaf_area)
+        leaf = labels == GREEN
+
+        self._draw_chlorosis(rng, labels, leaf, _uniform(rng, self.yellow))
+        self._draw_spots(rng, labels, leaf, int(rng.integers(self.spots[0], self.spots[1] + 1)))
+
+        return self._colorize(rng, labels, veins), labels
+
+    def stream(self, n=None, start=0):
+        """Yield (image, truth) for indices start, start + 1, ... (endless when n is None)"""
+        index = start
+        while n is None or index < start + n:
+            yield self.render(index)
+            index += 1
+
+    def __iter__(self):
+        return self.stream()
+
+    # -------------------------------------------------------------------------
+    # Shapes
+    # -------------------------------------------------------------------------
+
+    def _draw_leaf(self, rng, labels, veins, area):
+        h, w = labels.shape
+        aspect = rng.uniform(1.6, 3.0)                  # length / width
+        # Ellipse-like outline of the requested area: pi / 4 * L * W = area
+        length = np.sqrt(4 * area * aspect / np.pi)
+        width = length / aspect
+        angle = rng.uniform(0, np.pi)
+        cx, cy = rng.uniform(0.2, 0.8) * w, rng.uniform(0.2, 0.8) * h
+
+        t = np.linspace(0, 2 * np.pi, 180, endpoint=False)
+        # Egg-shaped blade with a pointed tip and a slightly serrated margin
+        x = length / 2 * np.cos(t)
+        y = width / 2 * np.sin(t) * (1 - 0.35 * np.cos(t)) * (1 + 0.02 * np.sin(24 * t))
+        tip = np.abs(np.cos(t)) ** 8 * (np.cos(t) > 0)
+        y *= 1 - 0.6 * tip
+        ca, sa = np.cos(angle), np.sin(angle)
+        pts = np.stack([cx + x * ca - y * sa, cy + x * sa + y * ca], axis=1).round().astype(np.int32)
+        cv2.fillPoly(labels, [pts], GREEN)
+
+        # Midrib and side veins (drawn darker, same class)
+        base = (int(cx - length / 2 * ca), int(cy - length / 2 * sa))
+        apex = (int(cx + length / 2 * ca), int(cy + length / 2 * sa))
+        thickness = max(1, int(width / 40))
+        cv2.line(veins, base, apex, 255, thickness + 1)
+        for s in np.linspace(-0.35, 0.35, 6):
+            px, py = cx + s * length * ca, cy + s * length * sa
+            for side in (-1, 1):
+                dx, dy = 0.3 * length * ca - side * 0.4 * width * sa, 0.3 * length * sa + side * 0.4 * width * ca
+                cv2.line(veins, (int(px), int(py)), (int(px + dx * 0.5), int(py + dy * 0.5)), 255, thickness)
+
+    def _draw_chlorosis(self, rng, labels, leaf, fraction):
+        """Yellow blotches inside the leaves until `fraction` of the leaf area is yellow"""
+        leaf_px = int(leaf.sum())
+        if fraction <= 0 or leaf_px == 0:
+            return
+        target = fraction * leaf_px
+        ys, xs = np.nonzero(leaf)
+        blotch = np.zeros_like(labels)
+        for _ in range(200):
+            i = rng.integers(len(xs))
+            r = rng.uniform(0.03, 0.12) * np.sqrt(leaf_px)
+            axes = (max(2, int(r)), max(2, int(r * rng.uniform(0.4, 1.0))))
+            cv2.ellipse(blotch, (int(xs[i]), int(ys[i])), axes, rng.uniform(0, 180), 0, 360, 1, -1)
+            if np.count_nonzero(blotch & leaf) >= target:
+                break
+        labels[(blotch > 0) & leaf] = YELLOW
+
+    def _spot_shape(self, rng, area):
+        """Contour (centred on 0, 0) of a spot with the requested area and an accepted circularity"""
+        lo, hi = self.spot_circularity
+        best = None
+        for _ in range(20):
+            # Lobed, stretched outline: lobes and elongation lower the circularity
+            lobes = int(rng.integers(3, 9))
+            amplitude = rng.uniform(0.0, 0.5)
+            stretch = rng.uniform(1.0, 3.0)
+            t = np.linspace(0, 2 * np.pi, 96, endpoint=False)
+            r = 1 + amplitude * np.sin(lobes * t + rng.uniform(0, 2 * np.pi))
+            x, y = r * np.cos(t) * stretch, r * np.sin(t)
+            scale = np.sqrt(area / max(cv2.contourArea(np.stack([x, y], 1).astype(np.float32)), 1e-6))
+            theta = rng.uniform(0, np.pi)
+            c, s = np.cos(theta), np.sin(theta)
+            pts = np.stack([(x * c - y * s) * scale, (x * s + y * c) * scale], 1)
+            circ = circularity(pts.astype(np.float32))
+            if lo <= circ <= hi:
+                return pts
+            if best is None or abs(circ - (lo + hi) / 2) < best[0]:
+                best = (abs(circ - (lo + hi) / 2), pts)
+        return best[1]
+
+    def _draw_spots(self, rng, labels, leaf, count):
+        """Brown spots fully inside leaf tissue, separated from each other"""
+        if count == 0 or not leaf.any():
+            return
+        room = cv2.distanceTransform(leaf.astype(np.uint8), cv2.DIST_L2, 5)
+        ys, xs = np.nonzero(leaf)
+        for _ in range(count):
+            area = _uniform(rng, self.spot_area)
+            pts = self._spot_shape(rng, area)
+            extent = int(np.ceil(np.abs(pts).max())) + SPOT_GAP
+            # Rejection-sample a leaf pixel with enough room instead of searching the frame per spot
+            for i in rng.integers(len(xs), size=100):
+                cx, cy = int(xs[i]), int(ys[i])
+                if room[cy, cx] > extent:
+                    break
+            else:
+                continue
+            poly = (pts + (cx, cy)).round().astype(np.int32)
+            cv2.fillPoly(labels, [poly], BROWN)
+            # Reserve the spot plus a gap so later spots never touch it
+            cv2.circle(room, (cx, cy), 2 * extent, 0, -1)
+
+    # -------------------------------------------------------------------------
+    # Rendering
+    # -------------------------------------------------------------------------
+
+    def _colorize(self, rng, labels, veins):
+        h, w = labels.shape
+        # Paint classes: the label classes plus darker green for veins
+        paint = labels.copy()
+        paint[(veins > 0) & (labels == GREEN)] = _VEIN
+
+        # Per-class base color, modulation amplitude and bounds as 256-entry tables,
+        # applied to the paint map with cv2.LUT (one table lookup per pixel and channel)
+        base = np.zeros((256, 3), np.float32)
+        amp = np.zeros((256, 3), np.float32)
+        lo = np.zeros((256, 3), np.uint8)
+        hi = np.tile(np.uint8([179, 255, 255]), (256, 1))
+        # Background: low-saturation texture (soil, bench, wall)
+        bg_sat = rng.uniform(0, BACKGROUND_MAX_SATURATION / 1.5)
+        base[BACKGROUND] = (rng.uniform(0, 180), bg_sat, rng.uniform(90, 200))
+        amp[BACKGROUND] = (0, bg_sat, 50)
+        for cls, ranges in CLASS_HSV.items():
+            base[cls] = [rng.uniform(*r) for r in ranges]
+            amp[cls] = (2, 30, 40)
+            lo[cls], hi[cls] = zip(*ranges)
+        base[_VEIN], amp[_VEIN], lo[_VEIN], hi[_VEIN] = base[GREEN] * (1, 1, 0.8), amp[GREEN], lo[GREEN], hi[GREEN]
+        lo[_VEIN, 2] = 0
+
+        def lookup(table):
+            return cv2.LUT(cv2.merge([paint] * 3), table.reshape(1, 256, 3))
+
+        # Modulation field in [-0.5, 0.5]: coarse texture on the background, finer mottling on leaves
+        texture = _smooth_noise(rng, (h, w), int(rng.integers(20, 80)))
+        mottle = _smooth_noise(rng, (h, w), int(rng.integers(8, 30)))
+        field = np.where(labels == BACKGROUND, texture, mottle) - np.float32(0.5)
+        hsv = cv2.add(lookup(base), cv2.multiply(lookup(amp), cv2.merge([field] * 3)), dtype=cv2.CV_8U)
+        hsv = cv2.max(cv2.min(hsv, lookup(hi)), lookup(lo))
+
+        rgb = cv2.cvtColor(hsv, cv2.COLOR_HSV2RGB)
+        sigma = _uniform(rng, self.noise)
+        if sigma > 0:
+            # From the scene's own generator: OpenCV's RNG is global (GrabCut uses it too)
+            noise = rng.standard_normal((h, w, 3), dtype=np.float32)
+            noise *= np.float32(sigma)
+            rgb = cv2.add(rgb, noise, dtype=cv2.CV_8U)
+        return rgb
+
+    # -------------------------------------------------------------------------
+    # Files
+    # -------------------------------------------------------------------------
+
+    def write_dataset(self, root, n, start=0):
+        """PNG images, masks and labels.json in the layout evaluation.load_dataset() reads"""
+        os.makedirs(os.path.join(root, "masks"), exist_ok=True)
+        labels = {}
+        for index in range(start, start + n):
+            image, class_map = self.render_labels(index)
+            truth = truth_from_labels(class_map, include_masks=True)
+            name = f"synthetic_{self.seed}_{index:07d}"
+            cv2.imwrite(os.path.join(root, name + ".png"), cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+            masks = {}
+            for key, cls in (("g", GREEN), ("y", YELLOW), ("b", BROWN)):
+                masks[key] = f"masks/{name}_{key}.png"
+                cv2.imwrite(os.path.join(root, masks[key]), (class_map == cls).astype(np.uint8) * 255)
+            labels[name + ".png"] = {"label": truth['label'], "masks": masks,
+                                     "ratios": truth['ratios'], "spots": truth['spots']}
+        with open(os.path.join(root, "labels.json"), "w", encoding="utf-8") as f:
+            json.dump(labels, f, indent=1)
+        return len(labels)
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Render synthetic leaf scenes with ground truth")
+    parser.add_argument("-n", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="write an evaluation dataset here (otherwise only benchmark rendering)")
+    args = parser.parse_args()
+
+    gen = LeafSceneGenerator(seed=args.seed)
+    start = time.perf_counter()
+    if args.output:
+        gen.write_dataset(args.output, args.n)
+    else:
+        for _ in gen.stream(args.n):
+            pass
+    elapsed = time.perf_counter() - start
+    print(f"{args.n} scenes in {elapsed:.2f} s ({args.n / elapsed:.0f} scenes/s)")